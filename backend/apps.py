@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.core.checks import Tags, register
+from django.db.backends.signals import connection_created
 
 
 class BackendConfig(AppConfig):
     # default_auto_field = 'django.db.models.BigAutoField'
     name = 'backend'
+
+    def ready(self):
+        from backend.checks import check_hot_trigger
+        from backend.middleware import record_queries
+
+        connection_created.connect(record_queries)
+        register(check_hot_trigger, Tags.database)
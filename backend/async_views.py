@@ -0,0 +1,146 @@
+import asyncio
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.request import Request
+
+from backend.cache import aget_post
+from backend.encoders import COMMENT_ROW, COMMENT_WITH_POST_ROW, dumps, post_detail
+from backend.metrics import record_fallback
+from backend.models import Comment
+from backend.response_cache import acached_response
+from backend.snapshots import aget_ranking
+from backend.streaming import STREAM_UNSUPPORTED_MESSAGE
+from backend.versions import aconditional_get
+from backend.views import PostsView
+
+"""
+Async read path.
+Async versions of the ranked posts list, the post and the subtree endpoints, served under api/v1/async/ by the ASGI
+application. Redis is read with an asyncio client and Postgres with the async ORM, independent lookups run
+concurrently, and responses are encoded by the row encoders of the fast read path, so a slow client holds a
+coroutine instead of a worker thread while it is served. Their responses are the same as the ones of the sync views,
+and the post and the subtree endpoints answer conditional GETs and share the response cache with them.
+"""
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def response_cache_enabled(version):
+    """
+    Responses of the async views are always JSON, so they are cached like the JSON responses of the sync views
+    """
+    return settings.RESPONSE_CACHE_ENABLED and version is not None
+
+
+async def fetch_rows(queryset):
+    return [row async for row in queryset]
+
+
+class AsyncAPIView(View):
+    """
+    Errors of the request are returned like the exception handler of rest framework does
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as error:
+            detail = error.detail if isinstance(error.detail, (list, dict)) else {'detail': error.detail}
+            return json_response(detail, status=error.status_code)
+
+
+class AsyncPostsView(AsyncAPIView):
+    """
+    Get top posts from the snapshot of their ranking in redis.
+    Next pages and new posts are read by PostsView, in a thread.
+    """
+
+    async def get(self, request):
+        view = PostsView(request=Request(request), args=(), kwargs={}, format_kwarg=None)
+        limit, sort = view.get_ranking_params()
+
+        if not view.first_page_ranked():
+            response = await sync_to_async(view.list)(view.request)
+            return json_response(response.data)
+
+        top_posts = []
+        try:
+            # One more post tells the paginator whether there is a next page
+            top_posts = await aget_ranking(sort, limit + 1)
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.BusyLoadingError):
+            record_fallback('ranking')
+
+        if len(top_posts):
+            page = view.paginate_queryset(top_posts)
+            return json_response(view.get_paginated_response(page).data)
+
+        response = await sync_to_async(view.list_from_database)(view.request)
+
+        return json_response(response.data)
+
+
+class AsyncPostView(AsyncAPIView):
+    """
+    Get a post by its id, the post and its comments are read at the same time
+    """
+
+    @aconditional_get
+    async def get(self, request, post_id):
+        if 'stream' in request.GET:
+            raise ValidationError({'stream': STREAM_UNSUPPORTED_MESSAGE})
+
+        if response_cache_enabled(self.post_version):
+            return await acached_response(post_id, 'post', self.post_version, lambda: self.get_data(post_id))
+
+        data = await self.get_data(post_id)
+
+        if data is None:
+            return json_response({'code': 'not_found', 'message': 'Post not found'}, status=404)
+
+        return json_response(data)
+
+    async def get_data(self, post_id):
+        post, comments = await asyncio.gather(
+            aget_post(post_id),
+            fetch_rows(COMMENT_ROW.values_list(Comment.objects.filter(post_id=post_id))),
+        )
+
+        return None if post is None else post_detail(post, COMMENT_ROW.encode(comments))
+
+
+class AsyncNestedCommentsView(AsyncAPIView):
+    """
+    Get a comment and its replies, the post and the tree path of the comment are read at the same time
+    """
+
+    @aconditional_get
+    async def get(self, request, post_id, comment_id):
+        post, tree_path = await asyncio.gather(
+            aget_post(post_id),
+            Comment.objects.filter(post_id=post_id, id=comment_id).values_list('tree_path', flat=True).afirst(),
+        )
+
+        if post is None:
+            return json_response({'code': 'post_not_found', 'message': 'Post not found'}, status=404)
+
+        if tree_path is None:
+            return json_response({'code': 'comment_not_found', 'message': 'Comment not found'}, status=404)
+
+        if response_cache_enabled(self.post_version):
+            return await acached_response(post_id, f'subtree:{comment_id}', self.post_version,
+                                          lambda: self.get_subtree_data(post_id, tree_path))
+
+        return json_response(await self.get_subtree_data(post_id, tree_path))
+
+    async def get_subtree_data(self, post_id, tree_path):
+        subtree = Comment.objects.filter(post_id=post_id, tree_path__startswith=tree_path).order_by('tree_path')
+
+        return COMMENT_WITH_POST_ROW.encode(await fetch_rows(COMMENT_WITH_POST_ROW.values_list(subtree)))
@@ -0,0 +1,268 @@
+import asyncio
+import math
+import random
+import time
+from urllib.parse import urlsplit
+
+from django.db import connection
+from django.db.models.functions import Length
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from backend.cron import flush_comment_counts
+from backend.models import Comment, Post
+from backend.paths import SEGMENT_WIDTH
+
+"""
+Benchmarks of the endpoints and background jobs.
+Every scenario runs in-process through the whole stack, views, database and redis, on the current database. Each run
+is measured for its latency, its number of queries and the rows it touches, the difference of the counters of
+pg_stat_user_tables around it. Runs are not wrapped in a transaction, so the transactions of the views commit and
+their commits are measured.
+"""
+ROWS_TOUCHED_QUERY = "select coalesce(sum(seq_tup_read + coalesce(idx_tup_fetch, 0) + n_tup_ins + n_tup_upd + " \
+                     "n_tup_del), 0) from pg_stat_user_tables where schemaname = 'public' " \
+                     "and relname in ('posts', 'comments')"
+
+# Comments created before each run of the flush scenario
+FLUSH_COMMENTS = 10
+
+
+def rows_touched():
+    """
+    Rows read and written in posts and comments tables by all connections. The counters of this connection are
+    flushed to the statistics once it is idle after pg_stat_force_next_flush(), and the statistics cached by the
+    previous read are cleared.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("select pg_stat_force_next_flush()")
+        cursor.execute("select pg_stat_clear_snapshot()")
+        cursor.execute(ROWS_TOUCHED_QUERY)
+        return int(cursor.fetchone()[0])
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+class Sample:
+    """
+    Posts and root comments picked at random to be requested by the scenarios
+    """
+
+    def __init__(self, rng, size=1000):
+        self.rng = rng
+        self.post_ids = list(Post.objects.order_by('?').values_list('id', flat=True)[:size])
+        self.comments = list(Comment.objects.filter(post_id__in=self.post_ids).
+                             alias(path_length=Length('tree_path')).filter(path_length=SEGMENT_WIDTH).
+                             values_list('post_id', 'id')[:size])
+
+    def post_id(self):
+        return self.rng.choice(self.post_ids)
+
+    def comment(self):
+        return self.rng.choice(self.comments)
+
+
+def hot_list(client, sample):
+    return lambda: client.get('/api/v1/posts?sort=hot')
+
+
+def post_detail(client, sample):
+    return lambda: client.get(f'/api/v1/posts/{sample.post_id()}')
+
+
+def subtree(client, sample):
+    def run():
+        post_id, comment_id = sample.comment()
+        return client.get(f'/api/v1/posts/{post_id}/comments/{comment_id}')
+
+    return run
+
+
+def comment_create(client, sample):
+    return lambda: client.post(f'/api/v1/posts/{sample.post_id()}/comments', {'body': 'Benchmark comment'},
+                               'application/json')
+
+
+def flush(client, sample):
+    return flush_comment_counts
+
+
+def before_flush(client, sample):
+    for _ in range(FLUSH_COMMENTS):
+        client.post(f'/api/v1/posts/{sample.post_id()}/comments', {'body': 'Benchmark comment'}, 'application/json')
+
+
+# Scenarios: name -> (run factory, setup run before every measured run)
+SCENARIOS = {
+    'hot_list': (hot_list, None),
+    'post_detail': (post_detail, None),
+    'subtree': (subtree, None),
+    'comment_create': (comment_create, None),
+    'flush': (flush, before_flush),
+}
+
+
+def run_scenario(name, sample, iterations, warmup):
+    """
+    Latency percentiles in milliseconds, queries and rows touched per run of a scenario
+    """
+    client = Client()
+    factory, setup = SCENARIOS[name]
+    run = factory(client, sample)
+
+    latencies = []
+    queries = []
+    rows = []
+    for iteration in range(warmup + iterations):
+        if setup is not None:
+            setup(client, sample)
+
+        rows_before = rows_touched()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        rows_after = rows_touched()
+
+        if iteration >= warmup:
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured))
+            rows.append(rows_after - rows_before)
+
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'queries': round(sum(queries) / len(queries), 2),
+        'rows_touched': round(sum(rows) / len(rows), 1),
+    }
+
+
+def run_benchmark(scenarios, iterations, warmup, seed):
+    sample = Sample(random.Random(seed))
+    # Posts without comments have no subtree to read
+    scenarios = [name for name in scenarios if name != 'subtree' or sample.comments]
+
+    return {
+        'posts': Post.objects.count(),
+        'comments': Comment.objects.count(),
+        'scenarios': {name: run_scenario(name, sample, iterations, warmup) for name in scenarios},
+    }
+
+
+def regressions(results, baseline, threshold):
+    """
+    Scenarios slower than their baseline at the same dataset size by more than `threshold` at p95,
+    or running more queries
+    """
+    baseline_runs = {run['posts']: run for run in baseline['runs']}
+    found = []
+
+    for run in results['runs']:
+        baseline_run = baseline_runs.get(run['posts'])
+        if baseline_run is None:
+            continue
+
+        for name, result in run['scenarios'].items():
+            expected = baseline_run['scenarios'].get(name)
+            if expected is None:
+                continue
+            if result['p95_ms'] > expected['p95_ms'] * (1 + threshold):
+                found.append(f"{name} at {run['posts']} posts: p95 {result['p95_ms']}ms, "
+                             f"baseline {expected['p95_ms']}ms")
+            if result['queries'] > expected['queries']:
+                found.append(f"{name} at {run['posts']} posts: {result['queries']} queries, "
+                             f"baseline {expected['queries']}")
+
+    return found
+
+
+"""
+Load test of a running server, e.g. the WSGI and the ASGI deployments, by many concurrent HTTP/1.1 clients.
+A slow client sends the headers of its request `client_delay` seconds after its request line, like a client on a slow
+network: a sync worker waits for it while an async worker serves other requests meanwhile.
+"""
+ASYNC_PREFIX = '/api/v1/async/'
+
+LOAD_PATHS = {
+    'hot_list': lambda sample: '/api/v1/posts?sort=hot',
+    'post_detail': lambda sample: f'/api/v1/posts/{sample.post_id()}',
+    'subtree': lambda sample: '/api/v1/posts/{}/comments/{}'.format(*sample.comment()),
+}
+
+
+def load_paths(endpoints, total_requests, sample):
+    """
+    Paths of the sync endpoints requested by a load test, the async ones are the same under ASYNC_PREFIX
+    """
+    # Posts without comments have no subtree to read
+    endpoints = [name for name in endpoints if name != 'subtree' or sample.comments]
+
+    return [LOAD_PATHS[endpoints[index % len(endpoints)]](sample) for index in range(total_requests)]
+
+
+def async_path(path):
+    return path.replace('/api/v1/', ASYNC_PREFIX, 1)
+
+
+async def http_get(host, port, path, client_delay):
+    """
+    Status of a GET request, read until the server closes the connection
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\n'.encode())
+        await writer.drain()
+        if client_delay:
+            await asyncio.sleep(client_delay)
+        writer.write(f'Host: {host}\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+
+    return int(response.split(b' ', 2)[1])
+
+
+async def load_test(url, paths, concurrency, client_delay):
+    """
+    Throughput and latency percentiles in milliseconds of `paths` requested by `concurrency` clients at a time.
+    Requests failing or answered with a server error are counted as errors.
+    """
+    target = urlsplit(url)
+    pending = iter(paths)
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        for path in pending:
+            start = time.perf_counter()
+            try:
+                status = await http_get(target.hostname, target.port or 80, path, client_delay)
+            except (OSError, ValueError, IndexError):
+                status = None
+            if status is None or status >= 500:
+                errors += 1
+            else:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    result = {'requests': len(paths), 'errors': errors, 'requests_per_second': round(len(latencies) / elapsed, 1)}
+    for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        result[name] = round(percentile(latencies, fraction), 3) if latencies else None
+
+    return result
+
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+from backend.models import Post
+from backend.redis_client import pubsub_client, redis_client
+
+"""
+In-process cache of the ranked posts lists and of posts metadata.
+Each worker keeps its own LRU cache with a TTL. Keys invalidated through invalidate() are dropped by every worker,
+which listen to INVALIDATION_CHANNEL in a background thread.
+"""
+INVALIDATION_CHANNEL = 'cache:invalidate'
+RANKING_CACHE_KEY = 'ranking:{sort}'
+POST_CACHE_KEY = 'post:{post_id}'
+
+
+class LocalCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._items[key] = (expires_at, value)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+local_cache = LocalCache(settings.LOCAL_CACHE_MAX_SIZE, settings.LOCAL_CACHE_TTL)
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = pubsub_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+
+            # Invalidations may have been missed while the worker was not subscribed
+            local_cache.clear()
+            for message in pubsub.listen():
+                local_cache.delete(message['data'])
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.BusyLoadingError):
+            local_cache.clear()
+            time.sleep(1)
+
+
+def ensure_listening():
+    """
+    Start listening to invalidations once per worker process
+    """
+    global _listener_pid
+
+    if _listener_pid == os.getpid():
+        return
+
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            threading.Thread(target=_listen, name='cache-invalidation', daemon=True).start()
+            _listener_pid = os.getpid()
+
+
+def invalidate(key):
+    local_cache.delete(key)
+    try:
+        redis_client.publish(INVALIDATION_CHANNEL, key)
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        pass
+
+
+def get_post(post_id):
+    """
+    Get a post by its id, posts are only read from posts table once per worker
+    """
+    ensure_listening()
+
+    cache_key = POST_CACHE_KEY.format(post_id=post_id)
+    post = local_cache.get(cache_key)
+    if post is None:
+        post = Post.objects.filter(id=post_id).first()
+        if post is not None:
+            local_cache.set(cache_key, post, settings.LOCAL_CACHE_POST_TTL)
+
+    return post
+
+
+async def aget_post(post_id):
+    """
+    Async get_post
+    """
+    ensure_listening()
+
+    cache_key = POST_CACHE_KEY.format(post_id=post_id)
+    post = local_cache.get(cache_key)
+    if post is None:
+        post = await Post.objects.filter(id=post_id).afirst()
+        if post is not None:
+            local_cache.set(cache_key, post, settings.LOCAL_CACHE_POST_TTL)
+
+    return post
@@ -0,0 +1,29 @@
+from django.core.checks import Error
+from django.db import connections
+
+from backend.ranking import hot_trigger_source
+
+"""
+System checks of the database, run by migrate and by check --database.
+"""
+
+
+def check_hot_trigger(databases=None, **kwargs):
+    """
+    The posts_hot trigger function of each database computes the hot column of posts with the formula of hot_score.
+    A database without the function yet is left to the migration creating it.
+    """
+    errors = []
+    for alias in databases or ():
+        with connections[alias].cursor() as cursor:
+            cursor.execute("select prosrc from pg_proc where proname = 'posts_hot' "
+                           "and pronamespace = 'public'::regnamespace")
+            row = cursor.fetchone()
+
+        if row is not None and row[0].strip() != hot_trigger_source():
+            errors.append(Error(f'The posts_hot trigger function of database {alias} does not compute hot_score',
+                                hint='Add a migration replacing the function with hot_trigger_source() and '
+                                     'recomputing the hot column of posts, then rebuild the hot ranking.',
+                                id='backend.E001'))
+
+    return errors
@@ -0,0 +1,314 @@
+import random
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from backend.metrics import record_fallback
+from backend.models import Comment, CounterFlush, Post
+from backend.ranking import HOT_KEY, TOP_KEY, hot_recency, hot_score
+from backend.redis_client import ReplyTimeoutError, redis_client
+from backend.snapshots import RANKING_VERSION_KEY
+
+"""
+Counters of the comments of posts.
+A counter adds new comments of a post atomically, returns its new total and updates its rankings in redis. Counts
+are added to posts table later by flush(), run every minute by cron. The counter used by the views and cron is the
+class at COMMENT_COUNTER_BACKEND:
+- RedisCounter keeps counts in the TOP_KEY ranking and adds comments with a single script;
+- PostgresCounter adds comments to one of COMMENT_COUNTER_SHARDS rows of a post, so concurrent comments on a post
+  rarely wait for each other;
+- MemoryCounter keeps counts in the process, for tests.
+"""
+
+"""
+Write-behind of total comments.
+Every new comment increases the pending increment of its post in the DIRTY_KEY hash. A flush renames that hash to
+a batch key, so new increments go to a fresh hash, then adds the increments of the batch to posts table in one
+UPDATE. The batch id is stored in counter_flushes in the same transaction, so a batch left in redis by a crashed
+flush is applied exactly once by the next one.
+"""
+DIRTY_KEY = 'posts:dirty'
+DIRTY_BATCH_KEY = 'posts:dirty:{batch_id}'
+DIRTY_BATCHES_KEY = 'posts:dirty:batches'
+
+CLAIM_DIRTY_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('rename', KEYS[1], KEYS[2])
+redis.call('sadd', KEYS[3], ARGV[1])
+return 1
+"""
+
+# Applied batches are remembered for this long to recognize batches left by crashed flushes
+FLUSH_RETENTION = timedelta(days=7)
+
+# Advisory lock held by flushes and by the recount of total comments while they change total comments of posts
+FLUSH_LOCK_ID = 3017003
+
+"""
+Add ARGV[2] comments to post ARGV[1] and update its rankings, or return false when the post is not ranked and no
+base count is given in ARGV[4]. ARGV[3] is the recency of the hot score of the post, rounded like hot_score.
+"""
+ADD_COMMENTS_SCRIPT = """
+local total
+if redis.call('zscore', KEYS[1], ARGV[1]) then
+    total = tonumber(redis.call('zincrby', KEYS[1], ARGV[2], ARGV[1]))
+elseif ARGV[4] then
+    total = tonumber(ARGV[4])
+    redis.call('zadd', KEYS[1], total, ARGV[1])
+else
+    return false
+end
+local hot = math.log10(math.max(total, 1)) + tonumber(ARGV[3])
+redis.call('zadd', KEYS[2], string.format('%.7f', hot), ARGV[1])
+redis.call('incr', KEYS[3])
+redis.call('hincrby', KEYS[4], ARGV[1], ARGV[2])
+return total
+"""
+
+
+def lock_flushes(cursor):
+    """
+    Wait for the flush or recount of total comments in progress, the lock being released by the end of the
+    transaction
+    """
+    cursor.execute("select pg_advisory_xact_lock(%s)", [FLUSH_LOCK_ID])
+
+
+def flush_batch(batch_id, key_prefix=''):
+    batch_key = key_prefix + DIRTY_BATCH_KEY.format(batch_id=batch_id)
+    increments = redis_client.hgetall(batch_key)
+
+    if increments:
+        post_ids = sorted(int(post_id) for post_id in increments)
+        with transaction.atomic(), connection.cursor() as cursor:
+            lock_flushes(cursor)
+            _, created = CounterFlush.objects.get_or_create(batch_id=batch_id,
+                                                            defaults={'total_posts': len(post_ids)})
+            if created:
+                query = "UPDATE public.posts p SET total_comments = p.total_comments + v.increment " \
+                        "from unnest(%s::integer[], %s::integer[]) v(id, increment) where p.id = v.id"
+                cursor.execute(query, [post_ids, [int(increments[str(post_id)]) for post_id in post_ids]])
+
+    pipeline = redis_client.pipeline()
+    pipeline.delete(batch_key)
+    pipeline.srem(key_prefix + DIRTY_BATCHES_KEY, batch_id)
+    pipeline.execute()
+
+
+def flush_dirty_counts(key_prefix=''):
+    batch_id = uuid.uuid4().hex
+    redis_client.eval(CLAIM_DIRTY_SCRIPT, 3, key_prefix + DIRTY_KEY,
+                      key_prefix + DIRTY_BATCH_KEY.format(batch_id=batch_id), key_prefix + DIRTY_BATCHES_KEY, batch_id)
+
+    # Batches of previous flushes that crashed are flushed too
+    for pending_batch_id in redis_client.smembers(key_prefix + DIRTY_BATCHES_KEY):
+        flush_batch(pending_batch_id, key_prefix)
+
+    CounterFlush.objects.filter(created_at__lt=timezone.now() - FLUSH_RETENTION).delete()
+
+
+def pending_dirty_counts(key_prefix=''):
+    """
+    Increments of the DIRTY_KEY hash and of the batches not applied yet, by post id
+    """
+    pipeline = redis_client.pipeline()
+    pipeline.hgetall(key_prefix + DIRTY_KEY)
+    pipeline.smembers(key_prefix + DIRTY_BATCHES_KEY)
+    dirty, batch_ids = pipeline.execute()
+
+    batches = {batch_id: redis_client.hgetall(key_prefix + DIRTY_BATCH_KEY.format(batch_id=batch_id))
+               for batch_id in batch_ids}
+    # A batch applied by a flush is kept in redis until the flush removes it
+    applied = set(CounterFlush.objects.filter(batch_id__in=batch_ids).values_list('batch_id', flat=True))
+
+    pending = {}
+    for increments in [dirty] + [batches[batch_id] for batch_id in batch_ids if batch_id not in applied]:
+        for post_id, increment in increments.items():
+            pending[int(post_id)] = pending.get(int(post_id), 0) + int(increment)
+
+    return pending
+
+
+def update_rankings(post, total_comments):
+    """
+    Set total comments and hot score of a post in redis
+    """
+    try:
+        pipeline = redis_client.pipeline()
+        pipeline.zadd(TOP_KEY, {str(post.id): total_comments})
+        pipeline.zadd(HOT_KEY, {str(post.id): hot_score(total_comments, post.created_at)})
+        pipeline.incr(RANKING_VERSION_KEY)
+        pipeline.execute()
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('comment_rankings')
+
+
+class CommentCounter(ABC):
+    def add(self, post, total_new):
+        """
+        Add new comments to a post and update its rankings. Returns its total comments.
+        """
+        total_comments = self.increment(post, total_new)
+        update_rankings(post, total_comments)
+
+        return total_comments
+
+    @abstractmethod
+    def increment(self, post, total_new):
+        """
+        Add new comments to the count of a post, returns its total comments
+        """
+
+    @abstractmethod
+    def flush(self):
+        """
+        Add the comments counted since the last flush to posts table
+        """
+
+    @abstractmethod
+    def pending(self):
+        """
+        Comments counted but not added to posts table yet, by post id. Read by the recount of total comments while
+        it holds the lock of flushes.
+        """
+
+
+class RedisCounter(CommentCounter):
+    """
+    Counts, rankings and pending increments are updated by one script, in one round trip. A post missing from the
+    rankings, e.g. after redis lost its data, is counted from comments table. Without redis, comments are added
+    to posts table directly. After a timeout the script may have run, so the comments are not added to posts table
+    and the weekly recount of total comments repairs a script that did not run.
+    Keys start with `key_prefix`, e.g. for a benchmark kept apart from the rankings served to clients.
+    """
+
+    def __init__(self, key_prefix=''):
+        self.key_prefix = key_prefix
+
+    def add(self, post, total_new):
+        # The script of increment updates the rankings too
+        return self.increment(post, total_new)
+
+    def increment(self, post, total_new):
+        keys = [self.key_prefix + key for key in (TOP_KEY, HOT_KEY, RANKING_VERSION_KEY, DIRTY_KEY)]
+        args = [str(post.id), total_new, repr(hot_recency(post.created_at))]
+        try:
+            total_comments = redis_client.eval(ADD_COMMENTS_SCRIPT, len(keys), *keys, *args)
+            if total_comments is None:
+                record_fallback('comment_count')
+                base = Comment.objects.filter(post_id=post.id).count()
+                total_comments = redis_client.eval(ADD_COMMENTS_SCRIPT, len(keys), *keys, *args, base)
+        except ReplyTimeoutError:
+            record_fallback('comment_counter_timeout')
+            return None
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.BusyLoadingError):
+            record_fallback('comment_counter')
+            Post.objects.filter(id=post.id).update(total_comments=F('total_comments') + total_new)
+            return None
+
+        return int(total_comments)
+
+    def flush(self):
+        flush_dirty_counts(self.key_prefix)
+
+    def pending(self):
+        return pending_dirty_counts(self.key_prefix)
+
+
+class PostgresCounter(CommentCounter):
+    """
+    Comments of a post are added to a random one of its COMMENT_COUNTER_SHARDS counter rows, whose sum is its
+    number of comments not flushed yet. A flush moves all the rows to posts table in one statement.
+    """
+    INCREMENT_QUERY = "with added as (insert into public.post_counter_shards (post_id, shard, total) " \
+                      "values (%s, %s, %s) on conflict (post_id, shard) " \
+                      "do update set total = post_counter_shards.total + excluded.total returning total) " \
+                      "select p.total_comments + %s + coalesce((select sum(s.total) " \
+                      "from public.post_counter_shards s where s.post_id = p.id), 0) " \
+                      "from public.posts p, added where p.id = %s"
+
+    FLUSH_QUERY = "with moved as (delete from public.post_counter_shards returning post_id, total) " \
+                  "UPDATE public.posts p SET total_comments = p.total_comments + m.total " \
+                  "from (select post_id, sum(total) as total from moved group by post_id) m where p.id = m.post_id"
+
+    def increment(self, post, total_new):
+        """
+        The sum of the rows is read from the snapshot of the statement, before its own insert, hence the increment
+        added to it
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(self.INCREMENT_QUERY,
+                           [post.id, random.randrange(settings.COMMENT_COUNTER_SHARDS), total_new, total_new, post.id])
+            return cursor.fetchone()[0]
+
+    def flush(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            lock_flushes(cursor)
+            cursor.execute(self.FLUSH_QUERY)
+
+    def pending(self):
+        with connection.cursor() as cursor:
+            cursor.execute("select post_id, sum(total) from public.post_counter_shards group by post_id")
+            return {post_id: int(total) for post_id, total in cursor.fetchall()}
+
+
+class MemoryCounter(CommentCounter):
+    """
+    Counts of the process, started from the comments of a post in comments table
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.increments = {}
+        self._lock = threading.Lock()
+
+    def increment(self, post, total_new):
+        with self._lock:
+            if post.id not in self.totals:
+                self.totals[post.id] = Comment.objects.filter(post_id=post.id).count()
+            else:
+                self.totals[post.id] += total_new
+            self.increments[post.id] = self.increments.get(post.id, 0) + total_new
+
+            return self.totals[post.id]
+
+    def flush(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            lock_flushes(cursor)
+            with self._lock:
+                increments, self.increments = self.increments, {}
+
+            for post_id, total_new in increments.items():
+                Post.objects.filter(id=post_id).update(total_comments=F('total_comments') + total_new)
+
+    def pending(self):
+        with self._lock:
+            return dict(self.increments)
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def comment_counter():
+    """
+    Counter of COMMENT_COUNTER_BACKEND, one per process
+    """
+    path = settings.COMMENT_COUNTER_BACKEND
+    with _counters_lock:
+        if path not in _counters:
+            _counters[path] = import_string(path)()
+
+        return _counters[path]
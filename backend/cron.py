@@ -1,12 +1,50 @@
-from django.db import connection
+from django.db import connection, transaction
+
+from backend.counters import comment_counter, lock_flushes
+from backend.partitions import comment_tables
+
+"""
+This function runs every minute to add new comments to total comments of their posts
+"""
+
+
+def flush_comment_counts():
+    comment_counter().flush()
+
 
 """
-This function runs every 10 minutes to update total comments in posts table
+This function recounts total comments of every post from comments table.
+It scans the whole comments table, so it only runs weekly to repair drifts. Comments are counted once they are
+committed, before their increments are added to the counter, so the increments still pending are counted by the
+recount and subtracted from the new totals, the next flush adding them back. Flushes wait for the lock held by each
+recount statement, so no increment is added to posts table between the read of the pending increments and the
+recount.
+When comments table is partitioned by post_id, all the comments of a post are in one partition, so partitions are
+counted one at a time, each in its own statement. Posts without any comment left, e.g. after a subtree was deleted,
+are reset by a last statement.
 """
+UPDATE_TOTAL_COMMENTS_QUERY = "UPDATE public.posts p SET total_comments = c.total_comments - coalesce(v.pending, 0) " \
+                              "from (select count(id) as total_comments, post_id from {table} group by post_id) c " \
+                              "left join unnest(%s::integer[], %s::integer[]) v(post_id, pending) " \
+                              "on v.post_id = c.post_id " \
+                              "where p.id = c.post_id and p.total_comments <> c.total_comments - coalesce(v.pending, 0)"
+
+RESET_TOTAL_COMMENTS_QUERY = "UPDATE public.posts p SET total_comments = -coalesce(v.pending, 0) " \
+                             "from public.posts q left join unnest(%s::integer[], %s::integer[]) v(post_id, pending) " \
+                             "on v.post_id = q.id " \
+                             "where p.id = q.id and p.total_comments <> -coalesce(v.pending, 0) " \
+                             "and not exists (select 1 from public.comments c where c.post_id = q.id)"
+
+
+def recount(cursor, query):
+    with transaction.atomic():
+        lock_flushes(cursor)
+        pending = comment_counter().pending()
+        cursor.execute(query, [list(pending), list(pending.values())])
 
 
 def update_total_comments():
     with connection.cursor() as cursor:
-        query = "UPDATE public.posts p SET total_comments = c.total_comments from (select count(id) as total_comments, " \
-                "post_id from public.comments group by post_id) c where p.id = c.post_id"
-        cursor.execute(query)
+        for table in comment_tables(cursor):
+            recount(cursor, UPDATE_TOTAL_COMMENTS_QUERY.format(table=table))
+        recount(cursor, RESET_TOTAL_COMMENTS_QUERY)
@@ -0,0 +1,152 @@
+import io
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+from django.db import connection, transaction
+
+from backend.paths import SEGMENT_WIDTH, child_path
+
+"""
+Synthetic datasets for benchmarks.
+The number of comments of every post is drawn up front from the seed, so the ids of the comments of each chunk of
+posts are known before generation and chunks are generated and copied to the database by parallel workers. Each
+chunk has its own random generator seeded by the seed and the chunk index, so a dataset does not depend on the
+number of workers.
+"""
+POSTS_COPY = "COPY public.posts (id, created_at, body, total_comments) FROM STDIN"
+COMMENTS_COPY = "COPY public.comments (id, created_at, body, tree_path, reply_count, descendant_count, post_id) " \
+                "FROM STDIN"
+
+
+def comment_counts(total_posts, mean, skew, seed):
+    """
+    Number of comments of each post, log-normally distributed around `mean`.
+    With skew 0 every post has `mean` comments, a larger skew gives a few posts most of the comments.
+    """
+    rng = random.Random(seed)
+    return [round(mean * rng.lognormvariate(-skew * skew / 2, skew)) for _ in range(total_posts)]
+
+
+def generate_thread(rng, post_id, created_at, first_comment_id, total, options):
+    """
+    Rows of the comments of a post.
+    A comment replies to the post, or with probability `reply_ratio` to a random comment that has less than
+    `max_fanout` replies and is less than `max_depth` levels deep, so older comments get more replies.
+    """
+    now = options['now']
+    parents = []
+    tree_paths = []
+    reply_counts = [0] * total
+    descendant_counts = [0] * total
+    open_comments = []
+    offsets = sorted(rng.random() for _ in range(total))
+
+    for index in range(total):
+        parent = None
+        if open_comments and rng.random() < options['reply_ratio']:
+            position = rng.randrange(len(open_comments))
+            parent = open_comments[position]
+            reply_counts[parent] += 1
+            if reply_counts[parent] >= options['max_fanout']:
+                open_comments[position] = open_comments[-1]
+                open_comments.pop()
+
+            ancestor = parent
+            while ancestor is not None:
+                descendant_counts[ancestor] += 1
+                ancestor = parents[ancestor]
+
+        parent_path = '' if parent is None else tree_paths[parent]
+        tree_path = child_path(parent_path, first_comment_id + index)
+        parents.append(parent)
+        tree_paths.append(tree_path)
+        if len(tree_path) < options['max_depth'] * SEGMENT_WIDTH:
+            open_comments.append(index)
+
+    for index in range(total):
+        comment_id = first_comment_id + index
+        comment_created_at = created_at + (now - created_at) * offsets[index]
+        yield (comment_id, comment_created_at.isoformat(), f'Comment {comment_id}', tree_paths[index],
+               reply_counts[index], descendant_counts[index], post_id)
+
+
+def copy_rows(cursor, query, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(str(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(query, buffer)
+
+
+def generate_chunk(chunk):
+    """
+    Generate and copy the posts of a chunk with their comments in one transaction.
+    Returns (post id, total comments, created at) of every post of the chunk.
+    """
+    chunk_index, first_post_id, first_comment_id, counts, options = chunk
+    rng = random.Random(f"{options['seed']}:{chunk_index}")
+    now = options['now']
+
+    posts = []
+    comments = []
+    comment_id = first_comment_id
+    for offset, total in enumerate(counts):
+        post_id = first_post_id + offset
+        created_at = now - timedelta(seconds=rng.random() * options['days'] * 86400)
+        posts.append((post_id, total, created_at))
+        comments.append(generate_thread(rng, post_id, created_at, comment_id, total, options))
+        comment_id += total
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        copy_rows(cursor, POSTS_COPY,
+                  ((post_id, created_at.isoformat(), f'Post {post_id}', total) for post_id, total, created_at in posts))
+        copy_rows(cursor, COMMENTS_COPY, (row for thread in comments for row in thread))
+
+    return posts
+
+
+def chunks(first_post_id, first_comment_id, counts, chunk_size, options):
+    for chunk_index, start in enumerate(range(0, len(counts), chunk_size)):
+        chunk_counts = counts[start:start + chunk_size]
+        yield chunk_index, first_post_id + start, first_comment_id, chunk_counts, options
+        first_comment_id += sum(chunk_counts)
+
+
+def next_ids():
+    """
+    First free ids of posts and comments
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("select coalesce(max(id), 0) + 1 from public.posts")
+        first_post_id = cursor.fetchone()[0]
+        cursor.execute("select coalesce(max(id), 0) + 1 from public.comments")
+        first_comment_id = cursor.fetchone()[0]
+
+    return first_post_id, first_comment_id
+
+
+def finish_dataset(last_post_id, last_comment_id):
+    """
+    Move the sequences after the generated ids and refresh the statistics of the planner
+    """
+    with connection.cursor() as cursor:
+        # A sequence of a table without rows restarts from 1
+        cursor.execute("select setval(pg_get_serial_sequence('public.posts', 'id'), %s, %s)",
+                       [max(last_post_id, 1), last_post_id > 0])
+        cursor.execute("select setval(pg_get_serial_sequence('public.comments', 'id'), %s, %s)",
+                       [max(last_comment_id, 1), last_comment_id > 0])
+        cursor.execute("analyze public.posts")
+        cursor.execute("analyze public.comments")
+
+
+def dataset_options(seed, days, reply_ratio, max_depth, max_fanout):
+    return {
+        'seed': seed,
+        'now': datetime.now(timezone.utc).replace(microsecond=0),
+        'days': days,
+        'reply_ratio': reply_ratio,
+        'max_depth': max_depth,
+        'max_fanout': max_fanout if max_fanout > 0 else math.inf,
+    }
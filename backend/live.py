@@ -0,0 +1,280 @@
+import asyncio
+import re
+import weakref
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from backend.cache import get_post
+from backend.encoders import dumps
+from backend.metrics import record_fallback, record_live_watchers
+from backend.redis_client import async_redis_client, pool_options, redis_client
+
+"""
+Live comments of a post over Server-Sent Events.
+GET /api/v1/posts/<post_id>/live is served by the ASGI application without going through Django, so a watcher is
+a coroutine and a queue. Created comments are published once to LIVE_CHANNEL, with an event id counted per post, and
+kept in a backlog of the last LIVE_BACKLOG_SIZE events of their post. Every process subscribes to the channel with a
+single connection and hands the events to the queues of the watchers of their post. A client reconnecting with
+Last-Event-ID gets the events it missed from the backlog, or a reset event when they are not all in it anymore, after
+which it should read the post again.
+"""
+LIVE_CHANNEL = 'live:comments'
+LIVE_SEQUENCE_KEY = 'live:{post_id}:sequence'
+LIVE_BACKLOG_KEY = 'live:{post_id}:backlog'
+
+LIVE_PATH = re.compile(r'^/api/v1/posts/(\d+)/live$')
+
+# Put in the queue of a watcher which may have missed events, so it reads them from the backlog
+RESYNC = 'resync'
+
+"""
+Give the next ids of the post KEYS[1] to the events ARGV[4:], add them to the backlog KEYS[2], keeping the last ARGV[2]
+for ARGV[3] seconds, and publish them to the channel ARGV[1] as '<post id> <event id> <data>'
+"""
+PUBLISH_EVENTS_SCRIPT = """
+local post_id = string.match(KEYS[1], '^live:(%d+):')
+local event_id = 0
+for i = 4, #ARGV do
+    event_id = redis.call('incr', KEYS[1])
+    redis.call('zadd', KEYS[2], event_id, ARGV[i])
+    redis.call('publish', ARGV[1], post_id .. ' ' .. event_id .. ' ' .. ARGV[i])
+end
+redis.call('zremrangebyrank', KEYS[2], 0, -tonumber(ARGV[2]) - 1)
+redis.call('expire', KEYS[2], ARGV[3])
+return event_id
+"""
+
+
+def publish_comments(post_id, comments):
+    """
+    Publish serialized comments of a post, once they are committed
+    """
+    try:
+        redis_client.eval(PUBLISH_EVENTS_SCRIPT, 2, LIVE_SEQUENCE_KEY.format(post_id=post_id),
+                          LIVE_BACKLOG_KEY.format(post_id=post_id), LIVE_CHANNEL, settings.LIVE_BACKLOG_SIZE,
+                          settings.LIVE_BACKLOG_TTL, *[dumps(comment) for comment in comments])
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('live')
+
+
+def format_event(event_id, data, event='comment'):
+    return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'.encode()
+
+
+class LiveHub:
+    """
+    Queues of the watchers of every post in a process, fed by a single subscription to LIVE_CHANNEL
+    """
+
+    def __init__(self):
+        self.watchers = defaultdict(set)
+        self.listener = None
+
+    def watch(self, post_id):
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.ensure_future(self.listen())
+
+        queue = asyncio.Queue(maxsize=settings.LIVE_QUEUE_SIZE)
+        self.watchers[post_id].add(queue)
+        record_live_watchers(1)
+
+        return queue
+
+    def unwatch(self, post_id, queue):
+        queues = self.watchers.get(post_id)
+        if queues is None or queue not in queues:
+            return
+
+        queues.discard(queue)
+        if not queues:
+            del self.watchers[post_id]
+        record_live_watchers(-1)
+
+    @staticmethod
+    def resync(queue):
+        """
+        A watcher too slow to keep up, or a listener reconnecting, skips the queued events for the backlog
+        """
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC)
+
+    def dispatch(self, message):
+        post_id, event_id, data = message.split(' ', 2)
+        for queue in self.watchers.get(int(post_id), ()):
+            try:
+                queue.put_nowait((int(event_id), data))
+            except asyncio.QueueFull:
+                self.resync(queue)
+
+    async def listen(self):
+        # The subscription blocks on reads until an event comes, so it has no socket timeout
+        client = redis.asyncio.Redis(connection_pool=redis.asyncio.BlockingConnectionPool(**pool_options()))
+        while True:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(LIVE_CHANNEL)
+                # Events published while the process was not subscribed are only in the backlogs
+                for queues in self.watchers.values():
+                    for queue in queues:
+                        self.resync(queue)
+
+                async for message in pubsub.listen():
+                    self.dispatch(message['data'])
+            except (redis.exceptions.ConnectionError,
+                    redis.exceptions.BusyLoadingError):
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.reset()
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def live_hub():
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = LiveHub()
+
+    return hub
+
+
+def find_post(post_id):
+    # Watchers are not Django requests, so their connections are not closed by the request signals, and a connection
+    # kept for CONN_MAX_AGE in a thread of sync_to_async is never reused nor closed
+    try:
+        return get_post(post_id)
+    finally:
+        connection.close()
+
+
+async def read_backlog(post_id, last_event_id):
+    """
+    Events of a post after `last_event_id`, and whether some of them are missing from the backlog
+    """
+    pipeline = async_redis_client().pipeline(transaction=False)
+    pipeline.get(LIVE_SEQUENCE_KEY.format(post_id=post_id))
+    pipeline.zrange(LIVE_BACKLOG_KEY.format(post_id=post_id), f'({last_event_id}', '+inf', byscore=True,
+                    withscores=True)
+    sequence, events = await pipeline.execute()
+    sequence = int(sequence or 0)
+    events = [(int(event_id), data) for data, event_id in events]
+
+    if sequence <= last_event_id:
+        # Ids restarted after redis lost its data
+        missing = sequence < last_event_id
+    else:
+        # Events were trimmed or expired
+        missing = not events or events[0][0] > last_event_id + 1
+
+    return sequence, events, missing
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class LiveApplication:
+    """
+    ASGI application serving the live comments of posts, and passing other requests to `application`
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        match = LIVE_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        if match is None:
+            return await self.application(scope, receive, send)
+
+        if scope['method'] != 'GET':
+            return await self.send_json(send, 405, b'{"detail":"Method not allowed."}')
+
+        post_id = int(match.group(1))
+        if await sync_to_async(find_post)(post_id) is None:
+            return await self.send_json(send, 404, b'{"code":"post_not_found","message":"Post not found"}')
+
+        await self.stream(scope, receive, send, post_id)
+
+    @staticmethod
+    async def send_json(send, status, body):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    def last_event_id(scope):
+        """
+        Last-Event-ID sent by EventSource when it reconnects, or last_event_id of the query string
+        """
+        value = dict(scope['headers']).get(b'last-event-id', b'').decode('latin-1')
+        if not value:
+            value = parse_qs(scope['query_string'].decode('latin-1')).get('last_event_id', [''])[0]
+
+        return int(value) if value.isdigit() else None
+
+    async def stream(self, scope, receive, send, post_id):
+        hub = live_hub()
+        # Watching before the backlog is read, events published in between are in both and sent once
+        queue = hub.watch(post_id)
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+            last_event_id = await self.catch_up(send, post_id, self.last_event_id(scope))
+            while not disconnect.done():
+                item = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({item, disconnect}, timeout=settings.LIVE_HEARTBEAT,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if item not in done:
+                    item.cancel()
+                    if not disconnect.done():
+                        await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                elif item.result() == RESYNC:
+                    last_event_id = await self.catch_up(send, post_id, last_event_id)
+                elif item.result()[0] > last_event_id:
+                    last_event_id, data = item.result()
+                    await send({'type': 'http.response.body', 'body': format_event(last_event_id, data),
+                                'more_body': True})
+        finally:
+            hub.unwatch(post_id, queue)
+            disconnect.cancel()
+
+    @staticmethod
+    async def catch_up(send, post_id, last_event_id):
+        """
+        Send the events after `last_event_id` from the backlog, a new watcher only getting the ones to come
+        """
+        try:
+            sequence, events, missing = await read_backlog(post_id, last_event_id or 0)
+        except (redis.exceptions.ConnectionError,
+                redis.exceptions.BusyLoadingError):
+            record_fallback('live')
+            return last_event_id or 0
+
+        if last_event_id is None:
+            return sequence
+
+        if missing:
+            await send({'type': 'http.response.body', 'body': format_event(sequence, '{}', event='reset'),
+                        'more_body': True})
+            return sequence
+
+        body = b''.join(format_event(event_id, data) for event_id, data in events)
+        if body:
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        return events[-1][0] if events else last_event_id
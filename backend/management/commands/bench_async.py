@@ -0,0 +1,43 @@
+import asyncio
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarks import LOAD_PATHS, Sample, async_path, load_paths, load_test
+
+
+class Command(BaseCommand):
+    help = 'Compare the WSGI and the ASGI deployments under many concurrent slow clients. Both servers must be ' \
+           'running on the same database, e.g. gunicorn seta_test.wsgi and uvicorn seta_test.asgi:application.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', default='http://127.0.0.1:8000', help='Server of the sync endpoints')
+        parser.add_argument('--asgi-url', default='http://127.0.0.1:8001',
+                            help='Server of the async endpoints, requested under /api/v1/async/')
+        parser.add_argument('--endpoints', nargs='+', choices=list(LOAD_PATHS), default=list(LOAD_PATHS),
+                            help='Endpoints requested in turn')
+        parser.add_argument('--concurrency', type=int, default=1000, help='Clients requesting at the same time')
+        parser.add_argument('--requests', type=int, default=10000, help='Requests sent to each server')
+        parser.add_argument('--client-delay', type=float, default=0.1,
+                            help='Seconds each client waits between its request line and its headers')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the requested posts and comments')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+
+        sample = Sample(random.Random(options['seed']))
+        if not sample.post_ids:
+            raise CommandError('The database has no posts, generate a dataset with generate_dataset')
+
+        paths = load_paths(options['endpoints'], options['requests'], sample)
+        targets = [
+            ('wsgi', options['wsgi_url'], paths),
+            ('asgi', options['asgi_url'], [async_path(path) for path in paths]),
+        ]
+
+        for name, url, target_paths in targets:
+            result = asyncio.run(load_test(url, target_paths, options['concurrency'], options['client_delay']))
+            self.stdout.write(f"{name} ({url}): {result['requests_per_second']} requests/s, p50 {result['p50_ms']}ms, "
+                              f"p95 {result['p95_ms']}ms, p99 {result['p99_ms']}ms, "
+                              f"{result['errors']} errors out of {result['requests']}")
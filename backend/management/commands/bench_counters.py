@@ -0,0 +1,76 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from backend.models import Post
+from backend.redis_client import redis_client
+
+BACKENDS = {
+    'redis': 'backend.counters.RedisCounter',
+    'postgres': 'backend.counters.PostgresCounter',
+    'memory': 'backend.counters.MemoryCounter',
+}
+
+# Prefix of the keys of the redis counter, apart from the rankings and pending counts served to clients
+KEY_PREFIX = 'bench:counters:'
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput of the comment counters when many threads comment on the same posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS),
+                            help='Counters to compare')
+        parser.add_argument('--threads', type=int, default=16, help='Threads adding comments at the same time')
+        parser.add_argument('--increments', type=int, default=500, help='Comments added by each thread')
+        parser.add_argument('--posts', type=int, default=1, help='Posts commented on, 1 for the most contention')
+
+    def handle(self, *args, **options):
+        posts = [Post.objects.create(body='Counter benchmark') for _ in range(options['posts'])]
+        try:
+            for backend in options['backends']:
+                self.bench(backend, posts, options['threads'], options['increments'])
+        finally:
+            Post.objects.filter(id__in=[post.id for post in posts]).delete()
+            if 'redis' in options['backends']:
+                keys = list(redis_client.scan_iter(match=f'{KEY_PREFIX}*'))
+                if keys:
+                    redis_client.delete(*keys)
+
+    def bench(self, backend, posts, threads, increments):
+        counter = import_string(BACKENDS[backend])(**({'key_prefix': KEY_PREFIX} if backend == 'redis' else {}))
+        for post in posts:
+            counter.add(post, 0)
+            counter.flush()
+        start_totals = {post.id: Post.objects.get(id=post.id).total_comments for post in posts}
+
+        barrier = threading.Barrier(threads + 1)
+
+        def comment(thread_index):
+            barrier.wait()
+            try:
+                for index in range(increments):
+                    counter.add(posts[(thread_index + index) % len(posts)], 1)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=comment, args=(index,)) for index in range(threads)]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        counter.flush()
+        counted = sum(Post.objects.get(id=post.id).total_comments - start_totals[post.id] for post in posts)
+        expected = threads * increments
+        status = self.style.SUCCESS('exact') if counted == expected else \
+            self.style.ERROR(f'{counted} counted instead of {expected}')
+
+        self.stdout.write(f'{backend}: {expected / elapsed:.0f} comments/s with {threads} threads '
+                          f'on {len(posts)} posts, {status}')
@@ -0,0 +1,72 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from backend.encoders import COMMENT_WITH_POST_ROW, dumps
+from backend.models import Comment
+from backend.paths import child_path
+from backend.serializers import CommentGetSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare the time to serialize comments with CommentGetSerializer and with the fast read path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='Numbers of comments')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of each serializer, the best one is kept')
+
+    @staticmethod
+    def make_rows(total):
+        """
+        Rows of a thread as read by values_list, each comment replying to the previous one of a chain of 10
+        """
+        created_at = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        rows = []
+        tree_path = ''
+        for comment_id in range(1, total + 1):
+            tree_path = child_path(tree_path if comment_id % 10 != 1 else '', comment_id)
+            rows.append((comment_id, created_at + timedelta(microseconds=comment_id), f'Comment {comment_id} ✓',
+                         tree_path, comment_id % 10 and 1, 10 - comment_id % 10, 1))
+
+        return rows
+
+    @staticmethod
+    def best_time(function, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            content = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        return best, content
+
+    def handle(self, *args, **options):
+        fields = COMMENT_WITH_POST_ROW.fields
+
+        for total in options['rows']:
+            rows = self.make_rows(total)
+
+            """
+            The serializer path builds model instances from the rows, as a queryset does
+            """
+
+            def serialize():
+                comments = [Comment.from_db('default', fields, row) for row in rows]
+                return JSONRenderer().render(CommentGetSerializer(comments, many=True).data)
+
+            def encode():
+                return dumps(COMMENT_WITH_POST_ROW.encode(rows))
+
+            serializer_time, serializer_content = self.best_time(serialize, options['repeat'])
+            encoder_time, encoder_content = self.best_time(encode, options['repeat'])
+
+            if serializer_content != encoder_content:
+                self.stderr.write(self.style.ERROR(f'{total} rows: outputs differ'))
+                continue
+
+            self.stdout.write(f'{total} rows: serializer {serializer_time * 1000:.1f}ms, '
+                              f'fast read path {encoder_time * 1000:.1f}ms, '
+                              f'{serializer_time / encoder_time:.1f}x faster')
@@ -0,0 +1,69 @@
+import json
+from datetime import datetime, timezone
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarks import SCENARIOS, regressions, run_benchmark
+from backend.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Measure latency percentiles, queries and rows touched of the endpoints and the flush job. ' \
+           'Writes comments, so it is meant for a benchmark database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+                            help='Scenarios to run')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[],
+                            help='Numbers of posts to benchmark at, datasets are generated up to each size in turn')
+        parser.add_argument('--iterations', type=int, default=200, help='Measured runs of each scenario')
+        parser.add_argument('--warmup', type=int, default=20, help='Runs of each scenario before measuring')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated datasets and of the requests')
+        parser.add_argument('--output', help='File the results are written to as JSON')
+        parser.add_argument('--baseline', help='Results of a previous run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Fails when the p95 latency of a scenario is this fraction above its baseline')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive')
+
+        runs = []
+        for size in sorted(options['sizes']) or [None]:
+            if size is not None:
+                missing_posts = size - Post.objects.count()
+                if missing_posts > 0:
+                    call_command('generate_dataset', posts=missing_posts, seed=options['seed'] + size,
+                                 stdout=self.stdout)
+
+            if not Post.objects.exists():
+                raise CommandError('The database has no posts, generate a dataset with --sizes or generate_dataset')
+
+            run = run_benchmark(options['scenarios'], options['iterations'], options['warmup'], options['seed'])
+            runs.append(run)
+            self.write_run(run)
+
+        results = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'iterations': options['iterations'],
+            'runs': runs,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                found = regressions(results, json.load(baseline), options['threshold'])
+            if found:
+                raise CommandError('Regressions:\n' + '\n'.join(found))
+            self.stdout.write(self.style.SUCCESS('No regression'))
+
+    def write_run(self, run):
+        self.stdout.write(f"{run['posts']} posts, {run['comments']} comments")
+        for name, result in run['scenarios'].items():
+            self.stdout.write(f"  {name}: p50 {result['p50_ms']}ms, p95 {result['p95_ms']}ms, "
+                              f"p99 {result['p99_ms']}ms, {result['queries']} queries, "
+                              f"{result['rows_touched']} rows touched")
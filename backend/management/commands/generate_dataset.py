@@ -0,0 +1,73 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from backend.datasets import chunks, comment_counts, dataset_options, finish_dataset, generate_chunk, next_ids
+from backend.ranking import HOT_KEY, TOP_KEY, hot_score
+from backend.redis_client import redis_client
+from backend.snapshots import RANKING_VERSION_KEY
+
+# Posts added to redis per pipeline
+REDIS_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = 'Generate posts with threads of comments, copied to the database by parallel workers, ' \
+           'and add them to the rankings in redis. Meant for benchmark databases without other writers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000, help='Number of posts')
+        parser.add_argument('--comments', type=float, default=150, help='Mean number of comments of a post')
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Skew of the number of comments of posts, 0 for the same number for every post')
+        parser.add_argument('--reply-ratio', type=float, default=0.7,
+                            help='Share of comments replying to another comment')
+        parser.add_argument('--max-depth', type=int, default=10, help='Maximum depth of a comment')
+        parser.add_argument('--max-fanout', type=int, default=50,
+                            help='Maximum number of replies of a comment, 0 for no maximum')
+        parser.add_argument('--days', type=float, default=30, help='Posts are created during the last days')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generators')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='Number of processes')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of posts generated and copied per transaction')
+
+    def handle(self, *args, **options):
+        if options['posts'] < 1 or options['max_depth'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--posts, --max-depth and --chunk-size must be positive')
+        if not 0 <= options['reply_ratio'] <= 1:
+            raise CommandError('--reply-ratio must be between 0 and 1')
+
+        start = time.perf_counter()
+        counts = comment_counts(options['posts'], options['comments'], options['skew'], options['seed'])
+        first_post_id, first_comment_id = next_ids()
+        dataset = dataset_options(options['seed'], options['days'], options['reply_ratio'], options['max_depth'],
+                                  options['max_fanout'])
+
+        # Workers are forked, each opens its own database connection
+        connections.close_all()
+        posts = []
+        with multiprocessing.get_context('fork').Pool(options['workers']) as pool:
+            for chunk_posts in pool.imap_unordered(generate_chunk, chunks(first_post_id, first_comment_id, counts,
+                                                                          options['chunk_size'], dataset)):
+                posts.extend(chunk_posts)
+                self.stdout.write(f'{len(posts)}/{len(counts)} posts', ending='\r')
+
+        finish_dataset(first_post_id + len(counts) - 1, first_comment_id + sum(counts) - 1)
+        self.stdout.write(f'{len(posts)} posts and {sum(counts)} comments copied '
+                          f'in {time.perf_counter() - start:.1f}s')
+
+        self.add_to_rankings(posts)
+        self.stdout.write(self.style.SUCCESS(f'Dataset generated in {time.perf_counter() - start:.1f}s'))
+
+    @staticmethod
+    def add_to_rankings(posts):
+        for start in range(0, len(posts), REDIS_BATCH_SIZE):
+            batch = posts[start:start + REDIS_BATCH_SIZE]
+            pipeline = redis_client.pipeline(transaction=False)
+            pipeline.zadd(TOP_KEY, {str(post_id): total for post_id, total, _ in batch})
+            pipeline.zadd(HOT_KEY, {str(post_id): hot_score(total, created_at) for post_id, total, created_at in batch})
+            pipeline.execute()
+
+        redis_client.incr(RANKING_VERSION_KEY)
@@ -0,0 +1,75 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from backend.partitions import PARTITIONED_TABLE, PREVIOUS_TABLE, TABLE, copy_batch_query, has_identity, \
+    is_partitioned, prepare_statements, swap_statements, table_exists, table_layout
+
+
+class Command(BaseCommand):
+    help = 'Move comments table online to a table hash partitioned by post_id. Writes keep going to comments ' \
+           'during the copy, and are blocked only while the tables are swapped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, default=settings.COMMENT_PARTITIONS,
+                            help='Number of partitions of the new table')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Ids of comments copied per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to wait between batches')
+        parser.add_argument('--start-id', type=int, default=0, help='Resume a copy after this comment id')
+        parser.add_argument('--no-swap', action='store_true', help='Copy the comments without swapping the tables')
+
+    def handle(self, *args, **options):
+        if options['partitions'] < 2 or options['batch_size'] < 1:
+            raise CommandError('--partitions must be at least 2 and --batch-size positive')
+
+        with connection.cursor() as cursor:
+            if is_partitioned(cursor):
+                raise CommandError('Comments table is already partitioned')
+            if table_exists(cursor, PREVIOUS_TABLE):
+                raise CommandError(f'Drop {PREVIOUS_TABLE} table left by a previous run first')
+
+            layout = table_layout(cursor)
+            if table_exists(cursor, PARTITIONED_TABLE):
+                self.stdout.write(f'Resuming the copy to {PARTITIONED_TABLE}')
+            else:
+                with transaction.atomic():
+                    for statement in prepare_statements(options['partitions'], layout):
+                        cursor.execute(statement)
+                self.stdout.write(f"Created {PARTITIONED_TABLE} with {options['partitions']} partitions")
+
+            # Comments created from now on are mirrored, so only the ids up to the current last one are copied
+            cursor.execute(f'select coalesce(max(id), 0) from public.{TABLE}')
+            last_id = cursor.fetchone()[0]
+
+            self.copy(cursor, layout[0], options['start_id'], last_id, options['batch_size'], options['pause'])
+
+            if options['no_swap']:
+                return
+
+            cursor.execute(f"select pg_get_serial_sequence('public.{TABLE}', 'id')")
+            sequence = cursor.fetchone()[0]
+            identity = has_identity(cursor)
+            with transaction.atomic():
+                for statement in swap_statements(sequence, [name for name, _ in layout[1]], identity):
+                    cursor.execute(statement)
+            cursor.execute(f'analyze public.{TABLE}')
+
+        self.stdout.write(self.style.SUCCESS(f'Comments table is partitioned, the previous table is {PREVIOUS_TABLE}'))
+
+    def copy(self, cursor, columns, start_id, last_id, batch_size, pause):
+        query = copy_batch_query(columns)
+        total_copied = 0
+
+        for first_id in range(start_id, last_id, batch_size):
+            with transaction.atomic():
+                cursor.execute(query, [first_id, min(first_id + batch_size, last_id)])
+                total_copied += cursor.rowcount
+
+            self.stdout.write(f'Copied comments up to id {min(first_id + batch_size, last_id)}, '
+                              f'{total_copied} rows', ending='\r')
+            if pause:
+                time.sleep(pause)
+
+        self.stdout.write(f'Copied {total_copied} comments')
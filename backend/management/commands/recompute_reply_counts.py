@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from backend.models import Post
+from backend.replies import recompute_reply_counts
+from backend.versions import reset_post_versions
+
+
+class Command(BaseCommand):
+    help = 'Recount reply and descendant counts of every comment from their tree paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of posts recounted per statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_post_id = Post.objects.aggregate(last_post_id=Max('id'))['last_post_id'] or 0
+
+        total_updated = 0
+        for first_post_id in range(1, last_post_id + 1, batch_size):
+            total_updated += recompute_reply_counts(first_post_id, first_post_id + batch_size - 1)
+
+        # Responses with the previous counts must not be revalidated
+        reset_post_versions()
+
+        self.stdout.write(self.style.SUCCESS(f'Reply counts of {total_updated} comments are fixed'))
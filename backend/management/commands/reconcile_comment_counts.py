@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from backend.cron import update_total_comments
+
+
+class Command(BaseCommand):
+    help = 'Recount total comments of every post from comments table'
+
+    def handle(self, *args, **options):
+        update_total_comments()
+        self.stdout.write(self.style.SUCCESS('Total comments of posts are reconciled'))
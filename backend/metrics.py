@@ -0,0 +1,388 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+from django.conf import settings
+
+"""
+Metrics of requests, in Prometheus text format.
+Each worker keeps its own metrics. With METRICS_DIR, each worker also writes them to a file of that directory, and
+/metrics adds up the files of all the workers, so counters keep growing whichever worker is scraped. Files of workers
+that exited are kept for their counters and histograms, their gauges are left out.
+Database queries, redis commands and rendering of a request are added up in a RequestStats while it runs, and
+recorded once per request when it ends, so the cost per query is only a few additions. Redis commands run outside of
+a request, e.g. by cron jobs, are counted under the BACKGROUND endpoint.
+"""
+BACKGROUND = 'background'
+UNMATCHED = 'unmatched'
+
+# Upper bounds of histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(values, other):
+        for label_values, value in other.items():
+            values[label_values] = values.get(label_values, 0) + value
+
+    def lines(self, values=None):
+        values = sorted((self.snapshot() if values is None else values).items())
+
+        for label_values, value in values:
+            yield f'{self.name}{format_labels(self.labels, label_values)} {value}'
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), aggregate=sum):
+        super().__init__(name, documentation, labels)
+        # Function giving the value of the gauge from its values in each worker
+        self.aggregate = aggregate
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def merge(self, values, other):
+        for label_values, value in other.items():
+            values[label_values] = self.aggregate((values[label_values], value)) if label_values in values else value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # Counts of each bucket, of values above the last bucket, then the sum of values
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {label_values: list(counts) for label_values, counts in self._values.items()}
+
+    @staticmethod
+    def merge(values, other):
+        for label_values, counts in other.items():
+            if label_values in values:
+                values[label_values] = [total + count for total, count in zip(values[label_values], counts)]
+            else:
+                values[label_values] = list(counts)
+
+    def lines(self, values=None):
+        values = sorted((self.snapshot() if values is None else values).items())
+
+        for label_values, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                yield f'{self.name}_bucket{format_labels(self.labels, label_values, [("le", bound)])} {total}'
+            yield f'{self.name}_sum{format_labels(self.labels, label_values)} {counts[-1]}'
+            yield f'{self.name}_count{format_labels(self.labels, label_values)} {total}'
+
+
+requests_total = Counter('http_requests_total', 'Requests', ('endpoint', 'method', 'status'))
+request_seconds = Histogram('http_request_duration_seconds', 'Duration of requests', ('endpoint', 'method'))
+request_view_seconds = Histogram('http_request_view_seconds',
+                                 'Time of requests spent in views, out of database, redis and rendering', ('endpoint',))
+request_db_seconds = Histogram('http_request_db_seconds', 'Time of requests spent in database queries', ('endpoint',))
+request_redis_seconds = Histogram('http_request_redis_seconds', 'Time of requests spent in redis commands',
+                                  ('endpoint',))
+request_render_seconds = Histogram('http_request_render_seconds', 'Time of requests spent rendering responses',
+                                   ('endpoint',))
+db_queries_total = Counter('db_queries_total', 'Database queries', ('endpoint',))
+db_errors_total = Counter('db_errors_total', 'Database queries that failed', ('endpoint',))
+redis_commands_total = Counter('redis_commands_total', 'Redis commands, a pipeline counting as one',
+                               ('endpoint', 'command'))
+redis_errors_total = Counter('redis_errors_total', 'Redis commands that failed', ('endpoint', 'command'))
+redis_fallbacks_total = Counter('redis_fallbacks_total', 'Requests served without redis because it failed',
+                                ('endpoint', 'fallback'))
+response_cache_total = Counter('response_cache_total', 'Lookups of the response cache by result: hit, stale or miss',
+                               ('endpoint', 'result'))
+db_replica_fallbacks_total = Counter('db_replica_fallbacks_total',
+                                     'Replicas skipped by reads because they lag or are unavailable',
+                                     ('endpoint', 'reason'))
+live_watchers = Gauge('live_watchers', 'Clients watching the live comments of a post')
+redis_breaker_state = Gauge('redis_breaker_state',
+                            'Highest state of the redis circuit breaker of the workers: 0 closed, 1 open, 2 half open',
+                            aggregate=max)
+redis_breaker_rejections_total = Counter('redis_breaker_rejections_total',
+                                         'Redis commands not sent because the circuit breaker is open', ('endpoint',))
+
+REGISTRY = [
+    requests_total,
+    request_seconds,
+    request_view_seconds,
+    request_db_seconds,
+    request_redis_seconds,
+    request_render_seconds,
+    db_queries_total,
+    db_errors_total,
+    redis_commands_total,
+    redis_errors_total,
+    redis_fallbacks_total,
+    response_cache_total,
+    db_replica_fallbacks_total,
+    live_watchers,
+    redis_breaker_state,
+    redis_breaker_rejections_total,
+]
+
+
+class RequestStats:
+    __slots__ = ('endpoint', 'db_seconds', 'db_queries', 'redis_seconds', 'render_seconds')
+
+    def __init__(self):
+        self.endpoint = UNMATCHED
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.redis_seconds = 0.0
+        self.render_seconds = 0.0
+
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+def current_endpoint():
+    stats = _request_stats.get()
+    return BACKGROUND if stats is None else stats.endpoint
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper timing the queries of a request
+    """
+    start = time.perf_counter()
+    failed = True
+    try:
+        result = execute(sql, params, many, context)
+        failed = False
+        return result
+    finally:
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.db_seconds += time.perf_counter() - start
+            stats.db_queries += 1
+            if failed:
+                db_errors_total.inc(stats.endpoint)
+
+
+def record_redis(command, seconds, failed):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.redis_seconds += seconds
+
+    endpoint = current_endpoint()
+    redis_commands_total.inc(endpoint, command)
+    if failed:
+        redis_errors_total.inc(endpoint, command)
+
+
+def record_breaker(state, rejected=False):
+    redis_breaker_state.set(state)
+    if rejected:
+        redis_breaker_rejections_total.inc(current_endpoint())
+
+
+def record_response_cache(result):
+    response_cache_total.inc(current_endpoint(), result)
+
+
+def record_render(seconds):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.render_seconds += seconds
+
+
+def record_fallback(fallback):
+    """
+    Count a request served without redis, e.g. a ranking read from posts table
+    """
+    redis_fallbacks_total.inc(current_endpoint(), fallback)
+
+
+def record_replica_fallback(reason):
+    db_replica_fallbacks_total.inc(current_endpoint(), reason)
+
+
+def record_live_watchers(change):
+    live_watchers.inc(amount=change)
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _request_stats.set(stats)
+
+
+def finish_request(stats, token, method, status, seconds):
+    _request_stats.reset(token)
+
+    endpoint = stats.endpoint
+    requests_total.inc(endpoint, method, status)
+    request_seconds.observe(seconds, endpoint, method)
+    request_view_seconds.observe(max(seconds - stats.db_seconds - stats.redis_seconds - stats.render_seconds, 0),
+                                 endpoint)
+    request_db_seconds.observe(stats.db_seconds, endpoint)
+    request_redis_seconds.observe(stats.redis_seconds, endpoint)
+    request_render_seconds.observe(stats.render_seconds, endpoint)
+    if stats.db_queries:
+        db_queries_total.inc(endpoint, amount=stats.db_queries)
+    if settings.METRICS_DIR:
+        _worker_file.start()
+
+
+def set_endpoint(endpoint):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.endpoint = endpoint
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+class WorkerFile:
+    """
+    File of this worker in METRICS_DIR, named after its pid and unique even when the pid is reused, written every
+    METRICS_WRITE_INTERVAL seconds by a thread of the worker. A worker forked after this module was imported, e.g. by
+    gunicorn --preload, gets its own file and thread.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self.name = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.name = f'{self.pid}-{uuid.uuid4().hex}.json'
+                threading.Thread(target=self.write_every_interval, daemon=True).start()
+
+    def path(self):
+        self.start()
+        return os.path.join(settings.METRICS_DIR, self.name)
+
+    def write_every_interval(self):
+        while True:
+            time.sleep(settings.METRICS_WRITE_INTERVAL)
+            write_metrics()
+
+
+_worker_file = WorkerFile()
+
+
+def write_metrics():
+    """
+    Write the metrics of this worker to its file of METRICS_DIR, replaced at once so workers never read it half
+    written
+    """
+    if not settings.METRICS_DIR:
+        return
+
+    path = _worker_file.path()
+    temporary_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump({metric.name: [[list(label_values), value] for label_values, value in metric.snapshot().items()]
+                   for metric in REGISTRY}, file)
+    os.replace(temporary_path, path)
+
+
+atexit.register(write_metrics)
+
+
+def collect():
+    """
+    Metrics of all the workers writing to METRICS_DIR, by metric name, or None without METRICS_DIR
+    """
+    if not settings.METRICS_DIR:
+        return None
+
+    write_metrics()
+    values = {metric.name: {} for metric in REGISTRY}
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name)) as file:
+                worker_values = json.load(file)
+        except (OSError, ValueError):
+            continue
+
+        alive = process_alive(int(name.split('-')[0]))
+        for metric in REGISTRY:
+            if metric.type == 'gauge' and not alive:
+                continue
+            metric.merge(values[metric.name], {tuple(label_values): value
+                                               for label_values, value in worker_values.get(metric.name, [])})
+
+    return values
+
+
+def render():
+    values = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.lines(None if values is None else values[metric.name]))
+
+    return '\n'.join(lines) + '\n'
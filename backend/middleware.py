@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+from django.conf import settings
+
+from backend.metrics import finish_request, record_query, set_endpoint, start_request
+from backend.routers import is_pinned, pin_to_primary, read_from_replicas, reset_read_from_replicas
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def record_queries(sender, connection, **kwargs):
+    """
+    Time the queries of every database connection. Queries of async views run in the threads of the async ORM,
+    whose connections are not the one of the request, so the wrapper is added when a connection is opened.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class MetricsMiddleware:
+    """
+    Record the duration of every request and the time it spends in database queries, labelled by its url pattern.
+    Streamed responses are measured until the view returns them, so the time and the queries of reading their content
+    are not included. Async requests are measured without leaving the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Like django.utils.deprecation.MiddlewareMixin, makes the middleware a coroutine function for Django
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            # A sync process_view would be run in a thread for every request
+            self.process_view = self.process_view_async
+        else:
+            self._is_coroutine = None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+
+        stats, token = start_request()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            finish_request(stats, token, request.method, status, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats, token = start_request()
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            finish_request(stats, token, request.method, status, time.perf_counter() - start)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        set_endpoint(request.resolver_match.route)
+
+    async def process_view_async(self, request, view_func, view_args, view_kwargs):
+        set_endpoint(request.resolver_match.route)
+
+
+class ReplicaMiddleware:
+    """
+    Read safe requests from the replicas unless their client is pinned to the primary, and pin the clients of
+    successful writes to the primary
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        else:
+            self._is_coroutine = None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                reset_read_from_replicas(token)
+
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+
+        # The async ORM runs queries in threads with a copy of the context of the request
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                reset_read_from_replicas(token)
+
+        return self.finish(request, response)
+
+    def start(self, request):
+        if request.method in SAFE_METHODS and not is_pinned(request):
+            return read_from_replicas()
+
+        return None
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(response)
+
+        return response
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.5 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0005_remove_comment_parent_alter_comment_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterFlush',
+            fields=[
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('batch_id', models.CharField(max_length=32, unique=True)),
+                ('total_posts', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'counter_flushes',
+            },
+        ),
+    ]
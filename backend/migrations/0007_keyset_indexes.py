@@ -0,0 +1,28 @@
+# Generated by Django 4.1.5 on 2026-10-18 20:38
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('backend', '0006_counterflush'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.BTreeIndex(fields=['post', '-created_at', '-id'], name='comment_post_created_at_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.BTreeIndex(fields=['-total_comments', '-id'], name='total_comments_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.BTreeIndex(fields=['-created_at', '-id'], name='post_created_at_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.1.5 on 2026-10-18 20:41
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 10000
+
+# '/4/5' and id 6 -> '000000040000000500000006'
+FORWARD_QUERY = "UPDATE public.comments SET tree_path = coalesce((select string_agg(lpad(to_hex(s.segment::integer), " \
+                "8, '0'), '' order by s.position) from unnest(string_to_array(path, '/')) with ordinality " \
+                "s(segment, position) where s.segment <> ''), '') || lpad(to_hex(id), 8, '0') " \
+                "where id >= %s and id < %s"
+
+# '000000040000000500000006' -> '/4/5'
+BACKWARD_QUERY = "UPDATE public.comments SET path = coalesce((select string_agg('/' || ('x' || substr(tree_path, " \
+                 "g * 8 + 1, 8))::bit(32)::integer, '' order by g) from generate_series(0, length(tree_path) / 8 - 2) g), " \
+                 "'') where id >= %s and id < %s"
+
+
+def update_in_batches(schema_editor, query):
+    """
+    Rewrite comments by ranges of ids, each range in its own short transaction
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("select min(id), max(id) from public.comments")
+        min_id, max_id = cursor.fetchone()
+
+        if min_id is None:
+            return
+
+        for start in range(min_id, max_id + 1, BATCH_SIZE):
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute(query, [start, start + BATCH_SIZE])
+
+
+def fill_tree_paths(apps, schema_editor):
+    update_in_batches(schema_editor, FORWARD_QUERY)
+
+
+def fill_paths(apps, schema_editor):
+    update_in_batches(schema_editor, BACKWARD_QUERY)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('backend', '0007_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='tree_path',
+            field=models.TextField(db_collation='C', default=''),
+        ),
+        migrations.RunPython(fill_tree_paths, fill_paths),
+        migrations.RemoveField(
+            model_name='comment',
+            name='path',
+        ),
+        AddIndexConcurrently(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.BTreeIndex(fields=['post', 'tree_path'], name='comment_post_tree_path_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.5 on 2026-10-18 20:45
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('backend', '0009_comment_reply_counts'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.BTreeIndex(models.F('post'), django.db.models.functions.text.Length('tree_path'), models.F('tree_path'), name='comment_post_depth_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.5 on 2026-10-18 21:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_comment_depth_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostCounterShard',
+            fields=[
+                ('id', models.BigAutoField(editable=False, primary_key=True, serialize=False)),
+                ('shard', models.SmallIntegerField()),
+                ('total', models.IntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counter_shards', to='backend.post')),
+            ],
+            options={
+                'db_table': 'post_counter_shards',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='postcountershard',
+            constraint=models.UniqueConstraint(fields=('post', 'shard'), name='post_counter_shard_unique'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.1.5 on 2026-10-18 21:52
+
+from django.db import migrations, transaction
+
+from backend.partitions import concurrent_index_statements
+
+BATCH_SIZE = 10000
+
+# Same configuration as backend.search.SEARCH_CONFIG
+TRIGGER_QUERY = "CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF body ON public.{table} " \
+                "FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.english', body)"
+
+BACKFILL_QUERY = "UPDATE public.{table} SET search_vector = to_tsvector('pg_catalog.english', body) " \
+                 "where id >= %s and id < %s and search_vector is null"
+
+
+def add_search_vectors(apps, schema_editor):
+    """
+    The column is added without a default, so the tables are not rewritten, and rows written from now on get their
+    vector from the trigger
+    """
+    with schema_editor.connection.cursor() as cursor:
+        for table in ('posts', 'comments'):
+            cursor.execute(f"ALTER TABLE public.{table} ADD COLUMN IF NOT EXISTS search_vector tsvector")
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector ON public.{table}")
+            cursor.execute(TRIGGER_QUERY.format(table=table))
+
+
+def backfill_search_vectors(apps, schema_editor):
+    """
+    Fill the vectors of existing rows by ranges of ids, each range in its own short transaction
+    """
+    with schema_editor.connection.cursor() as cursor:
+        for table in ('posts', 'comments'):
+            cursor.execute(f"select min(id), max(id) from public.{table}")
+            min_id, max_id = cursor.fetchone()
+
+            if min_id is None:
+                continue
+
+            for start in range(min_id, max_id + 1, BATCH_SIZE):
+                with transaction.atomic(using=schema_editor.connection.alias):
+                    cursor.execute(BACKFILL_QUERY.format(table=table), [start, start + BATCH_SIZE])
+
+
+def create_search_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS post_search_idx ON public.posts "
+                       "USING gin (search_vector)")
+        for statement in concurrent_index_statements(cursor, 'comment_search_idx', 'USING gin (search_vector)'):
+            cursor.execute(statement)
+
+
+def remove_search_vectors(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, index in (('posts', 'post_search_idx'), ('comments', 'comment_search_idx')):
+            cursor.execute(f"DROP INDEX IF EXISTS public.{index}")
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector ON public.{table}")
+            cursor.execute(f"ALTER TABLE public.{table} DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('backend', '0011_post_counter_shards'),
+    ]
+
+    # search_vector is only read by backend.search, so it is not a field of the models
+    operations = [
+        migrations.RunPython(add_search_vectors, remove_search_vectors),
+        migrations.RunPython(backfill_search_vectors, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.5 on 2026-10-18 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_search_vectors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='deleted',
+            field=models.BooleanField(default=False),
+        ),
+        # Kept in the database for the inserts and copies listing their columns, e.g. of generate_dataset
+        migrations.RunSQL("ALTER TABLE public.comments ALTER COLUMN deleted SET DEFAULT false",
+                          "ALTER TABLE public.comments ALTER COLUMN deleted DROP DEFAULT"),
+    ]
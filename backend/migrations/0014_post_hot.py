@@ -0,0 +1,71 @@
+# Generated by Django 4.1.5 on 2026-10-18 23:40
+
+from django.db import migrations, transaction
+
+from backend.ranking import hot_score_sql, hot_trigger_source
+
+BATCH_SIZE = 10000
+
+TRIGGER_FUNCTION_QUERY = "CREATE OR REPLACE FUNCTION public.posts_hot() RETURNS trigger AS $$ " + \
+                         hot_trigger_source() + " $$ LANGUAGE plpgsql"
+
+TRIGGER_QUERY = "CREATE TRIGGER posts_hot BEFORE INSERT OR UPDATE OF total_comments, created_at ON public.posts " \
+                "FOR EACH ROW EXECUTE FUNCTION public.posts_hot()"
+
+BACKFILL_QUERY = "UPDATE public.posts SET hot = " + hot_score_sql() + " where id >= %s and id < %s and hot is null"
+
+
+def add_hot(apps, schema_editor):
+    """
+    The column is added without a default, so the table is not rewritten, and rows written from now on get their
+    score from the trigger
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("ALTER TABLE public.posts ADD COLUMN IF NOT EXISTS hot double precision")
+        cursor.execute(TRIGGER_FUNCTION_QUERY)
+        cursor.execute("DROP TRIGGER IF EXISTS posts_hot ON public.posts")
+        cursor.execute(TRIGGER_QUERY)
+
+
+def backfill_hot(apps, schema_editor):
+    """
+    Fill the scores of existing rows by ranges of ids, each range in its own short transaction
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("select min(id), max(id) from public.posts")
+        min_id, max_id = cursor.fetchone()
+
+        if min_id is None:
+            return
+
+        for start in range(min_id, max_id + 1, BATCH_SIZE):
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute(BACKFILL_QUERY, [start, start + BATCH_SIZE])
+
+
+def create_hot_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS post_hot_idx ON public.posts (hot DESC, id DESC)")
+
+
+def remove_hot(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX IF EXISTS public.post_hot_idx")
+        cursor.execute("DROP TRIGGER IF EXISTS posts_hot ON public.posts")
+        cursor.execute("DROP FUNCTION IF EXISTS public.posts_hot()")
+        cursor.execute("ALTER TABLE public.posts DROP COLUMN IF EXISTS hot")
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('backend', '0013_comment_deleted'),
+    ]
+
+    # hot is only read to order posts when their ranking is not in redis, so it is not a field of the model
+    operations = [
+        migrations.RunPython(add_hot, remove_hot),
+        migrations.RunPython(backfill_hot, migrations.RunPython.noop),
+        migrations.RunPython(create_hot_index, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,9 @@
 from django.contrib.postgres.indexes import BTreeIndex
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Length
+
+from backend.paths import display_path
 
 
 class Post(models.Model):
@@ -10,26 +14,69 @@ class Post(models.Model):
 
     class Meta:
         db_table = 'posts'
-        BTreeIndex(
-            'total_comments',
-            name='total_comments_idx',
-        )
+        indexes = [
+            BTreeIndex(
+                fields=['-total_comments', '-id'],
+                name='total_comments_idx',
+            ),
+            BTreeIndex(
+                fields=['-created_at', '-id'],
+                name='post_created_at_idx',
+            ),
+        ]
 
 
 class Comment(models.Model):
     id = models.AutoField(primary_key=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True, editable=False, null=False, blank=False)
     body = models.TextField()
-    path = models.CharField(max_length=255, default='')
+    tree_path = models.TextField(db_collation='C', default='')
+    reply_count = models.IntegerField(default=0)
+    descendant_count = models.IntegerField(default=0)
+    # Deleted comments keeping their replies, their body being replaced
+    deleted = models.BooleanField(default=False)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
 
     class Meta:
         db_table = 'comments'
-        BTreeIndex(
-            ('post', 'created_at'),
-            name='post_created_at_idx',
-        )
-        BTreeIndex(
-            'path',
-            name='path_idx'
-        )
+        indexes = [
+            BTreeIndex(
+                fields=['post', '-created_at', '-id'],
+                name='comment_post_created_at_idx',
+            ),
+            BTreeIndex(
+                fields=['post', 'tree_path'],
+                name='comment_post_tree_path_idx',
+            ),
+            BTreeIndex(
+                F('post'), Length('tree_path'), F('tree_path'),
+                name='comment_post_depth_idx',
+            ),
+        ]
+
+    @property
+    def path(self):
+        return display_path(self.tree_path)
+
+
+class PostCounterShard(models.Model):
+    id = models.BigAutoField(primary_key=True, editable=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='counter_shards')
+    shard = models.SmallIntegerField()
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'post_counter_shards'
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'shard'], name='post_counter_shard_unique'),
+        ]
+
+
+class CounterFlush(models.Model):
+    id = models.AutoField(primary_key=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True, editable=False, null=False, blank=False)
+    batch_id = models.CharField(max_length=32, unique=True)
+    total_posts = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'counter_flushes'
@@ -0,0 +1,257 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from backend.snapshots import RankingPages
+
+
+# Types of the values of cursors in JSON by internal type of their ordering field, datetimes being in ISO format
+POSITION_TYPES = {
+    'AutoField': int,
+    'IntegerField': int,
+    'FloatField': (int, float),
+    'DateTimeField': str,
+}
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the ordering columns of a queryset, e.g. ('-created_at', '-id').
+    A cursor holds the ordering values of the first or last item of a page, and the next page is read with
+    an index range scan starting after them, so deep pages cost the same as the first one and nothing is counted.
+    The ordering must end with a unique column.
+    """
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_limit(request)
+        self.ordering = self.get_ordering(queryset, view)
+        position, reverse = self.decode_cursor(request)
+        if position is not None and not self.valid_position(position, queryset):
+            raise NotFound(self.invalid_cursor_message)
+
+        """
+        Items are read in the reverse ordering when going backwards from a cursor.
+        A list is an already ordered first page, e.g. a ranking served from redis.
+        """
+        if isinstance(queryset, list):
+            items = queryset[:self.limit + 1]
+        else:
+            items = self.fetch(queryset, position, reverse)
+
+        has_more = len(items) > self.limit
+        items = items[:self.limit]
+
+        if reverse:
+            items.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_position = None
+        self.previous_position = None
+        if items:
+            if has_next:
+                self.next_position = self.get_position(items[-1], view)
+            if has_previous:
+                self.previous_position = self.get_position(items[0], view)
+
+        return items
+
+    def fetch(self, queryset, position, reverse):
+        """
+        Items of the page and one more, read after `position`
+        """
+        ordering = [self.reverse_field(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(position, ordering))
+
+        return list(queryset[:self.limit + 1])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+    def get_limit(self, request):
+        """
+        Size of a page, the default one without a limit and at most max_limit
+        """
+        if self.limit_query_param not in request.query_params:
+            return self.default_limit
+
+        try:
+            return _positive_int(request.query_params[self.limit_query_param], strict=True, cutoff=self.max_limit)
+        except ValueError:
+            raise ValidationError({self.limit_query_param: 'Must be a positive integer'})
+
+    def get_ordering(self, queryset, view):
+        if hasattr(view, 'get_keyset_ordering'):
+            return view.get_keyset_ordering()
+
+        return queryset.query.order_by
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(position, ordering):
+        """
+        Filter of the items after `position` in `ordering`, e.g. for ('-created_at', '-id'):
+        created_at < position[0] OR (created_at = position[0] AND id < position[1])
+        """
+        condition = None
+        for field, value in reversed(list(zip(ordering, position))):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            field = field.lstrip('-')
+            beyond = Q(**{f'{field}__{lookup}': value})
+            condition = beyond if condition is None else beyond | (Q(**{field: value}) & condition)
+
+        return condition
+
+    def get_position(self, item, view):
+        if hasattr(view, 'get_keyset_position'):
+            return view.get_keyset_position(item)
+
+        fields = [field.lstrip('-') for field in self.ordering]
+        if isinstance(item, dict):
+            return [item[field] for field in fields]
+
+        return [getattr(item, field) for field in fields]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in position]
+        cursor = {'p': values, 'r': int(reverse)}
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode('ascii')
+
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position = cursor['p']
+            reverse = bool(cursor.get('r', 0))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def get_position_types(self, queryset):
+        """
+        Types of the values of a cursor, from the fields or annotations of the ordering of a queryset
+        """
+        types = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            annotation = queryset.query.annotations.get(name)
+            output_field = queryset.model._meta.get_field(name) if annotation is None else annotation.output_field
+            types.append(POSITION_TYPES[output_field.get_internal_type()])
+
+        return types
+
+    def valid_position(self, position, queryset):
+        """
+        Whether the values of a cursor can be compared to their ordering fields, so a forged cursor is not found
+        instead of failing its query
+        """
+        for value, types in zip(position, self.get_position_types(queryset)):
+            if isinstance(value, bool) or not isinstance(value, types):
+                return False
+            if isinstance(value, str):
+                try:
+                    if parse_datetime(value) is None:
+                        return False
+                except ValueError:
+                    return False
+
+        return True
+
+
+class RankingPagination(KeysetPagination):
+    default_limit = 10
+    # Pages bigger than the snapshot are read from the sorted set of the ranking
+    max_limit = 100
+
+    def fetch(self, queryset, position, reverse):
+        # Next pages of a ranking served from redis are read from its sorted set
+        if isinstance(queryset, RankingPages):
+            return queryset.fetch(position, reverse, self.limit + 1)
+
+        return super().fetch(queryset, position, reverse)
+
+    def get_position_types(self, queryset):
+        # Positions in a sorted set are a score and a post id
+        if isinstance(queryset, RankingPages):
+            return (int, float), int
+
+        return super().get_position_types(queryset)
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Keyset pagination of the rows of a Search, ordered by ('-rank', '-id')
+    """
+    default_limit = 20
+    max_limit = 100
+
+    def get_ordering(self, search, view):
+        return '-rank', '-id'
+
+    def fetch(self, search, position, reverse):
+        return search.fetch(position, reverse, self.limit + 1)
+
+    def get_position_types(self, search):
+        return (int, float), int
@@ -0,0 +1,212 @@
+"""
+Hash partitioning of comments table by post_id.
+All the comments of a post are in the same partition, so queries of a post filtering on post_id are pruned to a single
+partition, and counts grouped by post_id are computed one partition at a time. An unpartitioned comments table is
+moved online by the partition_comments command:
+- comments_partitioned is created with the columns, indexes, foreign keys and triggers of comments, and a trigger on
+  comments mirrors every write to it;
+- existing rows are copied in batches of ids, locking each batch so a concurrent write waits for its copy;
+- both tables are swapped in a short transaction, comments keeping its sequence and the names of its indexes. The
+  previous table is kept as comments_unpartitioned.
+A partitioned table cannot have an identity column before Postgres 17, so when the id of comments is an identity
+column the new table gets a sequence of its own, continuing from the last id of the identity, which is then stopped
+there.
+"""
+TABLE = 'comments'
+PARTITIONED_TABLE = 'comments_partitioned'
+PREVIOUS_TABLE = 'comments_unpartitioned'
+PARTITION_TABLE = 'comments_p{remainder}'
+MIRROR_TRIGGER = 'comments_mirror'
+
+# New indexes are renamed to the names of the indexes they replace when the tables are swapped
+NEW_INDEX_SUFFIX = '_part'
+PREVIOUS_INDEX_SUFFIX = '_unpartitioned'
+
+PARTITIONS_QUERY = "select inhrelid::regclass::text from pg_inherits " \
+                   "where inhparent = 'public.comments'::regclass order by 1"
+
+COLUMNS_QUERY = "select attname from pg_attribute where attrelid = %s::regclass and attnum > 0 " \
+                "and not attisdropped and attgenerated = '' order by attnum"
+
+INDEXES_QUERY = "select i.relname, pg_get_indexdef(i.oid) from pg_index x join pg_class i on i.oid = x.indexrelid " \
+                "where x.indrelid = %s::regclass and not x.indisprimary order by i.relname"
+
+FOREIGN_KEYS_QUERY = "select conname, pg_get_constraintdef(oid) from pg_constraint " \
+                     "where conrelid = %s::regclass and contype = 'f' order by conname"
+
+TRIGGERS_QUERY = "select tgname, pg_get_triggerdef(oid) from pg_trigger " \
+                 "where tgrelid = %s::regclass and not tgisinternal and tgname <> %s order by tgname"
+
+
+def comment_tables(cursor):
+    """
+    Partitions of comments table, or the table itself when it is not partitioned
+    """
+    cursor.execute(PARTITIONS_QUERY)
+    return [row[0] for row in cursor.fetchall()] or [f'public.{TABLE}']
+
+
+def has_identity(cursor):
+    cursor.execute(f"select attidentity <> '' from pg_attribute where attrelid = 'public.{TABLE}'::regclass "
+                   f"and attname = 'id'")
+    return cursor.fetchone()[0]
+
+
+def is_partitioned(cursor):
+    cursor.execute("select relkind = 'p' from pg_class where oid = 'public.comments'::regclass")
+    return cursor.fetchone()[0]
+
+
+def table_exists(cursor, table):
+    cursor.execute("select to_regclass(%s) is not null", [f'public.{table}'])
+    return cursor.fetchone()[0]
+
+
+def table_layout(cursor, table=TABLE):
+    """
+    Columns, (name, definition) of indexes and foreign keys, and (name, definition) of triggers of a table
+    """
+    relation = f'public.{table}'
+    cursor.execute(COLUMNS_QUERY, [relation])
+    columns = [row[0] for row in cursor.fetchall()]
+    cursor.execute(INDEXES_QUERY, [relation])
+    indexes = cursor.fetchall()
+    cursor.execute(FOREIGN_KEYS_QUERY, [relation])
+    foreign_keys = cursor.fetchall()
+    cursor.execute(TRIGGERS_QUERY, [relation, MIRROR_TRIGGER])
+    triggers = cursor.fetchall()
+
+    return columns, indexes, foreign_keys, triggers
+
+
+def concurrent_index_statements(cursor, name, definition):
+    """
+    Create an index of comments without blocking its writes, e.g. `definition` 'USING gin (search_vector)'.
+    An index cannot be created concurrently on a partitioned table, so it is created on the table alone, invalid
+    until an index built concurrently on every partition is attached to it.
+    """
+    if not is_partitioned(cursor):
+        return [f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON public.{TABLE} {definition}"]
+
+    statements = [f"CREATE INDEX IF NOT EXISTS {name} ON ONLY public.{TABLE} {definition}"]
+    for partition in comment_tables(cursor):
+        partition_index = f"{name}_{partition.split('.')[-1]}"
+        statements += [
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} {definition}",
+            f"ALTER INDEX {name} ATTACH PARTITION {partition_index}",
+        ]
+
+    return statements
+
+
+def on_table(definition, table):
+    return definition.replace(f' ON public.{TABLE} ', f' ON public.{table} ', 1)
+
+
+def mirror_function(columns):
+    """
+    Trigger function applying a write of comments to comments_partitioned, an update being a delete and an insert
+    in case it moves the comment to another post
+    """
+    names = ', '.join(columns)
+    values = ', '.join(f'NEW.{column}' for column in columns)
+
+    return f"""
+CREATE OR REPLACE FUNCTION public.{MIRROR_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM public.{PARTITIONED_TABLE} WHERE post_id = OLD.post_id AND id = OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.{PARTITIONED_TABLE} ({names}) VALUES ({values});
+    END IF;
+    RETURN NULL;
+END $$
+"""
+
+
+def prepare_statements(partitions, layout):
+    """
+    Create comments_partitioned and its partitions like comments, and start mirroring the writes of comments
+    """
+    columns, indexes, foreign_keys, triggers = layout
+
+    statements = [
+        f"CREATE TABLE public.{PARTITIONED_TABLE} (LIKE public.{TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+        f"INCLUDING STORAGE INCLUDING GENERATED, PRIMARY KEY (post_id, id)) PARTITION BY HASH (post_id)",
+    ]
+    statements += [f"CREATE TABLE public.{PARTITION_TABLE.format(remainder=remainder)} "
+                   f"PARTITION OF public.{PARTITIONED_TABLE} FOR VALUES WITH (MODULUS {partitions}, "
+                   f"REMAINDER {remainder})" for remainder in range(partitions)]
+    statements += [on_table(definition, PARTITIONED_TABLE).replace(f' {name} ON ', f' {name}{NEW_INDEX_SUFFIX} ON ', 1)
+                   for name, definition in indexes]
+    statements += [f"ALTER TABLE public.{PARTITIONED_TABLE} ADD CONSTRAINT {name} {definition}"
+                   for name, definition in foreign_keys]
+    statements += [on_table(definition, PARTITIONED_TABLE) for name, definition in triggers]
+    statements += [
+        mirror_function(columns),
+        f"CREATE TRIGGER {MIRROR_TRIGGER} AFTER INSERT OR UPDATE OR DELETE ON public.{TABLE} "
+        f"FOR EACH ROW EXECUTE FUNCTION public.{MIRROR_TRIGGER}()",
+    ]
+
+    return statements
+
+
+def copy_batch_query(columns):
+    """
+    Copy the comments with ids in (%s, %s]. Rows are locked until the batch is committed, so a write of one of them
+    is mirrored after its copy, and rows already mirrored are kept.
+    """
+    names = ', '.join(columns)
+
+    return f"INSERT INTO public.{PARTITIONED_TABLE} ({names}) SELECT {names} FROM public.{TABLE} " \
+           f"WHERE id > %s AND id <= %s FOR SHARE ON CONFLICT DO NOTHING"
+
+
+def stop_identity_statement(sequence):
+    """
+    Ids allocated from the identity sequence while the tables are swapped would also be given by the new sequence,
+    so the identity sequence is stopped at its last value
+    """
+    return f"DO $$ BEGIN EXECUTE format('ALTER SEQUENCE {sequence} MAXVALUE %s', " \
+           f"(select last_value from {sequence})); END $$"
+
+
+def swap_statements(sequence, index_names, identity=False):
+    """
+    Replace comments by comments_partitioned, run in a single transaction. The sequence of an identity is renamed
+    like the indexes, which waits for the ids being allocated from it, and a new sequence takes its name.
+    """
+    previous_sequence = f"{sequence}{PREVIOUS_INDEX_SUFFIX}"
+    statements = [
+        f"LOCK TABLE public.{TABLE}, public.{PARTITIONED_TABLE} IN ACCESS EXCLUSIVE MODE",
+        f"DROP TRIGGER {MIRROR_TRIGGER} ON public.{TABLE}",
+        f"DROP FUNCTION public.{MIRROR_TRIGGER}()",
+    ]
+    if identity:
+        statements += [
+            f"ALTER SEQUENCE {sequence} RENAME TO {previous_sequence.split('.')[-1]}",
+            stop_identity_statement(previous_sequence),
+        ]
+    else:
+        statements += [f"ALTER TABLE public.{TABLE} ALTER COLUMN id DROP DEFAULT"]
+    statements += [
+        f"ALTER TABLE public.{TABLE} RENAME TO {PREVIOUS_TABLE}",
+        f"ALTER TABLE public.{PREVIOUS_TABLE} RENAME CONSTRAINT {TABLE}_pkey TO {PREVIOUS_TABLE}_pkey",
+    ]
+    statements += [f"ALTER INDEX public.{name} RENAME TO {name}{PREVIOUS_INDEX_SUFFIX}" for name in index_names]
+    statements += [
+        f"ALTER TABLE public.{PARTITIONED_TABLE} RENAME TO {TABLE}",
+        f"ALTER TABLE public.{TABLE} RENAME CONSTRAINT {PARTITIONED_TABLE}_pkey TO {TABLE}_pkey",
+    ]
+    statements += [f"ALTER INDEX public.{name}{NEW_INDEX_SUFFIX} RENAME TO {name}" for name in index_names]
+    if identity:
+        statements += [
+            f"CREATE SEQUENCE {sequence} OWNED BY public.{TABLE}.id",
+            f"SELECT setval('{sequence}', last_value) FROM {previous_sequence}",
+            f"ALTER TABLE public.{TABLE} ALTER COLUMN id SET DEFAULT nextval('{sequence}')",
+        ]
+    else:
+        statements += [f"ALTER SEQUENCE {sequence} OWNED BY public.{TABLE}.id"]
+
+    return statements
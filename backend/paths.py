@@ -0,0 +1,46 @@
+from django.db import connection
+
+"""
+Materialized path of comments.
+The tree path of a comment is the ids of its ancestors followed by its own id, each written as a fixed-width
+hexadecimal segment, e.g. '0000000400000005' for comment 5 replying to comment 4. Tree paths are compared
+byte by byte (C collation), so ordering comments by tree path lists any subtree in depth-first order, and a
+subtree is a single range of the (post_id, tree_path) index.
+"""
+SEGMENT_WIDTH = 8
+
+
+def encode_segment(comment_id):
+    return format(comment_id, f'0{SEGMENT_WIDTH}x')
+
+
+def child_path(parent_path, comment_id):
+    return f'{parent_path}{encode_segment(comment_id)}'
+
+
+def path_ids(tree_path):
+    """
+    Ids of the comments of a tree path, from the root to the comment itself
+    """
+    return [int(tree_path[i:i + SEGMENT_WIDTH], 16) for i in range(0, len(tree_path), SEGMENT_WIDTH)]
+
+
+def depth(tree_path):
+    return len(tree_path) // SEGMENT_WIDTH
+
+
+def display_path(tree_path):
+    """
+    Ids of the ancestors of a comment joined by '/', e.g. '/4' for comment 5 replying to comment 4
+    """
+    return ''.join(f'/{comment_id}' for comment_id in path_ids(tree_path)[:-1])
+
+
+def allocate_comment_ids(total):
+    """
+    Reserve ids of new comments from the sequence of comments table, so their tree paths are known before insertion
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("select nextval(pg_get_serial_sequence('public.comments', 'id')) from generate_series(1, %s)",
+                       [total])
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,66 @@
+import math
+from datetime import datetime, timezone
+
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+"""
+Redis sorted sets used to rank posts.
+TOP_KEY keeps the raw number of comments of every post, HOT_KEY keeps the time-decayed hot score.
+"""
+TOP_KEY = 'comments'
+HOT_KEY = 'posts:hot'
+
+SORT_HOT = 'hot'
+SORT_TOP = 'top'
+SORT_NEW = 'new'
+SORTS = (SORT_HOT, SORT_TOP, SORT_NEW)
+
+# Scores are measured from this epoch to keep them small and precise
+HOT_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+# A post needs 10 times more comments every HOT_DECAY_SECONDS to keep its hot rank. Not a setting: the posts_hot
+# trigger computes the same score, and changing it needs a migration replacing the trigger and the scores.
+HOT_DECAY_SECONDS = 45000
+
+
+def hot_score(total_comments, created_at):
+    """
+    Hot score of a post: log-scaled activity plus recency.
+    Every HOT_DECAY_SECONDS a post needs 10 times more comments to keep its rank, so the score
+    of a post only changes when it gets a new comment and never has to be recomputed over time.
+    """
+    activity = math.log10(max(total_comments, 1))
+
+    return round(activity + hot_recency(created_at), 7)
+
+
+def hot_recency(created_at):
+    return (created_at - HOT_EPOCH).total_seconds() / HOT_DECAY_SECONDS
+
+
+def hot_score_sql(row=''):
+    """
+    Formula of hot_score in SQL, of the columns of `row`, e.g. NEW. in a trigger
+    """
+    return f"log(greatest({row}total_comments, 1)::double precision) + " \
+           f"(extract(epoch from {row}created_at)::double precision - {int(HOT_EPOCH.timestamp())}) / " \
+           f"{HOT_DECAY_SECONDS}"
+
+
+def hot_trigger_source():
+    """
+    Body of the posts_hot trigger function setting the hot column of posts
+    """
+    return f"BEGIN NEW.hot := {hot_score_sql('NEW.')}; RETURN NEW; END"
+
+
+def hot_score_column():
+    """
+    Hot score of posts kept in the hot column of posts table, set by a trigger with the formula of hot_score, so
+    posts are ordered by it with an index when Redis is unavailable
+    """
+    return RawSQL('"posts"."hot"', (), output_field=FloatField())
+
+
+def ranking_key(sort):
+    return HOT_KEY if sort == SORT_HOT else TOP_KEY
@@ -0,0 +1,302 @@
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import redis
+import redis.asyncio
+from django.conf import settings
+from redis.asyncio.client import Pipeline as AsyncPipeline
+from redis.client import Pipeline
+
+from backend.metrics import record_breaker, record_redis
+from config import *
+
+"""
+States of a circuit breaker, as reported by the redis_breaker_state metric
+"""
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+
+class ReplyTimeoutError(redis.exceptions.ConnectionError):
+    """
+    A command sent to redis without a reply in time. It is a connection error, so callers fall back like when redis
+    is unreachable, but the command may have run: writes that must not be applied twice tell it apart.
+    """
+
+
+class PoolExhaustedError(redis.exceptions.ConnectionError):
+    """
+    No connection of the pool of the worker was freed within REDIS_POOL_TIMEOUT. Callers fall back like when redis
+    is unreachable, but redis was not reached, so the circuit breaker does not count it as a failure.
+    """
+
+
+# Message of the ConnectionError raised by redis-py pools without a free connection in time
+POOL_EXHAUSTED_MESSAGE = 'No connection available.'
+
+
+class BlockingConnectionPool(redis.BlockingConnectionPool):
+    """
+    Pool raising PoolExhaustedError when no connection is freed in time
+    """
+
+    def get_connection(self, command_name, *keys, **options):
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except redis.exceptions.ConnectionError as error:
+            if str(error) == POOL_EXHAUSTED_MESSAGE:
+                raise PoolExhaustedError(POOL_EXHAUSTED_MESSAGE) from error
+            raise
+
+
+class AsyncBlockingConnectionPool(redis.asyncio.BlockingConnectionPool):
+    """
+    Async BlockingConnectionPool
+    """
+
+    async def get_connection(self, command_name, *keys, **options):
+        try:
+            return await super().get_connection(command_name, *keys, **options)
+        except redis.exceptions.ConnectionError as error:
+            if str(error) == POOL_EXHAUSTED_MESSAGE:
+                raise PoolExhaustedError(POOL_EXHAUSTED_MESSAGE) from error
+            raise
+
+
+class CircuitBreaker:
+    """
+    After `failures` connection errors or timeouts in a row, commands fail at once with a ConnectionError for
+    `cooldown` seconds instead of waiting for redis, so the callers fall back to the database right away. Then a
+    single command is let through to probe redis: the breaker closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(self, failures, cooldown, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = CLOSED
+        self.failures_in_row = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+        record_breaker(CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        record_breaker(state)
+
+    def before_call(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and self.clock() - self.opened_at >= self.cooldown:
+                self._set_state(HALF_OPEN)
+                return
+
+        record_breaker(self.state, rejected=True)
+        raise redis.exceptions.ConnectionError('Circuit breaker is open')
+
+    def record_success(self):
+        with self._lock:
+            self.failures_in_row = 0
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures_in_row += 1
+            if self.state == HALF_OPEN or self.failures_in_row >= self.failures:
+                self.opened_at = self.clock()
+                self._set_state(OPEN)
+
+    def abort_call(self):
+        """
+        A probe ended by something else than a reply or a redis error, e.g. a cancelled task or no free connection
+        in the pool, is probed again
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.opened_at = self.clock() - self.cooldown
+                self._set_state(OPEN)
+
+    @contextmanager
+    def guard(self):
+        """
+        Timeouts are raised as ReplyTimeoutError, a connection error, which callers already handle by falling back to
+        the database
+        """
+        self.before_call()
+        try:
+            yield
+        except redis.exceptions.TimeoutError as error:
+            self.record_failure()
+            raise ReplyTimeoutError(str(error)) from error
+        except PoolExhaustedError:
+            # The worker is busy, not redis
+            self.abort_call()
+            raise
+        except redis.exceptions.ConnectionError:
+            self.record_failure()
+            raise
+        except redis.exceptions.RedisError:
+            # Redis replied, with an error
+            self.record_success()
+            raise
+        except BaseException:
+            self.abort_call()
+            raise
+
+        self.record_success()
+
+    def call(self, function, *args, **kwargs):
+        with self.guard():
+            return function(*args, **kwargs)
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    Redis client recording the time and errors of every command in the metrics of the current request. Commands go
+    through `breaker` when it is given.
+    """
+
+    def __init__(self, *args, breaker=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    def execute_command(self, *args, **options):
+        if self.breaker is None:
+            return self._execute_command(*args, **options)
+        return self.breaker.call(self._execute_command, *args, **options)
+
+    def _execute_command(self, *args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            record_redis(str(args[0]).lower(), time.perf_counter() - start, failed)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipeline = InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipeline.breaker = self.breaker
+        return pipeline
+
+
+class InstrumentedPipeline(Pipeline):
+    """
+    Pipeline recorded as a single command, it is a single round trip
+    """
+    breaker = None
+
+    def execute(self, raise_on_error=True):
+        if self.breaker is None:
+            return self._execute(raise_on_error)
+        return self.breaker.call(self._execute, raise_on_error)
+
+    def _execute(self, raise_on_error):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(raise_on_error)
+            failed = False
+            return result
+        finally:
+            record_redis('pipeline', time.perf_counter() - start, failed)
+
+
+class AsyncInstrumentedRedis(redis.asyncio.Redis):
+    """
+    Asyncio version of InstrumentedRedis
+    """
+
+    def __init__(self, *args, breaker=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    async def execute_command(self, *args, **options):
+        if self.breaker is None:
+            return await self._execute_command(*args, **options)
+        with self.breaker.guard():
+            return await self._execute_command(*args, **options)
+
+    async def _execute_command(self, *args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            record_redis(str(args[0]).lower(), time.perf_counter() - start, failed)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipeline = AsyncInstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+        pipeline.breaker = self.breaker
+        return pipeline
+
+
+class AsyncInstrumentedPipeline(AsyncPipeline):
+    breaker = None
+
+    async def execute(self, raise_on_error=True):
+        if self.breaker is None:
+            return await self._execute(raise_on_error)
+        with self.breaker.guard():
+            return await self._execute(raise_on_error)
+
+    async def _execute(self, raise_on_error):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute(raise_on_error)
+            failed = False
+            return result
+        finally:
+            record_redis('pipeline', time.perf_counter() - start, failed)
+
+
+def pool_options(**kwargs):
+    """
+    Pools of a worker process wait up to REDIS_POOL_TIMEOUT for a free connection when all REDIS_MAX_CONNECTIONS
+    are in use, instead of opening more
+    """
+    return dict(host=host, port=6379, db=0, encoding='utf-8', decode_responses=True,
+                max_connections=settings.REDIS_MAX_CONNECTIONS, timeout=settings.REDIS_POOL_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+                health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL, socket_keepalive=True, **kwargs)
+
+
+# Sync and asyncio clients of a process talk to the same redis, so they share its breaker
+redis_breaker = CircuitBreaker(settings.REDIS_BREAKER_FAILURES, settings.REDIS_BREAKER_COOLDOWN)
+
+redis_client = None
+# Subscriptions block on reads until a message comes, so they have no socket timeout and no breaker
+pubsub_client = None
+try:
+    redis_client = InstrumentedRedis(
+        connection_pool=BlockingConnectionPool(**pool_options(socket_timeout=settings.REDIS_SOCKET_TIMEOUT)),
+        breaker=redis_breaker)
+    pubsub_client = redis.Redis(connection_pool=redis.BlockingConnectionPool(**pool_options()))
+except Exception:
+    pass
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def async_redis_client():
+    """
+    Asyncio client of the running event loop, connections of an asyncio client can only be used by the loop they
+    were opened in
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool = AsyncBlockingConnectionPool(**pool_options(socket_timeout=settings.REDIS_SOCKET_TIMEOUT))
+        client = _async_clients[loop] = AsyncInstrumentedRedis(connection_pool=pool, breaker=redis_breaker)
+
+    return client
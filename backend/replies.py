@@ -0,0 +1,70 @@
+from collections import defaultdict
+
+from django.db import connection
+
+from backend.paths import path_ids
+
+"""
+Reply counts of comments.
+reply_count is the number of direct replies to a comment, descendant_count the number of comments in its whole
+subtree. Both are increased along the ancestors of every new comment, read from its tree path.
+"""
+
+
+def reply_increments(parent_paths):
+    """
+    Increments of (reply_count, descendant_count) of each ancestor of new comments with the given parent paths
+    """
+    increments = defaultdict(lambda: [0, 0])
+
+    for parent_path in parent_paths:
+        ancestor_ids = path_ids(parent_path)
+        if not ancestor_ids:
+            continue
+
+        increments[ancestor_ids[-1]][0] += 1
+        for ancestor_id in ancestor_ids:
+            increments[ancestor_id][1] += 1
+
+    return increments
+
+
+def add_replies(post_id, parent_paths):
+    """
+    Increase reply counts of all the ancestors of new comments of a post in a single statement
+    """
+    increments = reply_increments(parent_paths)
+    if not increments:
+        return
+
+    comment_ids = sorted(increments)
+    with connection.cursor() as cursor:
+        query = "UPDATE public.comments c SET reply_count = c.reply_count + v.replies, " \
+                "descendant_count = c.descendant_count + v.descendants " \
+                "from unnest(%s::integer[], %s::integer[], %s::integer[]) v(id, replies, descendants) " \
+                "where c.post_id = %s and c.id = v.id"
+        cursor.execute(query, [comment_ids,
+                               [increments[comment_id][0] for comment_id in comment_ids],
+                               [increments[comment_id][1] for comment_id in comment_ids],
+                               post_id])
+
+
+def recompute_reply_counts(first_post_id, last_post_id):
+    """
+    Recount reply counts of the comments of posts first_post_id to last_post_id from their tree paths.
+    Every comment adds one to the descendant count of each of its ancestors, and one to the reply count of its parent.
+    """
+    with connection.cursor() as cursor:
+        query = "UPDATE public.comments c SET reply_count = s.reply_count, descendant_count = s.descendant_count " \
+                "from (select c2.post_id, c2.id, coalesce(a.reply_count, 0) as reply_count, " \
+                "coalesce(a.descendant_count, 0) as descendant_count from public.comments c2 left join (" \
+                "select d.post_id, ('x' || substr(d.tree_path, g * 8 + 1, 8))::bit(32)::integer as id, " \
+                "count(*) filter (where g = length(d.tree_path) / 8 - 2) as reply_count, " \
+                "count(*) as descendant_count " \
+                "from public.comments d, generate_series(0, length(d.tree_path) / 8 - 2) g " \
+                "where d.post_id between %s and %s group by 1, 2) a on a.post_id = c2.post_id and a.id = c2.id " \
+                "where c2.post_id between %s and %s) s " \
+                "where c.post_id = s.post_id and c.id = s.id and c.post_id between %s and %s " \
+                "and (c.reply_count <> s.reply_count or c.descendant_count <> s.descendant_count)"
+        cursor.execute(query, [first_post_id, last_post_id] * 3)
+        return cursor.rowcount
@@ -0,0 +1,240 @@
+import asyncio
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.http import HttpResponse
+
+from backend.encoders import dumps
+from backend.metrics import record_fallback, record_response_cache
+from backend.redis_client import async_redis_client, redis_client
+from backend.routers import use_primary
+from backend.versions import set_version_headers
+
+"""
+Shared cache of rendered responses of the comments of posts, e.g. a post with its comments or a subtree.
+An entry holds the body of a response with the version of its post it was built from. An entry of an older version
+is stale: a single worker, holding the lock of the entry, rebuilds it while the others keep serving the stale body
+with its own ETag, so comment writes invalidate the entries of their post without deleting anything. Entries are
+evicted in least recently used order when their bodies add up to more than RESPONSE_CACHE_MAX_BYTES.
+"""
+RESPONSE_KEY = 'responses:{post_id}:{variant}'
+RESPONSE_LOCK_KEY = 'responses:{post_id}:{variant}:lock'
+RESPONSE_LRU_KEY = 'responses:lru'
+RESPONSE_BYTES_KEY = 'responses:bytes'
+
+HIT = 'hit'
+STALE = 'stale'
+MISS = 'miss'
+
+"""
+Store the entry KEYS[1] and evict the least recently used entries until the bodies of the entries in the KEYS[2]
+zset fit in ARGV[5] bytes, counted in KEYS[3]. The counter is reset when a single entry is left, in case entries
+were removed by something else.
+"""
+SET_RESPONSE_SCRIPT = """
+local previous = redis.call('hstrlen', KEYS[1], 'body')
+redis.call('hset', KEYS[1], 'etag', ARGV[1], 'modified', ARGV[2], 'body', ARGV[3])
+redis.call('zadd', KEYS[2], ARGV[4], KEYS[1])
+local total = redis.call('incrby', KEYS[3], string.len(ARGV[3]) - previous)
+while total > tonumber(ARGV[5]) do
+    local oldest = redis.call('zrange', KEYS[2], 0, 0)[1]
+    if not oldest or oldest == KEYS[1] then
+        redis.call('set', KEYS[3], string.len(ARGV[3]))
+        break
+    end
+    total = redis.call('incrby', KEYS[3], -redis.call('hstrlen', oldest, 'body'))
+    redis.call('del', oldest)
+    redis.call('zrem', KEYS[2], oldest)
+end
+return total
+"""
+
+_results = {HIT: 0, STALE: 0, MISS: 0}
+_results_lock = threading.Lock()
+
+
+def count_result(result):
+    record_response_cache(result)
+    with _results_lock:
+        _results[result] += 1
+
+
+def json_response(body, version):
+    return set_version_headers(HttpResponse(body, content_type='application/json'), version)
+
+
+def read_entry(key):
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hmget(key, 'etag', 'modified', 'body')
+    # Reading an entry makes it the most recently used one
+    pipeline.zadd(RESPONSE_LRU_KEY, {key: time.time()}, xx=True)
+    (etag, modified, body), _ = pipeline.execute()
+
+    return None if body is None else ((etag, int(modified)), body)
+
+
+def store_entry(key, version, body):
+    etag, last_modified = version
+    redis_client.eval(SET_RESPONSE_SCRIPT, 3, key, RESPONSE_LRU_KEY, RESPONSE_BYTES_KEY,
+                      etag, last_modified, body, time.time(), settings.RESPONSE_CACHE_MAX_BYTES)
+
+
+def build_body(build):
+    # A replica may not have the comments of the version yet, and a response is given the version of its body
+    with use_primary():
+        return dumps(build())
+
+
+def rebuild(key, lock_key, version, build):
+    body = build_body(build)
+    try:
+        if len(body) <= settings.RESPONSE_CACHE_MAX_ENTRY_BYTES:
+            store_entry(key, version, body)
+        redis_client.delete(lock_key)
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('response_cache')
+
+    return body
+
+
+def cacheable(request, version):
+    """
+    Only JSON responses are cached, and only with the version of their post
+    """
+    return settings.RESPONSE_CACHE_ENABLED and version is not None and request.accepted_renderer.format == 'json'
+
+
+def cached_response(post_id, variant, version, build):
+    """
+    JSON response of the data returned by `build` for the `version` of a post, from the cache when it holds the
+    body of this version. Without any entry, a worker waits up to RESPONSE_CACHE_WAIT seconds for the one
+    building it, then builds the body itself.
+    """
+    key = RESPONSE_KEY.format(post_id=post_id, variant=variant)
+    lock_key = RESPONSE_LOCK_KEY.format(post_id=post_id, variant=variant)
+    deadline = time.monotonic() + settings.RESPONSE_CACHE_WAIT
+
+    try:
+        while True:
+            entry = read_entry(key)
+            if entry is not None and entry[0][0] == version[0]:
+                count_result(HIT)
+                return json_response(entry[1], entry[0])
+
+            if redis_client.set(lock_key, 1, nx=True, ex=settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+                break
+
+            if entry is not None:
+                count_result(STALE)
+                return json_response(entry[1], entry[0])
+
+            if time.monotonic() >= deadline:
+                count_result(MISS)
+                return json_response(build_body(build), version)
+
+            time.sleep(0.02)
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('response_cache')
+        return json_response(build_body(build), version)
+
+    count_result(MISS)
+    return json_response(rebuild(key, lock_key, version, build), version)
+
+
+async def aread_entry(client, key):
+    pipeline = client.pipeline(transaction=False)
+    pipeline.hmget(key, 'etag', 'modified', 'body')
+    pipeline.zadd(RESPONSE_LRU_KEY, {key: time.time()}, xx=True)
+    (etag, modified, body), _ = await pipeline.execute()
+
+    return None if body is None else ((etag, int(modified)), body)
+
+
+async def abuild_body(build):
+    with use_primary():
+        return dumps(await build())
+
+
+async def arebuild(client, key, lock_key, version, build):
+    body = await abuild_body(build)
+    try:
+        if len(body) <= settings.RESPONSE_CACHE_MAX_ENTRY_BYTES:
+            etag, last_modified = version
+            await client.eval(SET_RESPONSE_SCRIPT, 3, key, RESPONSE_LRU_KEY, RESPONSE_BYTES_KEY,
+                              etag, last_modified, body, time.time(), settings.RESPONSE_CACHE_MAX_BYTES)
+        await client.delete(lock_key)
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('response_cache')
+
+    return body
+
+
+async def acached_response(post_id, variant, version, build):
+    """
+    Async cached_response, `build` being a coroutine function. Entries are shared with the sync views.
+    """
+    client = async_redis_client()
+    key = RESPONSE_KEY.format(post_id=post_id, variant=variant)
+    lock_key = RESPONSE_LOCK_KEY.format(post_id=post_id, variant=variant)
+    deadline = time.monotonic() + settings.RESPONSE_CACHE_WAIT
+
+    try:
+        while True:
+            entry = await aread_entry(client, key)
+            if entry is not None and entry[0][0] == version[0]:
+                count_result(HIT)
+                return json_response(entry[1], entry[0])
+
+            if await client.set(lock_key, 1, nx=True, ex=settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+                break
+
+            if entry is not None:
+                count_result(STALE)
+                return json_response(entry[1], entry[0])
+
+            if time.monotonic() >= deadline:
+                count_result(MISS)
+                return json_response(await abuild_body(build), version)
+
+            await asyncio.sleep(0.02)
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('response_cache')
+        return json_response(await abuild_body(build), version)
+
+    count_result(MISS)
+    return json_response(await arebuild(client, key, lock_key, version, build), version)
+
+
+def response_cache_stats():
+    """
+    Results of the lookups of this worker, and size of the shared cache
+    """
+    with _results_lock:
+        results = dict(_results)
+
+    lookups = sum(results.values())
+    stats = {
+        'hits': results[HIT],
+        'stale_hits': results[STALE],
+        'misses': results[MISS],
+        'hit_ratio': round((results[HIT] + results[STALE]) / lookups, 4) if lookups else None,
+        'max_bytes': settings.RESPONSE_CACHE_MAX_BYTES,
+    }
+
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.zcard(RESPONSE_LRU_KEY)
+        pipeline.get(RESPONSE_BYTES_KEY)
+        size, total_bytes = pipeline.execute()
+        stats.update(size=size, bytes=int(total_bytes or 0))
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('response_cache')
+
+    return stats
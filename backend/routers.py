@@ -0,0 +1,134 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from backend.metrics import record_replica_fallback
+
+"""
+Routing of reads to replicas.
+Queries of safe requests are read from one of the DATABASE_REPLICAS, chosen at random, while writes and every other
+query, e.g. of cron jobs and commands, go to the primary. A client that wrote something is pinned to the primary by
+a cookie for REPLICA_PIN_SECONDS, so it reads its own writes. The lag of every replica is checked at most every
+REPLICA_LAG_CHECK_INTERVAL seconds by each worker, and a replica lagging by more than REPLICA_MAX_LAG seconds, or
+unreachable, is skipped until its next check. Without any usable replica, reads go to the primary.
+"""
+REPLICA_PIN_COOKIE = 'primary_until'
+
+# A replica with nothing left to replay is not lagging, however old its last replayed transaction is
+LAG_QUERY = "select case when not pg_is_in_recovery() or pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() " \
+            "then 0 else extract(epoch from now() - pg_last_xact_replay_timestamp()) end"
+
+LAGGING = 'lag'
+UNAVAILABLE = 'unavailable'
+
+_use_replica = ContextVar('use_replica', default=False)
+_lag_checks = {}
+_lag_checks_lock = threading.Lock()
+
+
+def read_from_replicas():
+    return _use_replica.set(True)
+
+
+def reset_read_from_replicas(token):
+    _use_replica.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """
+    Read from the primary inside a safe request, e.g. to build data kept longer than the lag of a replica
+    """
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(REPLICA_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_to_primary(response):
+    pinned_until = time.time() + settings.REPLICA_PIN_SECONDS
+    response.set_cookie(REPLICA_PIN_COOKIE, f'{pinned_until:.3f}', max_age=settings.REPLICA_PIN_SECONDS,
+                        httponly=True, samesite='Lax')
+
+
+def replica_lag(alias):
+    """
+    Seconds of lag of a replica, None when it cannot be reached
+    """
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_QUERY)
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        return None
+
+    # Nothing replayed yet since the replica started
+    return float('inf') if lag is None else float(lag)
+
+
+def replica_status(alias):
+    """
+    Reason to skip a replica, None when it can be read
+    """
+    now = time.monotonic()
+    with _lag_checks_lock:
+        checked_at, status = _lag_checks.get(alias, (None, None))
+        if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+            return status
+        # Other threads keep the previous status while this one checks
+        _lag_checks[alias] = (now, status)
+
+    lag = replica_lag(alias)
+    status = UNAVAILABLE if lag is None else LAGGING if lag > settings.REPLICA_MAX_LAG else None
+    with _lag_checks_lock:
+        _lag_checks[alias] = (now, status)
+
+    return status
+
+
+def reset_replica_status():
+    with _lag_checks_lock:
+        _lag_checks.clear()
+
+
+class ReplicaRouter:
+    """
+    Database router of DATABASE_ROUTERS sending the reads of safe requests to replicas
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get() or not settings.DATABASE_REPLICAS:
+            return None
+
+        replicas = list(settings.DATABASE_REPLICAS)
+        random.shuffle(replicas)
+        for alias in replicas:
+            status = replica_status(alias)
+            if status is None:
+                return alias
+            record_replica_fallback(status)
+
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
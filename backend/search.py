@@ -0,0 +1,73 @@
+from django.db import connections, router
+
+from backend.encoders import COMMENT_WITH_POST_ROW, POST_ROW
+from backend.models import Comment, Post
+
+"""
+Full-text search of posts and comments.
+Both tables have a search_vector column, a tsvector of their body kept up to date by a trigger and indexed with GIN,
+so a query only reads the rows matching all its terms. Results are ordered by rank then id, and pages are read after
+the rank and id of the last result of the previous one. The column is not a field of the models, so it is never read
+by the other queries.
+"""
+# Text search configuration of the search_vector triggers of migration 0012
+SEARCH_CONFIG = 'pg_catalog.english'
+
+POSTS = 'posts'
+COMMENTS = 'comments'
+SEARCH_TYPES = (POSTS, COMMENTS)
+
+SEARCH_QUERY = "select * from (select {columns}, ts_rank(t.search_vector, q.query) as rank " \
+               "from public.{table} t, websearch_to_tsquery('" + SEARCH_CONFIG + "', %s) q(query) " \
+               "where t.search_vector @@ q.query{filters}) s{after} order by rank {direction}, id {direction} limit %s"
+
+
+class Search:
+    """
+    Results of a query in posts, or in comments, of a post or of all posts. Rows are the columns of the row
+    encoder of their type, then their rank.
+    """
+
+    def __init__(self, query, search_type=POSTS, post_id=None):
+        self.query = query
+        self.search_type = search_type
+        self.post_id = post_id
+
+    @property
+    def encoder(self):
+        return POST_ROW if self.search_type == POSTS else COMMENT_WITH_POST_ROW
+
+    @property
+    def model(self):
+        return Post if self.search_type == POSTS else Comment
+
+    def fetch(self, position, reverse, limit):
+        """
+        Rows after `position` in the ('-rank', '-id') ordering, or before it in the reverse ordering
+        """
+        params = [self.query]
+        filters = ''
+        if self.post_id is not None:
+            # Comments of a post are in a single partition of a partitioned table
+            filters = ' and t.post_id = %s'
+            params.append(self.post_id)
+
+        after = ''
+        if position is not None:
+            after = f" where (rank, id) {'>' if reverse else '<'} (%s::real, %s)"
+            params += position
+
+        query = SEARCH_QUERY.format(columns=', '.join(f't.{field}' for field in self.encoder.fields),
+                                    table=self.search_type, filters=filters, after=after,
+                                    direction='asc' if reverse else 'desc')
+
+        # Reads go to a replica like the ones of the ORM
+        with connections[router.db_for_read(self.model)].cursor() as cursor:
+            cursor.execute(query, params + [limit])
+            return cursor.fetchall()
+
+    def get_position(self, row):
+        return row[-1], row[self.encoder.index('id')]
+
+    def encode(self, rows):
+        return self.encoder.encode(rows)
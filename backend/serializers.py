@@ -4,22 +4,30 @@ from backend.models import Post, Comment
 
 
 class CommentPostSerializer(serializers.ModelSerializer):
+    path = serializers.CharField(read_only=True)
+
     class Meta:
         model = Comment
-        exclude = ['post']
+        read_only_fields = ['reply_count', 'descendant_count']
+        fields = ['id', 'created_at', 'body', 'path', 'reply_count', 'descendant_count']
 
 
 class CommentGetSerializer(serializers.ModelSerializer):
+    path = serializers.CharField(read_only=True)
+
     class Meta:
         model = Comment
-        fields = '__all__'
+        read_only_fields = ['reply_count', 'descendant_count']
+        fields = ['id', 'created_at', 'body', 'path', 'reply_count', 'descendant_count', 'post']
 
 
 # Serializer for comments nested in a post
 class NestedCommentSerializer(serializers.ModelSerializer):
+    path = serializers.CharField(read_only=True)
+
     class Meta:
         model = Comment
-        exclude = ['post']
+        fields = ['id', 'created_at', 'body', 'path', 'reply_count', 'descendant_count']
         ordering = ['-created_at']
 
 
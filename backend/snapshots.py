@@ -0,0 +1,231 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from backend.cache import RANKING_CACHE_KEY, ensure_listening, invalidate, local_cache
+from backend.models import Post
+from backend.ranking import SORT_HOT, TOP_KEY, ranking_key
+from backend.redis_client import async_redis_client, redis_client
+from backend.serializers import PostsSerializer
+
+"""
+Snapshots of the ranked posts lists.
+A snapshot holds the serialized top HOT_SNAPSHOT_SIZE posts of a ranking, so reading the top posts is a single
+Redis round trip and never touches Postgres.
+Every write that can change the rankings increases RANKING_VERSION_KEY. A snapshot built from an older version is
+rebuilt once it is older than HOT_SNAPSHOT_MAX_AGE seconds, by a single worker while the others keep serving it.
+"""
+SNAPSHOT_KEY = 'posts:snapshot:{sort}'
+SNAPSHOT_LOCK_KEY = 'posts:snapshot:{sort}:lock'
+RANKING_VERSION_KEY = 'posts:ranking:version'
+
+"""
+Posts of the ranking KEYS[1] after the post ARGV[2] with score ARGV[1], or before it when ARGV[3] is 1, at most ARGV[4]
+of them with their scores, from the highest score. Posts with the same score are in descending order of their ids as
+strings, the order of the sorted set.
+"""
+RANKING_PAGE_SCRIPT = """
+local after, before
+local score = redis.call('zscore', KEYS[1], ARGV[2])
+if score and tonumber(score) == tonumber(ARGV[1]) then
+    local rank = redis.call('zrevrank', KEYS[1], ARGV[2])
+    after, before = rank + 1, rank - 1
+else
+    -- The post changed score or left the ranking since the cursor was given, the posts of its former score follow it
+    after = redis.call('zcount', KEYS[1], '(' .. ARGV[1], '+inf')
+    before = after - 1
+end
+local limit = tonumber(ARGV[4])
+if ARGV[3] == '1' then
+    if before < 0 then
+        return {}
+    end
+    return redis.call('zrevrange', KEYS[1], math.max(before - limit + 1, 0), before, 'withscores')
+end
+return redis.call('zrevrange', KEYS[1], after, after + limit - 1, 'withscores')
+"""
+
+
+def build_ranking(sort, limit):
+    """
+    Read the top posts of a ranking from Redis and their bodies from Postgres, without any write
+    """
+    top_posts = redis_client.zrange(ranking_key(sort), 0, limit - 1, desc=True, withscores=True)
+
+    return read_ranked_posts(sort, top_posts)
+
+
+def build_ranking_page(sort, position, reverse, limit):
+    """
+    Read `limit` posts of a ranking after `position`, the (score, id) of a post, or before it in the reverse order
+    """
+    values = redis_client.eval(RANKING_PAGE_SCRIPT, 1, ranking_key(sort), repr(position[0]), position[1],
+                               int(reverse), limit)
+    top_posts = [(post_id, float(score)) for post_id, score in zip(values[::2], values[1::2])]
+    if reverse:
+        top_posts.reverse()
+
+    return read_ranked_posts(sort, top_posts)
+
+
+class RankingPages:
+    """
+    Pages of a ranking following its first one, read from its sorted set after the (score, id) of a cursor like the
+    first page was, so a post is never skipped or repeated because its total comments were not flushed yet
+    """
+
+    def __init__(self, sort):
+        self.sort = sort
+
+    def fetch(self, position, reverse, limit):
+        return build_ranking_page(self.sort, position, reverse, limit)
+
+
+def read_ranked_posts(sort, top_posts):
+    """
+    Read the bodies of the posts of (post id, score) pairs of a ranking from Postgres, and their total comments from
+    the top ranking
+    """
+    post_ids = [post_id for post_id, score in top_posts]
+    if not post_ids:
+        return []
+
+    if sort == SORT_HOT:
+        total_comments = redis_client.zmscore(TOP_KEY, post_ids)
+    else:
+        total_comments = [score for post_id, score in top_posts]
+
+    posts = Post.objects.in_bulk([int(post_id) for post_id in post_ids])
+
+    return rank_posts(top_posts, total_comments, posts)
+
+
+async def abuild_ranking(sort, limit):
+    """
+    Async build_ranking, the total comments of the hot posts are read from redis while their bodies are read from
+    Postgres
+    """
+    client = async_redis_client()
+    top_posts = await client.zrange(ranking_key(sort), 0, limit - 1, desc=True, withscores=True)
+    post_ids = [post_id for post_id, score in top_posts]
+    if not post_ids:
+        return []
+
+    posts = Post.objects.ain_bulk([int(post_id) for post_id in post_ids])
+    if sort == SORT_HOT:
+        total_comments, posts = await asyncio.gather(client.zmscore(TOP_KEY, post_ids), posts)
+    else:
+        total_comments, posts = [score for post_id, score in top_posts], await posts
+
+    return rank_posts(top_posts, total_comments, posts)
+
+
+def rank_posts(top_posts, total_comments, posts):
+    """
+    Serialize the posts of (post id, score) pairs read from a ranking, with their total comments
+    """
+    # Posts keep the order of the ranking, so the next pages read from its sorted set follow them
+    ranking = []
+    for (post_id, score), count in zip(top_posts, total_comments):
+        post = posts.get(int(post_id))
+        if post is None:
+            continue
+        post.total_comments = int(count or 0)
+        ranking.append(PostsSerializer(post).data)
+
+    return ranking
+
+
+def rebuild_snapshot(sort, version=None):
+    if version is None:
+        version = redis_client.get(RANKING_VERSION_KEY)
+
+    snapshot = {
+        'version': version,
+        'built_at': time.time(),
+        'posts': build_ranking(sort, settings.HOT_SNAPSHOT_SIZE),
+    }
+    redis_client.set(SNAPSHOT_KEY.format(sort=sort), json.dumps(snapshot))
+    invalidate(RANKING_CACHE_KEY.format(sort=sort))
+
+    return snapshot
+
+
+def is_current(snapshot, version):
+    return snapshot['version'] == version or time.time() - snapshot['built_at'] < settings.HOT_SNAPSHOT_MAX_AGE
+
+
+def get_snapshot(sort):
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.get(SNAPSHOT_KEY.format(sort=sort))
+    pipeline.get(RANKING_VERSION_KEY)
+    raw_snapshot, version = pipeline.execute()
+
+    if raw_snapshot is None:
+        return rebuild_snapshot(sort, version)
+
+    snapshot = json.loads(raw_snapshot)
+    if is_current(snapshot, version):
+        return snapshot
+
+    """
+    Only the worker holding the lock rebuilds an outdated snapshot, the others keep serving it until it is replaced
+    """
+    lock_key = SNAPSHOT_LOCK_KEY.format(sort=sort)
+    if not redis_client.set(lock_key, 1, nx=True, ex=30):
+        return snapshot
+
+    try:
+        return rebuild_snapshot(sort, version)
+    finally:
+        redis_client.delete(lock_key)
+
+
+def get_ranking(sort, limit):
+    """
+    Top `limit` posts of a ranking, served from its snapshot when it is big enough.
+    Each worker keeps the last snapshot it read in memory until it expires or a new snapshot is built.
+    """
+    if limit > settings.HOT_SNAPSHOT_SIZE:
+        return build_ranking(sort, limit)
+
+    ensure_listening()
+
+    cache_key = RANKING_CACHE_KEY.format(sort=sort)
+    posts = local_cache.get(cache_key)
+    if posts is None:
+        posts = get_snapshot(sort)['posts']
+        local_cache.set(cache_key, posts)
+
+    return posts[:limit]
+
+
+async def aget_ranking(sort, limit):
+    """
+    Async get_ranking. Snapshots to rebuild are rebuilt by get_snapshot in a thread, which happens at most once every
+    HOT_SNAPSHOT_MAX_AGE seconds.
+    """
+    if limit > settings.HOT_SNAPSHOT_SIZE:
+        return await abuild_ranking(sort, limit)
+
+    ensure_listening()
+
+    cache_key = RANKING_CACHE_KEY.format(sort=sort)
+    posts = local_cache.get(cache_key)
+    if posts is None:
+        pipeline = async_redis_client().pipeline(transaction=False)
+        pipeline.get(SNAPSHOT_KEY.format(sort=sort))
+        pipeline.get(RANKING_VERSION_KEY)
+        raw_snapshot, version = await pipeline.execute()
+
+        snapshot = None if raw_snapshot is None else json.loads(raw_snapshot)
+        if snapshot is None or not is_current(snapshot, version):
+            snapshot = await sync_to_async(get_snapshot)(sort)
+
+        posts = snapshot['posts']
+        local_cache.set(cache_key, posts)
+
+    return posts[:limit]
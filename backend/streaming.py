@@ -0,0 +1,104 @@
+import json
+
+from django.core.handlers.asgi import ASGIRequest
+
+from backend.models import Comment
+from backend.paths import display_path
+from backend.threads import created_at_field
+
+"""
+Streaming of a post with all its comments.
+Comments are read from a server-side cursor by chunks of STREAM_CHUNK_SIZE rows in depth-first order and encoded one
+by one, so the memory of a worker does not grow with the size of the thread and the first bytes are sent right away.
+"""
+STREAM_CHUNK_SIZE = 2000
+STREAM_BUFFER_SIZE = 64 * 1024
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+STREAM_UNSUPPORTED_MESSAGE = 'Only supported by the WSGI application'
+
+COMMENT_FIELDS = ('id', 'created_at', 'body', 'tree_path', 'reply_count', 'descendant_count')
+
+
+def encode(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def post_fields(post):
+    return {
+        'id': post.id,
+        'created_at': created_at_field.to_representation(post.created_at),
+        'body': post.body,
+    }
+
+
+def stream_comments(post_id):
+    comments = Comment.objects.filter(post_id=post_id).order_by('tree_path').values_list(*COMMENT_FIELDS)
+
+    for comment_id, created_at, body, tree_path, reply_count, descendant_count in \
+            comments.iterator(chunk_size=STREAM_CHUNK_SIZE):
+        yield encode({
+            'id': comment_id,
+            'created_at': created_at_field.to_representation(created_at),
+            'body': body,
+            'path': display_path(tree_path),
+            'reply_count': reply_count,
+            'descendant_count': descendant_count,
+        })
+
+
+def buffered(parts):
+    """
+    Group small encoded parts into chunks of about STREAM_BUFFER_SIZE characters
+    """
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= STREAM_BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_post_json(post):
+    """
+    The post as a single JSON object, its comments in a `comments` array
+    """
+    yield f'{encode(post_fields(post))[:-1]},"comments":['
+
+    for index, comment in enumerate(stream_comments(post.id)):
+        yield f',{comment}' if index else comment
+
+    yield ']}'
+
+
+def stream_post_ndjson(post):
+    """
+    The post on the first line, then one comment per line
+    """
+    yield f'{encode(post_fields(post))}\n'
+
+    for comment in stream_comments(post.id):
+        yield f'{comment}\n'
+
+
+def streaming_supported(request):
+    """
+    Under ASGI, Django 4.1 iterates the content of a streamed response on the event loop, where the ORM cannot read
+    the comments, so posts are only streamed by the WSGI application
+    """
+    return not isinstance(request, ASGIRequest)
+
+
+def stream_post(post, stream_format):
+    parts = stream_post_ndjson(post) if stream_format == 'ndjson' else stream_post_json(post)
+
+    return buffered(parts)
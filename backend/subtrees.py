@@ -0,0 +1,163 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from backend.paths import SEGMENT_WIDTH, path_ids
+
+"""
+Set-based delete and move of the subtree of a comment.
+A subtree is the range of tree paths starting with the tree path of its root, a single range of the
+(post_id, tree_path) index, so it is deleted or moved by one statement whatever its size. The same statement updates
+the reply counts of the ancestors the subtree leaves or joins, by the number of comments it deleted or moved.
+Total comments of posts are changed by the views through the comment counter, by that number.
+Before changing reply counts, the views lock every comment whose reply counts change, with the root of a deleted or
+moved subtree, in (post_id, tree_path) order until the end of the transaction. The root of a subtree is an ancestor of
+every comment of it, so replies are neither added to a subtree being moved nor left out of it, and the shared order
+keeps concurrent replies, deletes and moves from deadlocking.
+"""
+TOMBSTONE_BODY = '[deleted]'
+
+TOMBSTONE = 'tombstone'
+HARD = 'hard'
+DELETE_MODES = (TOMBSTONE, HARD)
+
+"""
+Change the reply counts of the ancestors of a subtree, given as (post_id, id, reply change, sign of the descendant
+change) rows, by the number of comments of the `changed` statement. Reply counts only change when the statement
+found the subtree.
+"""
+ANCESTORS_CTE = "ancestors as (UPDATE public.comments c " \
+                "SET reply_count = c.reply_count + v.replies * (select (count(*) > 0)::int from changed), " \
+                "descendant_count = c.descendant_count + v.sign * (select count(*) from changed) " \
+                "from unnest(%s::integer[], %s::integer[], %s::integer[], %s::integer[]) " \
+                "v(post_id, id, replies, sign) where c.post_id = v.post_id and c.id = v.id)"
+
+DELETE_SUBTREE_QUERY = "with changed as (DELETE FROM public.comments where post_id = %s and tree_path like %s " \
+                       "returning id), " + ANCESTORS_CTE + " select count(*) from changed"
+
+MOVE_SUBTREE_QUERY = "with changed as (UPDATE public.comments SET post_id = %s, " \
+                     "tree_path = %s || substr(tree_path, %s) where post_id = %s and tree_path like %s " \
+                     "returning id), " + ANCESTORS_CTE + " select count(*) from changed"
+
+LOCK_REPLY_PARENTS_QUERY = "select id, tree_path from public.comments where post_id = %s and id = any(%s) " \
+                           "order by tree_path for no key update"
+
+LOCK_SUBTREE_QUERY = "select post_id, id, tree_path from public.comments " \
+                     "where post_id = %s and id = any(%s) or post_id = %s and id = any(%s) " \
+                     "order by post_id, tree_path for update"
+
+
+def parent_path(tree_path):
+    return tree_path[:-SEGMENT_WIDTH]
+
+
+def ancestor_changes(leaves=None, joins=None):
+    """
+    Rows of ANCESTORS_CTE for a subtree leaving the parent `leaves` and joining the parent `joins`, both
+    (post_id, parent tree path). Ancestors left and joined again are unchanged.
+    """
+    changes = defaultdict(lambda: [0, 0])
+    for parent, change in ((leaves, -1), (joins, 1)):
+        if parent is None:
+            continue
+
+        post_id, tree_path = parent
+        ancestor_ids = path_ids(tree_path)
+        if not ancestor_ids:
+            continue
+
+        changes[post_id, ancestor_ids[-1]][0] += change
+        for ancestor_id in ancestor_ids:
+            changes[post_id, ancestor_id][1] += change
+
+    keys = sorted(key for key, (replies, sign) in changes.items() if replies or sign)
+
+    return [[key[0] for key in keys], [key[1] for key in keys], [changes[key][0] for key in keys],
+            [changes[key][1] for key in keys]]
+
+
+def read_paths(cursor, post_id, comment_ids):
+    cursor.execute("select id, tree_path from public.comments where post_id = %s and id = any(%s)",
+                   [post_id, list(comment_ids)])
+    return dict(cursor.fetchall())
+
+
+def lock_reply_parents(post_id, parent_ids):
+    """
+    Tree paths of the parents of new replies of a post, by id. The parents and all their ancestors are locked in tree
+    path order until the end of the transaction, FOR NO KEY UPDATE as their reply counts are updated next: replies
+    to the same thread would deadlock upgrading FOR SHARE locks. A parent moved or deleted before it was locked is
+    read again, after rolling back the savepoint that locked the stale paths.
+    """
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            paths = read_paths(cursor, post_id, parent_ids)
+            ancestor_ids = sorted({ancestor_id for tree_path in paths.values() for ancestor_id in path_ids(tree_path)})
+            cursor.execute(LOCK_REPLY_PARENTS_QUERY, [post_id, ancestor_ids])
+            locked = dict(cursor.fetchall())
+
+            if all(locked.get(parent_id) == tree_path for parent_id, tree_path in paths.items()):
+                return paths
+            transaction.set_rollback(True)
+
+
+def lock_subtree(post_id, comment_id, new_post_id=None, new_parent_id=None):
+    """
+    Tree paths of the root of a subtree and of the comment `new_parent_id` of post `new_post_id` it moves under, None
+    when not found. The root, its ancestors and the ancestors of the new parent are locked FOR UPDATE in
+    (post_id, tree_path) order until the end of the transaction. A comment moved or deleted before it was locked is
+    read again, after rolling back the savepoint that locked the stale paths.
+    """
+    new_post_id = post_id if new_post_id is None else new_post_id
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            tree_path = read_paths(cursor, post_id, [comment_id]).get(comment_id)
+            if tree_path is None:
+                return None, None
+
+            new_parent_path = None
+            if new_parent_id is not None:
+                new_parent_path = read_paths(cursor, new_post_id, [new_parent_id]).get(new_parent_id)
+
+            cursor.execute(LOCK_SUBTREE_QUERY, [post_id, path_ids(tree_path), new_post_id,
+                                                path_ids(new_parent_path or '')])
+            locked = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+            if locked.get((post_id, comment_id)) == tree_path and \
+                    (new_parent_id is None or locked.get((new_post_id, new_parent_id)) == new_parent_path):
+                return tree_path, new_parent_path
+            transaction.set_rollback(True)
+
+
+def tombstone_comment(post_id, comment_id):
+    """
+    Replace the body of a comment, keeping its replies and the reply counts
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE public.comments SET body = %s, deleted = true "
+                       "where post_id = %s and id = %s and not deleted", [TOMBSTONE_BODY, post_id, comment_id])
+        return cursor.rowcount
+
+
+def delete_subtree(post_id, tree_path):
+    """
+    Delete a comment and all its replies, returns the number of deleted comments
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DELETE_SUBTREE_QUERY, [post_id, f'{tree_path}%',
+                                              *ancestor_changes(leaves=(post_id, parent_path(tree_path)))])
+        return cursor.fetchone()[0]
+
+
+def move_subtree(post_id, tree_path, new_post_id, new_parent_path):
+    """
+    Move a comment and all its replies under the comment with tree path `new_parent_path` of post `new_post_id`, or
+    to the top of the post with an empty path. Returns the number of moved comments.
+    """
+    old_parent_path = parent_path(tree_path)
+    with connection.cursor() as cursor:
+        cursor.execute(MOVE_SUBTREE_QUERY, [new_post_id, new_parent_path, len(old_parent_path) + 1, post_id,
+                                            f'{tree_path}%',
+                                            *ancestor_changes(leaves=(post_id, old_parent_path),
+                                                              joins=(new_post_id, new_parent_path))])
+        return cursor.fetchone()[0]
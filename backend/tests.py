@@ -1,13 +1,52 @@
+import asyncio
+import base64
+import json
+import os
 import random
+import tempfile
+import threading
 import time
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from io import StringIO
+from unittest import mock, skipUnless
 
 import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import call_command
 from django.test import Client
-from django.test import TransactionTestCase
+from django.db import connection, connections
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 
-from backend.cron import update_total_comments
-from backend.models import Post, Comment
+from backend.benchmarks import async_path, load_test, percentile, regressions
+from backend.cache import LocalCache, local_cache
+from backend.checks import check_hot_trigger
+from backend.counters import CLAIM_DIRTY_SCRIPT, DIRTY_BATCH_KEY, DIRTY_BATCHES_KEY, DIRTY_KEY, CommentCounter, \
+    MemoryCounter, PostgresCounter, RedisCounter, comment_counter
+from backend.cron import flush_comment_counts, update_total_comments
+from backend.datasets import chunks, comment_counts, dataset_options, generate_thread
+from backend.encoders import dumps
+from backend.live import LiveApplication
+from backend.metrics import BACKGROUND, Counter, Histogram, finish_request, live_watchers, record_fallback, \
+    redis_breaker_rejections_total, redis_breaker_state, redis_fallbacks_total, render, set_endpoint, start_request
+from backend.models import CounterFlush, Post, Comment
+from backend.partitions import MIRROR_TRIGGER, PARTITIONED_TABLE, PREVIOUS_TABLE, TABLE, comment_tables, \
+    copy_batch_query, is_partitioned, prepare_statements, swap_statements, table_layout
+from backend.pagination import RankingPagination
+from backend.paths import child_path, display_path, path_ids
+from backend.subtrees import TOMBSTONE_BODY, ancestor_changes, delete_subtree, parent_path
+from backend.threads import build_lazy_thread, decode_more
+from backend.versions import POST_VERSIONS_KEY
+from backend.ranking import HOT_DECAY_SECONDS, HOT_KEY, TOP_KEY, hot_score
+from backend.replies import recompute_reply_counts
+from backend.response_cache import RESPONSE_KEY, RESPONSE_LOCK_KEY
+from backend.routers import LAG_QUERY, REPLICA_PIN_COOKIE, is_pinned, reset_replica_status
+from backend.redis_client import CLOSED, HALF_OPEN, OPEN, BlockingConnectionPool, CircuitBreaker, InstrumentedRedis, \
+    PoolExhaustedError, ReplyTimeoutError
 from config import host
 
 
@@ -23,6 +62,7 @@ class PostTestCase(TransactionTestCase):
 
         for key in redis_client.keys():
             redis_client.delete(key)
+        local_cache.clear()
 
         for i in range(20):
             self.client.post('/api/v1/posts',
@@ -80,6 +120,81 @@ class PostTestCase(TransactionTestCase):
         self.assertEqual(set(list_post), {15, 11, 10, 9, 8, 19})
         self.assertEqual(response.status_code, 200)
 
+    # the top posts are served from a snapshot in redis without writing to posts table
+    def test_get_top_from_snapshot(self):
+        response = self.client.get('/api/v1/posts?limit=3')
+        self.assertEqual([post['total_comments'] for post in response.json()['results']], [10, 10, 10])
+        self.assertEqual(Post.objects.get(id=15).total_comments, 0)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/posts?limit=6')
+        list_post = [post['id'] for post in response.json()['results']]
+        self.assertEqual(set(list_post), {15, 11, 10, 9, 8, 19})
+
+    def test_get_hot(self):
+        response = self.client.get('/api/v1/posts?limit=6&sort=hot')
+        list_post = [post['id'] for post in response.json()['results']]
+        self.assertEqual(set(list_post), {15, 11, 10, 9, 8, 19})
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_new(self):
+        response = self.client.get('/api/v1/posts?limit=3&sort=new')
+        list_post = [post['id'] for post in response.json()['results']]
+        self.assertEqual(list_post, [20, 19, 18])
+        self.assertEqual(response.status_code, 200)
+
+    # next pages are read from the same ranking as the first one, before total comments are flushed
+    def test_get_next_page(self):
+        response = self.client.get('/api/v1/posts?limit=6')
+        first_page = [post['id'] for post in response.json()['results']]
+        self.assertIsNotNone(response.json()['next'])
+        self.assertIsNone(response.json()['previous'])
+
+        response = self.client.get(response.json()['next'])
+        list_post = [post['id'] for post in response.json()['results']]
+        # posts with the same score are ordered by their ids as strings, like in the sorted set
+        self.assertEqual(list_post, [4, 3, 2, 1, 7, 6])
+
+        response = self.client.get(response.json()['previous'])
+        self.assertEqual([post['id'] for post in response.json()['results']], first_page)
+        self.assertIsNone(response.json()['previous'])
+
+    def test_get_hot_pages(self):
+        ids = []
+        response = self.client.get('/api/v1/posts?limit=7&sort=hot')
+        while True:
+            ids += [post['id'] for post in response.json()['results']]
+            if response.json()['next'] is None:
+                break
+            response = self.client.get(response.json()['next'])
+
+        self.assertEqual(sorted(ids), list(range(1, 21)))
+
+    def test_get_new_pages(self):
+        response = self.client.get('/api/v1/posts?limit=8&sort=new')
+        response = self.client.get(response.json()['next'])
+        list_post = [post['id'] for post in response.json()['results']]
+        self.assertEqual(list_post, [12, 11, 10, 9, 8, 7, 6, 5])
+
+        response = self.client.get(response.json()['previous'])
+        list_post = [post['id'] for post in response.json()['results']]
+        self.assertEqual(list_post, [20, 19, 18, 17, 16, 15, 14, 13])
+        self.assertIsNone(response.json()['previous'])
+
+    def test_get_invalid_sort(self):
+        response = self.client.get('/api/v1/posts?sort=random')
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_invalid_limit(self):
+        for path in ('/api/v1/posts', '/api/v1/async/posts'):
+            for limit in ('abc', '0', '-1', '1.5'):
+                response = self.client.get(path, {'limit': limit, 'sort': 'hot'})
+                self.assertEqual(response.status_code, 400, (path, limit))
+                self.assertEqual(response.json(), {'limit': 'Must be a positive integer'})
+
+        # Bigger pages are cut to the maximum
+        self.assertEqual(RankingPagination().get_limit(Request(RequestFactory().get('/', {'limit': 1000}))), 100)
+
     def test_get_post(self):
         response = self.client.get('/api/v1/posts/10')
         self.assertEqual(response.status_code, 200)
@@ -98,6 +213,75 @@ class PostTestCase(TransactionTestCase):
 
         self.assertEqual(Post.objects.count(), 20)
 
+    def test_get_post_stream(self):
+        response = self.client.get('/api/v1/posts/10?stream=json')
+        self.assertEqual(response.status_code, 200)
+        post = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(post['body'], 'Post 9')
+        self.assertEqual(len(post['comments']), 10)
+        self.assertEqual(post, self.client.get('/api/v1/posts/10').json() | {'comments': post['comments']})
+
+        response = self.client.get('/api/v1/posts/19?stream=ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(lines[0]['body'], 'Post 18')
+        comment_ids = [comment['id'] for comment in lines[1:]]
+        self.assertEqual([comment['path'] for comment in lines[1:]],
+                         [''.join(f'/{comment_id}' for comment_id in comment_ids[:i]) for i in range(5)])
+
+        response = self.client.get('/api/v1/posts/19?stream=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_metrics(self):
+        self.client.get('/api/v1/posts/10')
+        self.client.get('/api/v1/posts/100')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('http_requests_total{endpoint="api/v1/posts/<int:post_id>",method="GET",status="200"}', metrics)
+        self.assertIn('http_requests_total{endpoint="api/v1/posts/<int:post_id>",method="GET",status="404"}', metrics)
+        self.assertIn('http_request_db_seconds_count{endpoint="api/v1/posts/<int:post_id>"}', metrics)
+        self.assertIn('redis_commands_total{endpoint="api/v1/posts/<int:post_id>/comments",command="eval"}',
+                      metrics)
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/v1/posts/10')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # Revalidating reads no comment
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/posts/10', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get('/api/v1/posts/10', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        comment_id = self.client.get('/api/v1/posts/10').json()['comments'][0]['id']
+        response = self.client.get(f'/api/v1/posts/10/comments/{comment_id}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Comments written to the post, or to another post, change its version or not
+        self.client.post('/api/v1/posts/11/comments', {'body': 'Other post'}, 'application/json')
+        self.assertEqual(self.client.get('/api/v1/posts/10', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post('/api/v1/posts/10/comments', {'body': 'New comment'}, 'application/json')
+        response = self.client.get('/api/v1/posts/10', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['comments']), 11)
+
+        # Versions lost by redis start again from a new epoch
+        etag = response['ETag']
+        redis_client = redis.Redis(host=host, port=6379, db=0, decode_responses=True)
+        redis_client.delete(POST_VERSIONS_KEY)
+        response = self.client.get('/api/v1/posts/10', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_get_post_not_exist(self):
         response = self.client.get('/api/v1/posts/100')
         self.assertEqual(response.status_code, 404)
@@ -112,12 +296,31 @@ class PostTestCase(TransactionTestCase):
         self.assertEqual(response.json()['body'], 'New created post')
         self.assertEqual(Post.objects.count(), 21)
 
+    def test_bulk_create_posts(self):
+        response = self.client.post('/api/v1/posts/bulk',
+                                    [{'body': 'Bulk post 1'}, {'body': 'Bulk post 2'}],
+                                    'application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([post['body'] for post in response.json()], ['Bulk post 1', 'Bulk post 2'])
+        self.assertEqual(Post.objects.count(), 22)
+
+        response = self.client.get('/api/v1/posts?sort=new&limit=2')
+        self.assertEqual([post['body'] for post in response.json()['results']], ['Bulk post 2', 'Bulk post 1'])
+
+        response = self.client.post('/api/v1/posts/bulk', [{'body': 'Bulk post 3'}, {}], 'application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/v1/posts/bulk', [], 'application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Post.objects.count(), 22)
+
 
 class CommentTestCase(TransactionTestCase):
     reset_sequences = True
 
     def setUp(self):
         self.client = Client()
+        local_cache.clear()
         Post.objects.create(body='Post 1', id=1)
         Post.objects.create(body='Post 2', id=2)
 
@@ -176,6 +379,133 @@ class CommentTestCase(TransactionTestCase):
         self.assertEqual(response.json()[0]['body'], 'Comment 2')
         self.assertEqual(response.json()[0]['path'], '/1')
 
+    def test_list_comments(self):
+        for i in range(5):
+            self.client.post('/api/v1/posts/1/comments',
+                             {'body': f'Comment {i}'},
+                             'application/json')
+
+        response = self.client.get('/api/v1/posts/1/comments?limit=2')
+        self.assertEqual([comment['id'] for comment in response.json()['results']], [5, 4])
+        self.assertNotIn('count', response.json())
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([comment['id'] for comment in response.json()['results']], [3, 2])
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual([comment['id'] for comment in response.json()['results']], [1])
+        self.assertIsNone(response.json()['next'])
+
+        response = self.client.get(response.json()['previous'])
+        self.assertEqual([comment['id'] for comment in response.json()['results']], [3, 2])
+
+    def test_list_comments_invalid_cursor(self):
+        response = self.client.get('/api/v1/posts/1/comments?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
+        # values of the wrong type for their ordering fields
+        for position in (['x', 1], ['2023-01-01T00:00:00+00:00', 'x'], ['2023-13-01T00:00:00', 1], [1, True]):
+            cursor = base64.urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+            response = self.client.get('/api/v1/posts/1/comments', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+        for sort in ('top', 'hot', 'new'):
+            cursor = base64.urlsafe_b64encode(json.dumps({'p': ['x', 1]}).encode()).decode()
+            response = self.client.get('/api/v1/posts', {'sort': sort, 'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    # a comment is returned with all its replies in depth-first order
+    def test_get_comment_subtree(self):
+        for body, parent_id in [('Comment 1', None), ('Comment 2', 1), ('Comment 3', None),
+                                ('Comment 4', 1), ('Comment 5', 2)]:
+            data = {'body': body}
+            if parent_id is not None:
+                data['parent_id'] = parent_id
+            self.client.post('/api/v1/posts/1/comments', data, 'application/json')
+
+        response = self.client.get('/api/v1/posts/1/comments/1')
+        self.assertEqual([comment['id'] for comment in response.json()], [1, 2, 5, 4])
+        self.assertEqual([comment['path'] for comment in response.json()], ['', '/1', '/1/2', '/1'])
+
+        response = self.client.get('/api/v1/posts/1/comments/2')
+        self.assertEqual([comment['id'] for comment in response.json()], [2, 5])
+
+    def test_get_thread(self):
+        for body, parent_id in [('Comment 1', None), ('Comment 2', 1), ('Comment 3', None),
+                                ('Comment 4', 1), ('Comment 5', 2)]:
+            data = {'body': body}
+            if parent_id is not None:
+                data['parent_id'] = parent_id
+            self.client.post('/api/v1/posts/1/comments', data, 'application/json')
+
+        response = self.client.get('/api/v1/posts/1/thread')
+        self.assertEqual(response.status_code, 200)
+        comments = response.json()['comments']
+        self.assertEqual([comment['id'] for comment in comments], [1, 3])
+        self.assertEqual([comment['id'] for comment in comments[0]['children']], [2, 4])
+        self.assertEqual(comments[0]['children'][0]['children'][0]['body'], 'Comment 5')
+
+        response = self.client.get('/api/v1/posts/1/thread?max_depth=2&sort=new')
+        comments = response.json()['comments']
+        self.assertEqual([comment['id'] for comment in comments], [3, 1])
+        self.assertEqual([comment['id'] for comment in comments[1]['children']], [4, 2])
+        self.assertEqual(comments[1]['children'][1]['children'], [])
+
+        response = self.client.get('/api/v1/posts/1/comments/1/thread?sort=old,new')
+        self.assertEqual(response.json()['id'], 1)
+        self.assertEqual([comment['id'] for comment in response.json()['children']], [4, 2])
+
+        response = self.client.get('/api/v1/posts/1/comments/9/thread')
+        self.assertEqual(response.status_code, 404)
+
+    def test_reply_counts(self):
+        for body, parent_id in [('Comment 1', None), ('Comment 2', 1), ('Comment 3', None),
+                                ('Comment 4', 1), ('Comment 5', 2)]:
+            data = {'body': body}
+            if parent_id is not None:
+                data['parent_id'] = parent_id
+            self.client.post('/api/v1/posts/1/comments', data, 'application/json')
+
+        response = self.client.get('/api/v1/posts/1/comments/1')
+        self.assertEqual([(comment['reply_count'], comment['descendant_count']) for comment in response.json()],
+                         [(2, 3), (1, 1), (0, 0), (0, 0)])
+
+        response = self.client.get('/api/v1/posts/1/thread?sort=top')
+        self.assertEqual([comment['id'] for comment in response.json()['comments']], [1, 3])
+        self.assertEqual([comment['id'] for comment in response.json()['comments'][0]['children']], [2, 4])
+
+        Comment.objects.update(reply_count=0, descendant_count=0)
+        call_command('recompute_reply_counts', stdout=StringIO())
+        self.assertEqual(Comment.objects.get(id=1).descendant_count, 3)
+        self.assertEqual(Comment.objects.get(id=1).reply_count, 2)
+        self.assertEqual(Comment.objects.get(id=2).reply_count, 1)
+
+    def test_get_lazy_thread(self):
+        for body, parent_id in [('Comment 1', None), ('Comment 2', 1), ('Comment 3', None),
+                                ('Comment 4', 1), ('Comment 5', 2), ('Comment 6', None)]:
+            data = {'body': body}
+            if parent_id is not None:
+                data['parent_id'] = parent_id
+            self.client.post('/api/v1/posts/1/comments', data, 'application/json')
+
+        response = self.client.get('/api/v1/posts/1/thread?limit=1&max_depth=2')
+        comments = response.json()['comments']
+        self.assertEqual([comment['id'] for comment in comments], [1])
+        self.assertEqual([comment['id'] for comment in comments[0]['children']], [2])
+        self.assertIsNotNone(comments[0]['children'][0]['more'])
+
+        response = self.client.get(f'/api/v1/posts/1/thread?limit=1&max_depth=2&cursor={comments[0]["more"]}')
+        self.assertEqual([comment['id'] for comment in response.json()['comments']], [4])
+        self.assertIsNone(response.json()['more'])
+
+        response = self.client.get('/api/v1/posts/1/thread?limit=1&max_depth=2')
+        response = self.client.get(f'/api/v1/posts/1/thread?limit=1&max_depth=2&cursor={response.json()["more"]}')
+        self.assertEqual([comment['id'] for comment in response.json()['comments']], [3])
+        self.assertIsNotNone(response.json()['more'])
+
+        response = self.client.get('/api/v1/posts/1/thread?limit=1&cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
     # comment is not existed
     def test_get_comment_not_existed(self):
         response = self.client.get('/api/v1/posts/1/comments/1')
@@ -195,6 +525,40 @@ class CommentTestCase(TransactionTestCase):
                                     'application/json')
         self.assertEqual(response.status_code, 404)
 
+    def test_bulk_create_comments(self):
+        self.client.post('/api/v1/posts/1/comments', {'body': 'Comment 1'}, 'application/json')
+
+        response = self.client.post('/api/v1/posts/1/comments/bulk', [
+            {'body': 'Comment 2', 'parent_id': 1, 'temp_id': 'a'},
+            {'body': 'Comment 3', 'parent_temp_id': 'a', 'temp_id': 'b'},
+            {'body': 'Comment 4', 'parent_temp_id': 'a'},
+            {'body': 'Comment 5'},
+        ], 'application/json')
+
+        self.assertEqual(response.status_code, 201)
+        comments = response.json()
+        self.assertEqual([comment['path'] for comment in comments], ['/1', '/1/2', '/1/2', ''])
+        self.assertEqual([comment.get('temp_id') for comment in comments], ['a', 'b', None, None])
+        self.assertEqual(comments[0]['post'], 1)
+
+        response = self.client.get('/api/v1/posts/1/comments/1')
+        self.assertEqual([comment['id'] for comment in response.json()], [1, 2, 3, 4])
+        self.assertEqual(Comment.objects.get(id=1).descendant_count, 3)
+        self.assertEqual(Comment.objects.get(id=2).reply_count, 2)
+
+    def test_bulk_create_comments_invalid(self):
+        response = self.client.post('/api/v1/posts/1/comments/bulk', [
+            {'body': 'Comment 1', 'temp_id': 'a'},
+            {'body': 'Comment 2', 'parent_temp_id': 'b'},
+            {'body': 'Comment 3', 'temp_id': 'a'},
+        ], 'application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([sorted(errors) for errors in response.json()], [[], ['parent_temp_id'], ['temp_id']])
+
+        response = self.client.post('/api/v1/posts/3/comments/bulk', [{'body': 'Comment 1'}], 'application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Comment.objects.count(), 0)
+
     # post is existed, but parent comment is not -> make it as a base comment
     def test_post_comment_without_parent(self):
         response = self.client.post('/api/v1/posts/2/comments',
@@ -205,6 +569,1165 @@ class CommentTestCase(TransactionTestCase):
         self.assertEqual(response.json()['path'], '')
         self.assertEqual(response.json()['post'], 2)
 
+    def test_post_comment_invalid_parent(self):
+        for parent_id in ('abc', '1', True, 1.5):
+            response = self.client.post('/api/v1/posts/1/comments', {'body': 'Comment 1', 'parent_id': parent_id},
+                                        'application/json')
+            self.assertEqual(response.status_code, 400, parent_id)
+            self.assertEqual(response.json(), {'parent_id': 'Must be an integer'})
+        self.assertEqual(Comment.objects.count(), 0)
+
+
+class FlushTestCase(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        self.redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in self.redis_client.keys():
+            self.redis_client.delete(key)
+        local_cache.clear()
+
+        for i in range(3):
+            self.client.post('/api/v1/posts', {'body': f'Post {i}'}, 'application/json')
+
+    def create_comments(self, post_id, total):
+        for i in range(total):
+            self.client.post(f'/api/v1/posts/{post_id}/comments', {'body': 'Comment'}, 'application/json')
+
+    def test_flush(self):
+        self.create_comments(1, 3)
+        self.create_comments(2, 1)
+        self.assertEqual(Post.objects.get(id=1).total_comments, 0)
+
+        flush_comment_counts()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 3)
+        self.assertEqual(Post.objects.get(id=2).total_comments, 1)
+        self.assertEqual(Post.objects.get(id=3).total_comments, 0)
+
+        # flushed increments are not added twice
+        self.create_comments(1, 1)
+        flush_comment_counts()
+        flush_comment_counts()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 4)
+
+    # a batch claimed by a crashed flush is applied by the next flush
+    def test_flush_claimed_batch(self):
+        self.create_comments(1, 2)
+        self.redis_client.eval(CLAIM_DIRTY_SCRIPT, 3, DIRTY_KEY, DIRTY_BATCH_KEY.format(batch_id='crashed'),
+                               DIRTY_BATCHES_KEY, 'crashed')
+        self.create_comments(1, 1)
+
+        flush_comment_counts()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 3)
+        self.assertEqual(self.redis_client.smembers(DIRTY_BATCHES_KEY), set())
+
+    # a batch applied by a flush that crashed before cleaning redis is not applied twice
+    def test_flush_applied_batch(self):
+        self.create_comments(1, 2)
+        self.redis_client.eval(CLAIM_DIRTY_SCRIPT, 3, DIRTY_KEY, DIRTY_BATCH_KEY.format(batch_id='applied'),
+                               DIRTY_BATCHES_KEY, 'applied')
+        Post.objects.filter(id=1).update(total_comments=2)
+        CounterFlush.objects.create(batch_id='applied', total_posts=1)
+
+        flush_comment_counts()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 2)
+
+    def test_reconcile(self):
+        self.create_comments(1, 2)
+        Post.objects.filter(id=2).update(total_comments=5)
+        Comment.objects.create(post_id=2, body='Comment')
+        Post.objects.filter(id=3).update(total_comments=4)
+
+        update_total_comments()
+        flush_comment_counts()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 2)
+        self.assertEqual(Post.objects.get(id=2).total_comments, 1)
+        # posts without any comment are reset
+        self.assertEqual(Post.objects.get(id=3).total_comments, 0)
+
+    # comments counted by the recount while their increments are pending are not added again by the next flush
+    def test_reconcile_pending(self):
+        self.create_comments(1, 2)
+        flush_comment_counts()
+        self.create_comments(1, 1)
+        self.redis_client.eval(CLAIM_DIRTY_SCRIPT, 3, DIRTY_KEY, DIRTY_BATCH_KEY.format(batch_id='claimed'),
+                               DIRTY_BATCHES_KEY, 'claimed')
+        self.create_comments(1, 1)
+
+        update_total_comments()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 2)
+
+        flush_comment_counts()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 4)
+
+
+class FastReadTestCase(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in redis_client.keys():
+            redis_client.delete(key)
+        local_cache.clear()
+
+        for i in range(3):
+            self.client.post('/api/v1/posts', {'body': f'Post {i} \u00e9\u2028\U0001f600'}, 'application/json')
+
+        parent_id = None
+        for i in range(5):
+            data = {'body': f'Comment {i} "\\/\u2029\x01'}
+            if parent_id is not None and i != 3:
+                data['parent_id'] = parent_id
+            response = self.client.post('/api/v1/posts/2/comments', data, 'application/json')
+            parent_id = response.json()['id']
+
+    def get_content(self, url, fast):
+        local_cache.clear()
+        with self.settings(FAST_READ_SERIALIZATION=fast, RESPONSE_CACHE_ENABLED=False):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_parity(self):
+        first_page = self.client.get('/api/v1/posts?sort=new&limit=2').json()
+        urls = [
+            '/api/v1/posts?sort=new&limit=2',
+            first_page['next'],
+            '/api/v1/posts?sort=top',
+            '/api/v1/posts/2',
+            '/api/v1/posts/2/comments?limit=2',
+            '/api/v1/posts/2/comments/2',
+        ]
+
+        for url in urls:
+            self.assertEqual(self.get_content(url, True), self.get_content(url, False), url)
+
+    def test_async_views(self):
+        urls = [
+            '/api/v1/posts?sort=top',
+            '/api/v1/posts?sort=hot&limit=2',
+            '/api/v1/posts?sort=hot&limit=200',
+            '/api/v1/posts?sort=new&limit=2',
+            '/api/v1/posts?sort=best',
+            '/api/v1/posts/2',
+            '/api/v1/posts/9',
+            '/api/v1/posts/2/comments/2',
+            '/api/v1/posts/2/comments/100',
+        ]
+
+        for url in urls:
+            local_cache.clear()
+            expected = self.client.get(url)
+            local_cache.clear()
+            response = self.client.get(url.replace('/api/v1/', '/api/v1/async/'))
+
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.content, expected.content.replace(b'/api/v1/', b'/api/v1/async/'), url)
+            for header in ('ETag', 'Last-Modified'):
+                self.assertEqual(response.get(header), expected.get(header), url)
+
+    async def test_async_client(self):
+        response = await self.async_client.get('/api/v1/async/posts/2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['comments']), 5)
+
+        # Posts are only streamed under WSGI
+        for url in ('/api/v1/posts/2?stream=json', '/api/v1/async/posts/2?stream=json'):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'stream': 'Only supported by the WSGI application'})
+
+        response = await self.async_client.get('/metrics')
+        self.assertIn('http_requests_total{endpoint="api/v1/async/posts/<int:post_id>",method="GET",status="200"}',
+                      response.content.decode())
+
+    def test_renderer(self):
+        data = {'body': ''.join(chr(i) for i in range(128)) + '\u00e9\u2028\u2029\U0001f600', 'total': [1, None, True]}
+        self.assertEqual(dumps(data), JSONRenderer().render(data))
+
+
+class ResponseCacheTestCase(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        self.redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in self.redis_client.keys():
+            self.redis_client.delete(key)
+        local_cache.clear()
+
+        for i in range(2):
+            self.client.post('/api/v1/posts', {'body': f'Post {i}'}, 'application/json')
+            for j in range(3):
+                self.client.post(f'/api/v1/posts/{i + 1}/comments', {'body': f'Comment {j}'}, 'application/json')
+
+    def get_stats(self):
+        return self.client.get('/api/v1/cache/stats').json()['responses']
+
+    def test_hit_and_stale(self):
+        stats = self.get_stats()
+        response = self.client.get('/api/v1/posts/1')
+        with self.settings(RESPONSE_CACHE_ENABLED=False):
+            expected = self.client.get('/api/v1/posts/1')
+        self.assertEqual(response.content, expected.content)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/v1/posts/1')
+        self.assertEqual((cached.content, cached['ETag']), (response.content, response['ETag']))
+
+        # While another worker rebuilds the entry of a new version, the previous one is served with its ETag
+        self.client.post('/api/v1/posts/1/comments', {'body': 'New comment'}, 'application/json')
+        self.redis_client.set(RESPONSE_LOCK_KEY.format(post_id=1, variant='post'), 1)
+        stale = self.client.get('/api/v1/posts/1')
+        self.assertEqual((stale.content, stale['ETag']), (response.content, response['ETag']))
+
+        self.redis_client.delete(RESPONSE_LOCK_KEY.format(post_id=1, variant='post'))
+        fresh = self.client.get('/api/v1/posts/1')
+        self.assertNotEqual(fresh['ETag'], response['ETag'])
+        self.assertEqual(len(fresh.json()['comments']), 4)
+
+        new_stats = self.get_stats()
+        self.assertEqual(new_stats['hits'] - stats['hits'], 1)
+        self.assertEqual(new_stats['stale_hits'] - stats['stale_hits'], 1)
+        self.assertEqual(new_stats['misses'] - stats['misses'], 2)
+
+    def test_subtree(self):
+        comment_id = self.client.get('/api/v1/posts/2').json()['comments'][0]['id']
+        url = f'/api/v1/posts/2/comments/{comment_id}'
+
+        response = self.client.get(url)
+        self.assertTrue(self.redis_client.exists(RESPONSE_KEY.format(post_id=2, variant=f'subtree:{comment_id}')))
+        self.assertEqual(self.client.get(url).content, response.content)
+        self.assertEqual(self.client.get('/api/v1/posts/2/comments/100').status_code, 404)
+
+    def test_async_views(self):
+        # The async views share the entries of the sync ones and answer conditional GETs
+        response = self.client.get('/api/v1/posts/1')
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/v1/async/posts/1')
+        self.assertEqual((cached.content, cached['ETag']), (response.content, response['ETag']))
+        self.assertEqual(self.client.get('/api/v1/async/posts/1', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         304)
+
+        comment_id = response.json()['comments'][0]['id']
+        response = self.client.get(f'/api/v1/async/posts/1/comments/{comment_id}')
+        self.assertTrue(self.redis_client.exists(RESPONSE_KEY.format(post_id=1, variant=f'subtree:{comment_id}')))
+        self.assertEqual(self.client.get(f'/api/v1/posts/1/comments/{comment_id}').content, response.content)
+
+    def test_eviction(self):
+        body = self.client.get('/api/v1/posts/1').content
+        with self.settings(RESPONSE_CACHE_MAX_BYTES=len(body) * 3 // 2):
+            self.client.get('/api/v1/posts/2')
+
+        self.assertFalse(self.redis_client.exists(RESPONSE_KEY.format(post_id=1, variant='post')))
+        self.assertTrue(self.redis_client.exists(RESPONSE_KEY.format(post_id=2, variant='post')))
+        stats = self.get_stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['bytes'], len(self.client.get('/api/v1/posts/2').content))
+
+    def test_wait(self):
+        # Without any entry, a worker waits for the one holding the lock, then builds the response itself
+        self.redis_client.set(RESPONSE_LOCK_KEY.format(post_id=1, variant='post'), 1)
+        with self.settings(RESPONSE_CACHE_WAIT=0.05):
+            response = self.client.get('/api/v1/posts/1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['comments']), 3)
+        self.assertFalse(self.redis_client.exists(RESPONSE_KEY.format(post_id=1, variant='post')))
+
+
+class SubtreeTestCase(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        self.redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in self.redis_client.keys():
+            self.redis_client.delete(key)
+        local_cache.clear()
+
+        for i in range(2):
+            self.client.post('/api/v1/posts', {'body': f'Post {i}'}, 'application/json')
+        # Post 1: 1 <- 2 <- 3, 1 <- 4 and 5, post 2: 6
+        for post_id, parent_id in ((1, None), (1, 1), (1, 2), (1, 1), (1, None), (2, None)):
+            data = {'body': 'Comment'} if parent_id is None else {'body': 'Comment', 'parent_id': parent_id}
+            self.client.post(f'/api/v1/posts/{post_id}/comments', data, 'application/json')
+
+    def counts(self, comment_id):
+        comment = Comment.objects.get(id=comment_id)
+        return comment.reply_count, comment.descendant_count
+
+    def total_comments(self, post_id):
+        return int(self.redis_client.zscore(TOP_KEY, str(post_id)))
+
+    def test_ancestor_changes(self):
+        old_parent_path = child_path(child_path('', 1), 2)
+        self.assertEqual(ancestor_changes(leaves=(1, old_parent_path)), [[1, 1], [1, 2], [0, -1], [-1, -1]])
+        # Ancestors left and joined again keep their descendants
+        self.assertEqual(ancestor_changes(leaves=(1, old_parent_path), joins=(1, child_path('', 1))),
+                         [[1, 1], [1, 2], [1, -1], [0, -1]])
+        self.assertEqual(ancestor_changes(leaves=(1, ''), joins=(2, '')), [[], [], [], []])
+
+    def test_tombstone(self):
+        self.assertEqual(self.client.delete('/api/v1/posts/1/comments/2').status_code, 204)
+
+        comment = Comment.objects.get(id=2)
+        self.assertEqual((comment.body, comment.deleted), (TOMBSTONE_BODY, True))
+        self.assertEqual(self.client.get('/api/v1/posts/1/comments/2').json()[1]['id'], 3)
+        self.assertEqual(self.counts(1), (2, 3))
+        self.assertEqual(self.total_comments(1), 5)
+
+    def test_hard_delete(self):
+        etag = self.client.get('/api/v1/posts/1')['ETag']
+        self.assertEqual(self.client.delete('/api/v1/posts/1/comments/2?mode=hard').status_code, 204)
+
+        self.assertFalse(Comment.objects.filter(id__in=[2, 3]).exists())
+        self.assertEqual(self.counts(1), (1, 1))
+        self.assertEqual(self.total_comments(1), 3)
+        response = self.client.get('/api/v1/posts/1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['comments']), 3)
+        self.assertEqual(recompute_reply_counts(1, 2), 0)
+
+        # A subtree already deleted leaves the counts of its ancestors as they are
+        self.assertEqual(delete_subtree(1, child_path(child_path('', 1), 2)), 0)
+        self.assertEqual(self.counts(1), (1, 1))
+
+        self.assertEqual(self.client.delete('/api/v1/posts/1/comments/2?mode=hard').status_code, 404)
+        self.assertEqual(self.client.delete('/api/v1/posts/1/comments/1?mode=soft').status_code, 400)
+
+    def test_move(self):
+        response = self.client.post('/api/v1/posts/1/comments/2/move', {'parent_id': 5}, 'application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['path'], '/5')
+        self.assertEqual(self.client.get('/api/v1/posts/1/comments/3').json()[0]['path'], '/5/2')
+        self.assertEqual((self.counts(1), self.counts(5)), ((1, 1), (1, 2)))
+
+        # A comment cannot be moved under its own replies
+        response = self.client.post('/api/v1/posts/1/comments/5/move', {'parent_id': 3}, 'application/json')
+        self.assertEqual(response.status_code, 400)
+
+        # Moved to another post, with its replies
+        response = self.client.post('/api/v1/posts/1/comments/5/move', {'post_id': 2, 'parent_id': 6},
+                                    'application/json')
+        self.assertEqual((response.json()['post'], response.json()['path']), (2, '/6'))
+        self.assertEqual(list(Comment.objects.filter(post_id=2).order_by('id').values_list('id', flat=True)),
+                         [2, 3, 5, 6])
+        self.assertEqual(self.counts(6), (1, 3))
+        self.assertEqual((self.total_comments(1), self.total_comments(2)), (2, 4))
+
+        response = self.client.post('/api/v1/posts/2/comments/5/move', {'post_id': 1}, 'application/json')
+        self.assertEqual(response.json()['path'], '')
+        self.assertEqual(self.counts(6), (0, 0))
+        self.assertEqual(recompute_reply_counts(1, 2), 0)
+
+        self.assertEqual(self.client.post('/api/v1/posts/1/comments/5/move', {'parent_id': 100},
+                                          'application/json').status_code, 404)
+
+    def test_move_invalid_body(self):
+        for body in ('{"parent_id": 5', '[5]', '5'):
+            response = self.client.post('/api/v1/posts/1/comments/2/move', body, 'application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+        response = self.client.post('/api/v1/posts/1/comments/2/move', {'parent_id': '5'}, 'application/json')
+        self.assertEqual(response.json(), {'parent_id': 'Must be an integer'})
+
+    # replies added under a subtree while it moves are neither lost, orphaned nor deadlocked
+    def test_concurrent_replies_and_moves(self):
+        statuses = []
+
+        def send(requests):
+            client = Client()
+            try:
+                for path, data in requests:
+                    statuses.append(client.post(path, data, 'application/json').status_code)
+            finally:
+                connection.close()
+
+        replies = [('/api/v1/posts/1/comments', {'body': 'Reply', 'parent_id': 3})] * 20
+        bulk_replies = [('/api/v1/posts/1/comments/bulk', [{'body': 'Reply', 'parent_id': 3},
+                                                           {'body': 'Reply', 'parent_id': 4}])] * 10
+        moves = [('/api/v1/posts/1/comments/2/move', {'parent_id': parent_id}) for parent_id in (5, 1) * 10]
+        threads = [threading.Thread(target=send, args=(requests,)) for requests in (replies, bulk_replies, moves)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(set(statuses), {200, 201})
+        self.assertEqual(self.counts(3), (30, 30))
+        self.assertEqual(self.counts(1), (2, 43))
+        self.assertEqual(recompute_reply_counts(1, 2), 0)
+        tree_paths = set(Comment.objects.filter(post_id=1).values_list('tree_path', flat=True))
+        orphans = {tree_path for tree_path in tree_paths if parent_path(tree_path) not in tree_paths | {''}}
+        self.assertEqual(orphans, set())
+
+
+class LiveTestCase(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in redis_client.keys():
+            redis_client.delete(key)
+        local_cache.clear()
+
+        self.client.post('/api/v1/posts', {'body': 'Live post'}, 'application/json')
+
+    def add_comment(self, body):
+        return self.client.post('/api/v1/posts/1/comments', {'body': body}, 'application/json').json()
+
+    def watch(self, write=None, last_event_id=None, post_id=1):
+        """
+        Status and (id, event, data) events of a live stream of a post, while `write` runs
+        """
+
+        async def stream():
+            disconnect = asyncio.Queue()
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            headers = [] if last_event_id is None else [(b'last-event-id', str(last_event_id).encode())]
+            scope = {'type': 'http', 'method': 'GET', 'path': f'/api/v1/posts/{post_id}/live', 'query_string': b'',
+                     'headers': headers}
+            task = asyncio.ensure_future(LiveApplication(None)(scope, disconnect.get, send))
+            await asyncio.sleep(0.2)
+            if write is not None:
+                await sync_to_async(write)()
+                await asyncio.sleep(0.2)
+            await disconnect.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(task, 5)
+
+            return messages
+
+        messages = asyncio.run(stream())
+        body = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+        events = []
+        for block in body.split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.split('\n') if ': ' in line and line[0] != ':')
+            if 'event' in fields:
+                events.append((int(fields['id']), fields['event'], fields['data']))
+
+        return messages[0]['status'], events
+
+    def test_stream(self):
+        status, events = self.watch(lambda: self.add_comment('Live comment'))
+        self.assertEqual(status, 200)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0][:2], (1, 'comment'))
+        comment = json.loads(events[0][2])
+        self.assertEqual((comment['body'], comment['path'], comment['post']), ('Live comment', '', 1))
+
+        # Comments of other posts are not sent
+        self.client.post('/api/v1/posts', {'body': 'Other post'}, 'application/json')
+        status, events = self.watch(lambda: self.client.post('/api/v1/posts/2/comments', {'body': 'Other'},
+                                                             'application/json'))
+        self.assertEqual(events, [])
+
+        self.assertEqual(self.watch(post_id=100)[0], 404)
+
+    def test_resume(self):
+        for i in range(3):
+            self.add_comment(f'Comment {i}')
+
+        # A new watcher only gets the events to come
+        self.assertEqual(self.watch()[1], [])
+        self.assertEqual([(event_id, json.loads(data)['body']) for event_id, _, data in
+                          self.watch(last_event_id=1)[1]], [(2, 'Comment 1'), (3, 'Comment 2')])
+        self.assertEqual(self.watch(last_event_id=3)[1], [])
+
+        # Events no longer in the backlog, or ids from before redis lost its data, reset the client
+        with self.settings(LIVE_BACKLOG_SIZE=1):
+            self.add_comment('Comment 3')
+        self.assertEqual(self.watch(last_event_id=2)[1], [(4, 'reset', '{}')])
+        self.assertEqual(self.watch(last_event_id=10)[1], [(4, 'reset', '{}')])
+
+
+class SearchTestCase(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in redis_client.keys():
+            redis_client.delete(key)
+        local_cache.clear()
+
+        for body in ('Postgres partitions', 'Redis streams', 'Partitioned tables in Postgres'):
+            self.client.post('/api/v1/posts', {'body': body}, 'application/json')
+        for post_id in (1, 2):
+            for i in range(5):
+                self.client.post(f'/api/v1/posts/{post_id}/comments', {'body': f'Comment {i} about indexes'},
+                                 'application/json')
+        self.client.post('/api/v1/posts/1/comments', {'body': 'Indexes, indexes and more indexes'},
+                         'application/json')
+
+    def test_search_posts(self):
+        response = self.client.get('/api/v1/search', {'q': 'postgres partition'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(post['id'] for post in response.json()['results']), [1, 3])
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'created_at', 'body', 'total_comments'})
+
+        self.assertEqual(self.client.get('/api/v1/search', {'q': '"redis streams"'}).json()['results'][0]['id'], 2)
+        self.assertEqual(self.client.get('/api/v1/search', {'q': 'postgres -tables'}).json()['results'][0]['id'], 1)
+        self.assertEqual(self.client.get('/api/v1/search', {'q': 'unknown'}).json()['results'], [])
+
+    def test_search_comments(self):
+        comments = self.client.get('/api/v1/search', {'q': 'index', 'type': 'comments', 'limit': 100}).json()
+        self.assertEqual(len(comments['results']), 11)
+        # The comment repeating the term ranks first
+        self.assertEqual(comments['results'][0]['body'], 'Indexes, indexes and more indexes')
+
+        # Pages follow the ranking, forwards and backwards
+        pages = []
+        url = '/api/v1/search?q=index&type=comments&limit=4'
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page)
+            url = page['next']
+        self.assertEqual([comment['id'] for page in pages for comment in page['results']],
+                         [comment['id'] for comment in comments['results']])
+        self.assertEqual(self.client.get(pages[-1]['previous']).json()['results'], pages[-2]['results'])
+
+        # A new comment is searchable at once
+        self.client.post('/api/v1/posts/2/comments', {'body': 'Another index'}, 'application/json')
+        post_comments = self.client.get('/api/v1/search', {'q': 'index', 'post_id': 2}).json()['results']
+        self.assertEqual(len(post_comments), 6)
+        self.assertTrue(all(comment['post'] == 2 for comment in post_comments))
+
+    def test_invalid(self):
+        self.assertEqual(self.client.get('/api/v1/search').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/search', {'q': 'index', 'type': 'users'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/search', {'q': 'index', 'type': 'posts', 'post_id': 1}).status_code,
+                         400)
+        self.assertEqual(self.client.get('/api/v1/search', {'q': 'x' * (settings.SEARCH_MAX_QUERY_LENGTH + 1)})
+                         .status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/search', {'q': 'index', 'cursor': 'abc'}).status_code, 404)
+
+
+class ReplicaTestCase(TransactionTestCase):
+    """
+    Replicas are mirrors of the test database, set with SETA_DB_REPLICAS
+    """
+    reset_sequences = True
+    databases = '__all__'
+
+    def setUp(self):
+        redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in redis_client.keys():
+            redis_client.delete(key)
+        local_cache.clear()
+        reset_replica_status()
+
+        self.client.post('/api/v1/posts', {'body': 'Post'}, 'application/json')
+        self.client.cookies.clear()
+
+    def test_pin(self):
+        response = self.client.post('/api/v1/posts/1/comments', {'body': 'New comment'}, 'application/json')
+        self.assertEqual(REPLICA_PIN_COOKIE in response.cookies, bool(settings.DATABASE_REPLICAS))
+
+        with self.settings(DATABASE_REPLICAS=['default']):
+            response = self.client.post('/api/v1/posts/1/comments', {'body': 'New comment'}, 'application/json')
+            self.assertIn(REPLICA_PIN_COOKIE, response.cookies)
+            self.assertNotIn(REPLICA_PIN_COOKIE, self.client.post('/api/v1/posts/100/comments', {'body': 'Comment'},
+                                                                  'application/json').cookies)
+
+        request = RequestFactory().get('/api/v1/posts/1')
+        request.COOKIES[REPLICA_PIN_COOKIE] = response.cookies[REPLICA_PIN_COOKIE].value
+        self.assertTrue(is_pinned(request))
+        request.COOKIES[REPLICA_PIN_COOKIE] = str(time.time() - 1)
+        self.assertFalse(is_pinned(request))
+        request.COOKIES[REPLICA_PIN_COOKIE] = 'primary'
+        self.assertFalse(is_pinned(request))
+
+    @skipUnless(settings.DATABASE_REPLICAS, 'SETA_DB_REPLICAS is not set')
+    def test_read_your_writes(self):
+        replica = connections[settings.DATABASE_REPLICAS[0]]
+
+        with self.settings(DATABASE_REPLICAS=settings.DATABASE_REPLICAS[:1], RESPONSE_CACHE_ENABLED=False):
+            with CaptureQueriesContext(replica) as queries:
+                self.client.get('/api/v1/posts/1')
+            self.assertIn(LAG_QUERY, [query['sql'] for query in queries])
+            # The comments of a response given the version of its post are read from the primary
+            self.assertFalse([query for query in queries if 'FROM "comments"' in query['sql']
+                              and '"comments"."body"' in query['sql']])
+            # Other reads still go to the replica
+            with CaptureQueriesContext(replica) as queries:
+                self.client.get('/api/v1/posts/1/comments')
+            self.assertTrue([query for query in queries if 'FROM "comments"' in query['sql']])
+
+            # A client that wrote is pinned to the primary
+            self.client.post('/api/v1/posts/1/comments', {'body': 'New comment'}, 'application/json')
+            with CaptureQueriesContext(replica) as queries:
+                response = self.client.get('/api/v1/posts/1')
+            self.assertEqual(len(queries), 0)
+            self.assertEqual(len(response.json()['comments']), 1)
+
+            # A lagging replica is skipped until its next check
+            self.client.cookies.clear()
+            reset_replica_status()
+            with self.settings(REPLICA_MAX_LAG=-1), CaptureQueriesContext(replica) as queries:
+                self.assertEqual(len(self.client.get('/api/v1/posts/1').json()['comments']), 1)
+                self.client.get('/api/v1/posts/1')
+            self.assertEqual([query['sql'] for query in queries], [LAG_QUERY])
+
+
+class DatasetTestCase(SimpleTestCase):
+    def test_comment_counts(self):
+        self.assertEqual(comment_counts(5, 10, 0, seed=1), [10] * 5)
+        self.assertEqual(comment_counts(5, 10, 1, seed=1), comment_counts(5, 10, 1, seed=1))
+
+    def test_generate_thread(self):
+        options = dataset_options(seed=1, days=1, reply_ratio=0.8, max_depth=3, max_fanout=2)
+        rows = list(generate_thread(random.Random(1), 7, options['now'] - timedelta(days=1), 100, 50, options))
+
+        self.assertEqual([row[0] for row in rows], list(range(100, 150)))
+        self.assertEqual({row[6] for row in rows}, {7})
+
+        reply_counts = {}
+        descendant_counts = {}
+        for row in rows:
+            ancestor_ids = path_ids(row[3])[:-1]
+            self.assertEqual(path_ids(row[3])[-1], row[0])
+            self.assertLessEqual(len(ancestor_ids), 2)
+            if ancestor_ids:
+                reply_counts[ancestor_ids[-1]] = reply_counts.get(ancestor_ids[-1], 0) + 1
+            for ancestor_id in ancestor_ids:
+                descendant_counts[ancestor_id] = descendant_counts.get(ancestor_id, 0) + 1
+
+        for row in rows:
+            self.assertLessEqual(row[4], 2)
+            self.assertEqual(row[4], reply_counts.get(row[0], 0))
+            self.assertEqual(row[5], descendant_counts.get(row[0], 0))
+
+    def test_chunks(self):
+        options = dataset_options(seed=1, days=1, reply_ratio=0.8, max_depth=3, max_fanout=2)
+        self.assertEqual([chunk[:4] for chunk in chunks(11, 101, [3, 0, 5, 2, 4], 2, options)],
+                         [(0, 11, 101, [3, 0]), (1, 13, 104, [5, 2]), (2, 15, 111, [4])])
+
+
+class BenchmarkTestCase(SimpleTestCase):
+    def test_percentile(self):
+        latencies = list(range(1, 101))
+        self.assertEqual(percentile(latencies, 0.5), 50)
+        self.assertEqual(percentile(latencies, 0.99), 99)
+        self.assertEqual(percentile([7], 0.95), 7)
+
+    def test_regressions(self):
+        baseline = {'runs': [{'posts': 100, 'scenarios': {'hot_list': {'p95_ms': 10, 'queries': 1}}}]}
+        results = {'runs': [
+            {'posts': 100, 'scenarios': {'hot_list': {'p95_ms': 11.5, 'queries': 1}, 'flush': {'p95_ms': 1}}},
+            {'posts': 1000, 'scenarios': {'hot_list': {'p95_ms': 100, 'queries': 5}}},
+        ]}
+        self.assertEqual(regressions(results, baseline, 0.2), [])
+
+        results['runs'][0]['scenarios']['hot_list'] = {'p95_ms': 12.5, 'queries': 2}
+        self.assertEqual(len(regressions(results, baseline, 0.2)), 2)
+
+    async def test_load_test(self):
+        requests = []
+
+        async def serve(reader, writer):
+            request = await reader.readuntil(b'\r\n\r\n')
+            requests.append(request.split(b' ')[1].decode())
+            status = b'500 Internal Server Error' if b'/fail' in request else b'200 OK'
+            writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Length: 2\r\nConnection: close\r\n\r\n{}')
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(serve, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            paths = [async_path('/api/v1/posts/1'), '/fail'] * 5
+            result = await load_test(f'http://127.0.0.1:{port}', paths, concurrency=3, client_delay=0.01)
+
+        self.assertEqual(sorted(requests), sorted(paths))
+        self.assertEqual(requests.count('/api/v1/async/posts/1'), 5)
+        self.assertEqual((result['requests'], result['errors']), (10, 5))
+        self.assertGreater(result['p50_ms'], 10)
+
+
+class MetricsTestCase(SimpleTestCase):
+    def test_counter(self):
+        counter = Counter('test_total', 'Test', ('endpoint',))
+        counter.inc('a')
+        counter.inc('a', amount=2)
+        counter.inc('b"')
+        self.assertEqual(list(counter.lines()), ['test_total{endpoint="a"} 3', 'test_total{endpoint="b\\""} 1'])
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test', ('endpoint',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.1, 'a')
+        histogram.observe(5, 'a')
+        self.assertEqual(list(histogram.lines()), [
+            'test_seconds_bucket{endpoint="a",le="0.1"} 2',
+            'test_seconds_bucket{endpoint="a",le="1"} 2',
+            'test_seconds_bucket{endpoint="a",le="+Inf"} 3',
+            'test_seconds_sum{endpoint="a"} 5.15',
+            'test_seconds_count{endpoint="a"} 3',
+        ])
+
+    def test_fallback(self):
+        stats, token = start_request()
+        set_endpoint('api/v1/posts')
+        record_fallback('ranking')
+        finish_request(stats, token, 'GET', 200, 0.01)
+        record_fallback('ranking')
+
+        self.assertGreaterEqual(redis_fallbacks_total.get('api/v1/posts', 'ranking'), 1)
+        self.assertGreaterEqual(redis_fallbacks_total.get(BACKGROUND, 'ranking'), 1)
+
+    # metrics of other workers are added up, without the gauges of a worker that exited
+    def test_workers(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            for pid, value, state in ((999999999, 2, 2), (os.getppid(), 3, 1)):
+                with open(os.path.join(directory, f'{pid}-worker.json'), 'w') as file:
+                    json.dump({'redis_fallbacks_total': [[[BACKGROUND, 'workers'], value]],
+                               'live_watchers': [[[], value]], 'redis_breaker_state': [[[], state]]}, file)
+            record_fallback('workers')
+
+            lines = render().split('\n')
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith('.json')]), 3)
+
+        self.assertIn(f'redis_fallbacks_total{{endpoint="{BACKGROUND}",fallback="workers"}} 6', lines)
+        self.assertIn(f'live_watchers {live_watchers.get() + 3}', lines)
+        self.assertIn(f'redis_breaker_state {max(redis_breaker_state.get(), 1)}', lines)
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    def test_transitions(self):
+        now = [0]
+        breaker = CircuitBreaker(failures=2, cooldown=10, clock=lambda: now[0])
+
+        def fail():
+            raise redis.exceptions.TimeoutError('Timeout reading from socket')
+
+        # Timeouts are raised as connection errors, the breaker opens on the second failure in a row
+        for _ in range(2):
+            self.assertEqual(breaker.state, CLOSED)
+            with self.assertRaises(ReplyTimeoutError):
+                breaker.call(fail)
+        self.assertEqual(breaker.state, OPEN)
+
+        calls = []
+        with self.assertRaisesRegex(redis.exceptions.ConnectionError, 'Circuit breaker is open'):
+            breaker.call(calls.append, 1)
+        self.assertEqual(calls, [])
+
+        # After the cooldown, a failed probe opens the breaker again and a successful one closes it
+        now[0] = 10
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            breaker.call(fail)
+        self.assertEqual(breaker.state, OPEN)
+
+        now[0] = 20
+        self.assertEqual(breaker.call(lambda: 'PONG'), 'PONG')
+        self.assertEqual(breaker.state, CLOSED)
+
+        # Replies with an error come from a running redis
+        def reply_error():
+            raise redis.exceptions.ResponseError('WRONGTYPE')
+
+        for _ in range(3):
+            with self.assertRaises(redis.exceptions.ResponseError):
+                breaker.call(reply_error)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_half_open_single_probe(self):
+        now = [0]
+        breaker = CircuitBreaker(failures=1, cooldown=10, clock=lambda: now[0])
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            breaker.call(self.fail_connection)
+
+        now[0] = 10
+        breaker.before_call()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        # Other commands are not sent while the probe runs
+        with self.assertRaisesRegex(redis.exceptions.ConnectionError, 'Circuit breaker is open'):
+            breaker.before_call()
+
+    # a worker out of free connections falls back, without opening the breaker of a redis that is up
+    def test_pool_exhausted(self):
+        breaker = CircuitBreaker(failures=1, cooldown=60)
+        client = InstrumentedRedis(connection_pool=BlockingConnectionPool(host=host, port=6379, max_connections=1,
+                                                                          timeout=0.01), breaker=breaker)
+        connection = client.connection_pool.get_connection('GET')
+        try:
+            for _ in range(2):
+                with self.assertRaises(PoolExhaustedError):
+                    client.get('key')
+            self.assertEqual(breaker.state, CLOSED)
+        finally:
+            client.connection_pool.release(connection)
+
+        self.assertTrue(client.ping())
+        client.connection_pool.disconnect()
+
+    def test_unreachable_redis(self):
+        client = InstrumentedRedis(host='127.0.0.1', port=1, socket_connect_timeout=0.2,
+                                   breaker=CircuitBreaker(failures=2, cooldown=60))
+        rejections = redis_breaker_rejections_total.get(BACKGROUND)
+
+        for _ in range(2):
+            with self.assertRaises(redis.exceptions.ConnectionError):
+                client.get('key')
+
+        start = time.perf_counter()
+        with self.assertRaisesRegex(redis.exceptions.ConnectionError, 'Circuit breaker is open'):
+            client.get('key')
+        with self.assertRaisesRegex(redis.exceptions.ConnectionError, 'Circuit breaker is open'):
+            pipeline = client.pipeline()
+            pipeline.get('key')
+            pipeline.execute()
+        self.assertLess(time.perf_counter() - start, 0.1)
+        self.assertEqual(redis_breaker_rejections_total.get(BACKGROUND), rejections + 2)
+
+    @staticmethod
+    def fail_connection():
+        raise redis.exceptions.ConnectionError('Connection refused')
+
+
+class CounterTestCase(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        self.redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in self.redis_client.keys():
+            self.redis_client.delete(key)
+        local_cache.clear()
+
+        self.client.post('/api/v1/posts', {'body': 'Post 1'}, 'application/json')
+        self.post = Post.objects.get(id=1)
+
+    def test_redis_counter(self):
+        counter = RedisCounter()
+        self.assertEqual(counter.add(self.post, 2), 2)
+        self.assertEqual(counter.add(self.post, 1), 3)
+
+        self.assertEqual(self.redis_client.zscore(TOP_KEY, '1'), 3)
+        self.assertEqual(self.redis_client.zscore(HOT_KEY, '1'), hot_score(3, self.post.created_at))
+        self.assertEqual(self.redis_client.hget(DIRTY_KEY, '1'), '3')
+
+    # the benchmark counts under its own keys and removes them with its posts
+    def test_bench_counters(self):
+        keys = set(self.redis_client.keys())
+        out = StringIO()
+        call_command('bench_counters', backends=['redis'], threads=2, increments=5, stdout=out)
+
+        self.assertIn('exact', out.getvalue())
+        self.assertEqual(set(self.redis_client.keys()), keys)
+        self.assertEqual((self.redis_client.zrange(TOP_KEY, 0, -1), self.redis_client.zrange(HOT_KEY, 0, -1)),
+                         (['1'], ['1']))
+        self.assertEqual(list(Post.objects.values_list('id', flat=True)), [1])
+
+    # a post missing from the rankings is counted from comments table
+    def test_redis_counter_missing_post(self):
+        self.redis_client.delete(TOP_KEY)
+        Comment.objects.create(post=self.post, body='Comment', tree_path=child_path('', 1))
+        Comment.objects.create(post=self.post, body='Comment', tree_path=child_path('', 2))
+
+        self.assertEqual(RedisCounter().add(self.post, 1), 2)
+        self.assertEqual(self.redis_client.zscore(TOP_KEY, '1'), 2)
+
+    def test_redis_counter_concurrent(self):
+        counter = RedisCounter()
+
+        def comment():
+            for _ in range(50):
+                counter.add(self.post, 1)
+
+        threads = [threading.Thread(target=comment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.redis_client.zscore(TOP_KEY, '1'), 200)
+        self.assertEqual(self.redis_client.hget(DIRTY_KEY, '1'), '200')
+
+    # comments of a script that may have run are left to the recount, those of a script never sent are added to posts
+    def test_redis_counter_timeout(self):
+        counter = RedisCounter()
+        with mock.patch('backend.counters.redis_client.eval', side_effect=ReplyTimeoutError('Timeout')):
+            self.assertIsNone(counter.add(self.post, 2))
+        self.assertEqual(Post.objects.get(id=1).total_comments, 0)
+
+        with mock.patch('backend.counters.redis_client.eval',
+                        side_effect=redis.exceptions.ConnectionError('Circuit breaker is open')):
+            self.assertIsNone(counter.add(self.post, 2))
+        self.assertEqual(Post.objects.get(id=1).total_comments, 2)
+
+    def test_postgres_counter(self):
+        counter = PostgresCounter()
+        self.assertEqual(counter.add(self.post, 2), 2)
+        self.assertEqual(counter.add(self.post, 1), 3)
+        self.assertEqual(self.redis_client.zscore(TOP_KEY, '1'), 3)
+        self.assertEqual(counter.pending(), {1: 3})
+
+        counter.flush()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 3)
+        self.assertEqual(counter.pending(), {})
+        self.assertEqual(counter.add(self.post, 1), 4)
+
+    def test_memory_counter(self):
+        counter = MemoryCounter()
+        self.assertEqual(counter.add(self.post, 0), 0)
+        self.assertEqual(counter.add(self.post, 2), 2)
+        self.assertEqual(Post.objects.get(id=1).total_comments, 0)
+        self.assertEqual(counter.pending(), {1: 2})
+
+        counter.flush()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 2)
+        counter.flush()
+        self.assertEqual(Post.objects.get(id=1).total_comments, 2)
+
+    def test_backend_setting(self):
+        with self.settings(COMMENT_COUNTER_BACKEND='backend.counters.MemoryCounter'):
+            counter = comment_counter()
+            self.assertIsInstance(counter, MemoryCounter)
+            self.assertIs(comment_counter(), counter)
+
+            self.client.post('/api/v1/posts/1/comments', {'body': 'Comment 1'}, 'application/json')
+            self.client.post('/api/v1/posts/1/comments', {'body': 'Comment 2'}, 'application/json')
+            self.assertEqual(counter.totals[1], 2)
+            self.assertIsNone(self.redis_client.hget(DIRTY_KEY, '1'))
+
+        self.assertIsInstance(comment_counter(), RedisCounter)
+
+    # a backend missing a method of the counter fails when it is created, not when a comment is counted
+    def test_incomplete_backend(self):
+        class IncrementOnlyCounter(CommentCounter):
+            def increment(self, post, total_new):
+                return total_new
+
+        with self.assertRaises(TypeError):
+            IncrementOnlyCounter()
+
+
+class PathTestCase(SimpleTestCase):
+    def test_child_path(self):
+        tree_path = child_path(child_path('', 4), 5)
+        self.assertEqual(tree_path, '0000000400000005')
+        self.assertEqual(path_ids(tree_path), [4, 5])
+        self.assertEqual(display_path(tree_path), '/4')
+        self.assertEqual(display_path(child_path('', 4)), '')
+
+    # tree paths sort in depth-first order whatever the number of digits of ids
+    def test_sort(self):
+        root = child_path('', 9)
+        paths = [child_path('', 10), child_path(root, 100), root, child_path(child_path(root, 11), 12)]
+        self.assertEqual([path_ids(path) for path in sorted(paths)], [[9], [9, 11, 12], [9, 100], [10]])
+
+
+class LazyThreadTestCase(SimpleTestCase):
+    def comment(self, parent_path, comment_id, level, position, reply_count=0):
+        return {'id': comment_id, 'created_at': datetime(2023, 6, 1, tzinfo=timezone.utc), 'body': 'Comment',
+                'tree_path': child_path(parent_path, comment_id), 'reply_count': reply_count,
+                'descendant_count': reply_count, 'level': level, 'position': position}
+
+    def test_build(self):
+        first = child_path('', 1)
+        comments = [
+            self.comment('', 1, 1, 1, reply_count=3),
+            self.comment(first, 4, 2, 1, reply_count=1),
+            self.comment(first, 5, 2, 2),
+            self.comment(first, 6, 2, 3),
+            self.comment('', 2, 1, 2),
+            self.comment('', 3, 1, 3),
+        ]
+        roots, more = build_lazy_thread(comments, '', limit=2, max_depth=2)
+
+        self.assertEqual([node['id'] for node in roots], [1, 2])
+        self.assertEqual(decode_more(more), ('', child_path('', 2)))
+        self.assertEqual([node['id'] for node in roots[0]['children']], [4, 5])
+        self.assertEqual(decode_more(roots[0]['more']), (first, child_path(first, 5)))
+        self.assertEqual(decode_more(roots[0]['children'][0]['more']), (child_path(first, 4), ''))
+        self.assertIsNone(roots[0]['children'][1]['more'])
+        self.assertIsNone(roots[1]['more'])
+
+
+class LocalCacheTestCase(SimpleTestCase):
+    def test_expire(self):
+        cache = LocalCache(max_size=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=-1)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_evict_least_recently_used(self):
+        cache = LocalCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['size'], 2)
+
+
+class PartitionTestCase(SimpleTestCase):
+    layout = (
+        ['id', 'post_id', 'tree_path'],
+        [('comments_post_id_idx', 'CREATE INDEX comments_post_id_idx ON public.comments USING btree (post_id)')],
+        [('comments_post_id_fk', 'FOREIGN KEY (post_id) REFERENCES posts(id) DEFERRABLE INITIALLY DEFERRED')],
+        [],
+    )
+
+    def test_prepare(self):
+        statements = prepare_statements(4, self.layout)
+
+        self.assertIn('PARTITION BY HASH (post_id)', statements[0])
+        self.assertIn('PRIMARY KEY (post_id, id)', statements[0])
+        self.assertEqual(len([s for s in statements if f'PARTITION OF public.{PARTITIONED_TABLE}' in s]), 4)
+        self.assertIn(f'CREATE INDEX comments_post_id_idx_part ON public.{PARTITIONED_TABLE} USING btree (post_id)',
+                      statements)
+        self.assertIn(f'ALTER TABLE public.{PARTITIONED_TABLE} ADD CONSTRAINT comments_post_id_fk '
+                      f'FOREIGN KEY (post_id) REFERENCES posts(id) DEFERRABLE INITIALLY DEFERRED', statements)
+        self.assertIn('NEW.id, NEW.post_id, NEW.tree_path', statements[-2])
+        self.assertTrue(statements[-1].startswith(f'CREATE TRIGGER {MIRROR_TRIGGER} '))
+
+    def test_copy_and_swap(self):
+        self.assertIn('WHERE id > %s AND id <= %s FOR SHARE ON CONFLICT DO NOTHING', copy_batch_query(self.layout[0]))
+
+        statements = swap_statements('public.comments_id_seq', ['comments_post_id_idx'])
+        self.assertTrue(statements[0].startswith('LOCK TABLE'))
+        # the old index is renamed before the new one takes its name
+        self.assertLess(statements.index('ALTER INDEX public.comments_post_id_idx RENAME TO '
+                                         'comments_post_id_idx_unpartitioned'),
+                        statements.index('ALTER INDEX public.comments_post_id_idx_part RENAME TO comments_post_id_idx'))
+        self.assertEqual(statements[-1], 'ALTER SEQUENCE public.comments_id_seq OWNED BY public.comments.id')
+
+        # An identity is stopped and the new table continues from its last id with a sequence of its own
+        statements = swap_statements('public.comments_id_seq', ['comments_post_id_idx'], identity=True)
+        self.assertNotIn('ALTER TABLE public.comments ALTER COLUMN id DROP DEFAULT', statements)
+        self.assertIn('ALTER SEQUENCE public.comments_id_seq RENAME TO comments_id_seq_unpartitioned', statements)
+        self.assertEqual(statements[-2:], [
+            "SELECT setval('public.comments_id_seq', last_value) FROM public.comments_id_seq_unpartitioned",
+            "ALTER TABLE public.comments ALTER COLUMN id SET DEFAULT nextval('public.comments_id_seq')",
+        ])
+
+
+class PartitionCommandTestCase(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
+        for key in redis_client.keys():
+            redis_client.delete(key)
+        local_cache.clear()
+
+        for i in range(2):
+            self.client.post('/api/v1/posts', {'body': f'Post {i}'}, 'application/json')
+        # Comments 1 to 12, every third one replying to the previous one
+        for i in range(12):
+            data = {'body': f'Comment {i}'} if i % 3 == 0 else {'body': f'Comment {i}', 'parent_id': i}
+            self.client.post(f'/api/v1/posts/{i // 6 + 1}/comments', data, 'application/json')
+
+        with connection.cursor() as cursor:
+            self.columns, indexes, _, _ = table_layout(cursor)
+        self.index_names = [name for name, _ in indexes]
+        self.addCleanup(self.unpartition)
+
+    def unpartition(self):
+        """
+        Put the unpartitioned comments table back for the next tests
+        """
+        with connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {MIRROR_TRIGGER} ON public.{TABLE}")
+                cursor.execute(f"DROP FUNCTION IF EXISTS public.{MIRROR_TRIGGER}()")
+                cursor.execute(f"DROP TABLE IF EXISTS public.{PARTITIONED_TABLE}")
+                return
+
+            # The id of the test database is an identity column, whose sequence was stopped by the swap
+            cursor.execute(f"select pg_get_serial_sequence('public.{TABLE}', 'id')")
+            sequence = cursor.fetchone()[0]
+            statements = [
+                f"DROP TABLE public.{TABLE}",
+                f"ALTER TABLE public.{PREVIOUS_TABLE} RENAME TO {TABLE}",
+                f"ALTER TABLE public.{TABLE} RENAME CONSTRAINT {PREVIOUS_TABLE}_pkey TO {TABLE}_pkey",
+                f"ALTER SEQUENCE {sequence}_unpartitioned RENAME TO {sequence.split('.')[-1]}",
+                f"ALTER SEQUENCE {sequence} NO MAXVALUE",
+            ]
+            statements += [f"ALTER INDEX public.{name}_unpartitioned RENAME TO {name}" for name in self.index_names]
+            for statement in statements:
+                cursor.execute(statement)
+
+    def test_partition_comments(self):
+        # Writes between the batches of the copy, to comments already copied, not copied yet and new ones
+        writes = iter([
+            lambda: (Comment.objects.filter(id__in=[2, 10]).update(body='Edited'),
+                     Comment.objects.filter(id=11).delete()),
+            lambda: (self.client.post('/api/v1/posts/2/comments', {'body': 'New'}, 'application/json'),
+                     Comment.objects.filter(id=3).delete()),
+            lambda: Comment.objects.filter(id=5).update(post_id=2),
+        ])
+        with mock.patch('backend.management.commands.partition_comments.time.sleep',
+                        side_effect=lambda seconds: next(writes)()):
+            call_command('partition_comments', partitions=4, batch_size=4, pause=1, stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor))
+            partitions = [table.split('.')[-1] for table in comment_tables(cursor)]
+            self.assertEqual(len(partitions), 4)
+
+            # The new table has the rows of the previous one, which had every write until the swap
+            columns = ', '.join(self.columns)
+            cursor.execute(f"select count(*) from ((select {columns} from public.{TABLE} "
+                           f"except select {columns} from public.{PREVIOUS_TABLE}) union all "
+                           f"(select {columns} from public.{PREVIOUS_TABLE} "
+                           f"except select {columns} from public.{TABLE})) difference")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+            # The new indexes have the names of the previous ones
+            self.assertEqual([name for name, _ in table_layout(cursor)[1]], self.index_names)
+            self.assertEqual([name for name, _ in table_layout(cursor, PREVIOUS_TABLE)[1]],
+                             [f'{name}_unpartitioned' for name in self.index_names])
+
+            # The comments of a post are read from a single partition
+            cursor.execute(f"explain select id from public.{TABLE} where post_id = %s", [1])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            self.assertEqual(len([partition for partition in partitions if f' {partition} ' in plan]), 1)
+
+        self.assertEqual(Comment.objects.count(), 11)
+        self.assertEqual(set(Comment.objects.filter(body='Edited').values_list('id', flat=True)), {2, 10})
+        self.assertFalse(Comment.objects.filter(id__in=[3, 11]).exists())
+        self.assertEqual(Comment.objects.get(id=5).post_id, 2)
+        self.assertTrue(Comment.objects.filter(id=13, body='New').exists())
+
+        # New comments take the next ids of the sequence
+        response = self.client.post('/api/v1/posts/1/comments', {'body': 'After the swap'}, 'application/json')
+        self.assertEqual(response.json()['id'], 14)
+
+
+class HotScoreTestCase(SimpleTestCase):
+    databases = {'default'}
+
+    def test_decay(self):
+        created_at = datetime(2023, 6, 1, tzinfo=timezone.utc)
+        older = created_at - timedelta(seconds=HOT_DECAY_SECONDS)
+
+        # an older post needs 10 times more comments to have the same score
+        self.assertAlmostEqual(hot_score(100, older), hot_score(10, created_at))
+        self.assertGreater(hot_score(10, created_at), hot_score(99, older))
+
+    def test_no_comments(self):
+        created_at = datetime(2023, 6, 1, tzinfo=timezone.utc)
+        self.assertEqual(hot_score(0, created_at), hot_score(1, created_at))
+
+    # the trigger of the migrated database computes hot_score, and no longer does once its decay changes
+    def test_trigger_check(self):
+        self.assertEqual(check_hot_trigger(databases=['default']), [])
+        with mock.patch('backend.ranking.HOT_DECAY_SECONDS', HOT_DECAY_SECONDS * 2):
+            self.assertEqual([error.id for error in check_hot_trigger(databases=['default'])], ['backend.E001'])
+
 
 def time_measured(func):
     @wraps(func)
@@ -229,6 +1752,7 @@ class StressTestCase(TransactionTestCase):
 
         for key in redis_client.keys():
             redis_client.delete(key)
+        local_cache.clear()
 
     @time_measured
     def generate(self, num_post, num_comment):
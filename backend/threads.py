@@ -0,0 +1,220 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db import connection
+from django.db.models.functions import Length
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound, ValidationError
+
+from backend.models import Comment
+from backend.paths import SEGMENT_WIDTH, depth, display_path
+
+"""
+Nested comment threads.
+All comments of a thread are read with a single range scan of the (post_id, tree_path) index, in depth-first order,
+and assembled into a tree in one pass: the parent of a comment is always read before the comment itself.
+
+Big threads are read lazily: only the first `limit` replies of each comment are read, down to `max_depth` levels.
+Each level of replies is a bounded scan of the (post_id, length(tree_path), tree_path) index, and every truncated
+level carries a `more` token that reads its next replies.
+"""
+THREAD_FIELDS = ('id', 'created_at', 'body', 'tree_path', 'reply_count', 'descendant_count')
+
+# Sort of the replies of a comment: key and whether it is descending
+THREAD_SORTS = {
+    'old': (None, False),
+    'new': ('id', True),
+    'top': ('descendant_count', True),
+}
+
+created_at_field = serializers.DateTimeField()
+
+
+def thread_comments(post_id, root_path='', max_depth=None):
+    """
+    Comments of a post, or replies of the comment with tree path `root_path`, in depth-first order.
+    With max_depth, only comments at most max_depth levels below the root are read.
+    """
+    comments = Comment.objects.filter(post_id=post_id)
+    if root_path:
+        comments = comments.filter(tree_path__startswith=root_path)
+    if max_depth is not None:
+        comments = comments.alias(path_length=Length('tree_path')). \
+            filter(path_length__lte=(depth(root_path) + max_depth) * SEGMENT_WIDTH)
+
+    return comments.order_by('tree_path').values(*THREAD_FIELDS)
+
+
+def comment_node(comment):
+    return {
+        'id': comment['id'],
+        'created_at': created_at_field.to_representation(comment['created_at']),
+        'body': comment['body'],
+        'path': display_path(comment['tree_path']),
+        'reply_count': comment['reply_count'],
+        'descendant_count': comment['descendant_count'],
+        'children': [],
+    }
+
+
+def post_node(post, comments):
+    return {
+        'id': post.id,
+        'created_at': created_at_field.to_representation(post.created_at),
+        'body': post.body,
+        'comments': comments,
+    }
+
+
+def build_thread(comments, sorts=()):
+    """
+    Nest comments read in depth-first order under their parents.
+    Returns the comments without a parent in the thread. The replies at each level are sorted by the sort of
+    that level in `sorts`, the last sort applying to all deeper levels.
+    """
+    roots = []
+    nodes = {}
+
+    for comment in comments:
+        node = comment_node(comment)
+        parent = nodes.get(comment['tree_path'][:-SEGMENT_WIDTH])
+        if parent is None:
+            roots.append(node)
+        else:
+            parent['children'].append(node)
+        nodes[comment['tree_path']] = node
+
+    if any(sort != 'old' for sort in sorts):
+        sort_level(roots, sorts)
+
+    return roots
+
+
+def sort_level(nodes, sorts, level=0):
+    key, descending = THREAD_SORTS[sorts[min(level, len(sorts) - 1)]]
+    if key is not None:
+        nodes.sort(key=lambda node: node[key], reverse=descending)
+
+    for node in nodes:
+        if node['children']:
+            sort_level(node['children'], sorts, level + 1)
+
+
+LAZY_THREAD_QUERY = """
+WITH RECURSIVE thread AS (
+    SELECT first_level.*, 1 AS level FROM (
+        SELECT page.*, row_number() over (order by page.tree_path) AS position FROM (
+            SELECT c.id, c.created_at, c.body, c.tree_path, c.reply_count, c.descendant_count FROM public.comments c
+            WHERE c.post_id = %(post_id)s AND length(c.tree_path) = %(length)s
+            AND c.tree_path > %(after)s AND c.tree_path < %(end)s
+            ORDER BY c.tree_path LIMIT %(limit)s + 1) page) first_level
+    UNION ALL
+    SELECT next_level.*, t.level + 1 FROM thread t, LATERAL (
+        SELECT page.*, row_number() over (order by page.tree_path) AS position FROM (
+            SELECT c.id, c.created_at, c.body, c.tree_path, c.reply_count, c.descendant_count FROM public.comments c
+            WHERE c.post_id = %(post_id)s AND length(c.tree_path) = length(t.tree_path) + %(segment_width)s
+            AND c.tree_path > t.tree_path AND c.tree_path < t.tree_path || 'g'
+            ORDER BY c.tree_path LIMIT %(limit)s + 1) page) next_level
+    WHERE t.level < %(max_depth)s AND t.position <= %(limit)s AND t.reply_count > 0
+)
+SELECT id, created_at, body, tree_path, reply_count, descendant_count, level, position FROM thread
+ORDER BY tree_path
+"""
+
+
+def encode_more(parent_path, after):
+    return urlsafe_b64encode(json.dumps({'p': parent_path, 'a': after}).encode()).decode('ascii')
+
+
+def decode_more(token):
+    try:
+        more = json.loads(urlsafe_b64decode(token.encode('ascii')))
+        parent_path, after = more['p'], more['a']
+    except (TypeError, ValueError, KeyError):
+        raise NotFound('Invalid cursor')
+
+    if not isinstance(parent_path, str) or not isinstance(after, str):
+        raise NotFound('Invalid cursor')
+
+    return parent_path, after
+
+
+def lazy_thread_comments(post_id, parent_path, after, limit, max_depth):
+    """
+    First `limit` replies after `after` of the comment with tree path `parent_path`, each with its first `limit`
+    replies and so on down to `max_depth` levels, plus one more reply per level telling that it is truncated.
+    A hex digit is always lower than 'g', so the replies of a comment are the tree paths between its own and its own
+    followed by 'g'.
+    """
+    params = {
+        'post_id': post_id,
+        'length': len(parent_path) + SEGMENT_WIDTH,
+        'after': max(after, parent_path),
+        'end': f'{parent_path}g',
+        'limit': limit,
+        'max_depth': max_depth,
+        'segment_width': SEGMENT_WIDTH,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(LAZY_THREAD_QUERY, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def build_lazy_thread(comments, parent_path, limit, max_depth):
+    """
+    Nest comments read by lazy_thread_comments under their parents, in one pass.
+    Returns the replies of the parent and the token of its next replies.
+    """
+    parent = {'children': [], 'more': None}
+    nodes = {parent_path: parent}
+    last_reply_paths = {}
+
+    for comment in comments:
+        comment_parent_path = comment['tree_path'][:-SEGMENT_WIDTH]
+        if comment['position'] > limit:
+            nodes[comment_parent_path]['more'] = encode_more(comment_parent_path, last_reply_paths[comment_parent_path])
+            continue
+
+        node = comment_node(comment)
+        node['more'] = None
+        if comment['level'] == max_depth and comment['reply_count'] > 0:
+            node['more'] = encode_more(comment['tree_path'], '')
+
+        nodes[comment_parent_path]['children'].append(node)
+        nodes[comment['tree_path']] = node
+        last_reply_paths[comment_parent_path] = comment['tree_path']
+
+    return parent['children'], parent['more']
+
+
+def parse_thread_params(query_params):
+    max_depth = query_params.get('max_depth')
+    if max_depth is not None:
+        if not max_depth.isdigit() or int(max_depth) < 1:
+            raise ValidationError({'max_depth': 'Must be a positive integer'})
+        max_depth = int(max_depth)
+
+    sorts = query_params.get('sort', 'old').split(',')
+    if any(sort not in THREAD_SORTS for sort in sorts):
+        raise ValidationError({'sort': f'Must be a comma separated list of: {", ".join(THREAD_SORTS)}'})
+
+    return max_depth, sorts
+
+
+def parse_lazy_thread_params(query_params):
+    """
+    Replies per level and depth of a lazy thread, None when the whole thread is read
+    """
+    limit = query_params.get('limit')
+    if limit is None:
+        return None, None
+
+    if not limit.isdigit() or int(limit) < 1:
+        raise ValidationError({'limit': 'Must be a positive integer'})
+
+    max_depth, sorts = parse_thread_params(query_params)
+    if sorts != ['old']:
+        raise ValidationError({'sort': 'Replies of a thread read with a limit are sorted from oldest to newest'})
+
+    return int(limit), max_depth or 3
@@ -1,10 +1,20 @@
 from django.urls import path
 
-from backend import views
+from backend import async_views, views
 
 urlpatterns = [
     path('posts', views.PostsView.as_view()),
+    path('posts/bulk', views.BulkPostsView.as_view()),
     path('posts/<int:post_id>', views.PostView.as_view()),
     path('posts/<int:post_id>/comments', views.CommentsView.as_view()),
+    path('posts/<int:post_id>/comments/bulk', views.BulkCommentsView.as_view()),
     path('posts/<int:post_id>/comments/<int:comment_id>', views.NestedCommentsView.as_view()),
+    path('posts/<int:post_id>/comments/<int:comment_id>/move', views.CommentMoveView.as_view()),
+    path('posts/<int:post_id>/thread', views.ThreadView.as_view()),
+    path('posts/<int:post_id>/comments/<int:comment_id>/thread', views.ThreadView.as_view()),
+    path('search', views.SearchView.as_view()),
+    path('cache/stats', views.CacheStatsView.as_view()),
+    path('async/posts', async_views.AsyncPostsView.as_view()),
+    path('async/posts/<int:post_id>', async_views.AsyncPostView.as_view()),
+    path('async/posts/<int:post_id>/comments/<int:comment_id>', async_views.AsyncNestedCommentsView.as_view()),
 ]
@@ -0,0 +1,217 @@
+import uuid
+from functools import wraps
+
+import redis
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from backend.cache import aget_post, get_post
+from backend.metrics import record_fallback
+from backend.models import Comment
+from backend.redis_client import async_redis_client, redis_client
+from backend.routers import use_primary
+
+"""
+Versions of the comments of posts, for conditional GETs.
+Every write of the comments of a post bumps its version in the POST_VERSIONS_KEY hash, with the time of the write.
+The ETag of a post is its version prefixed by the epoch of the hash, a random token created with the hash, so the
+versions restarting after redis lost its data never match an ETag given before. A post without a version yet, e.g.
+after a restart, starts at version 0 with the time of its last comment, read from an index.
+A bump that cannot reach redis leaves an outdated version, so all the versions are reset once redis is back.
+"""
+POST_VERSIONS_KEY = 'posts:versions'
+EPOCH_FIELD = 'epoch'
+
+BUMP_VERSION_SCRIPT = """
+redis.call('hsetnx', KEYS[1], 'epoch', ARGV[3])
+local current = redis.call('hget', KEYS[1], ARGV[1])
+local version = 1
+if current then
+    version = tonumber(string.match(current, '^%d+')) + 1
+end
+redis.call('hset', KEYS[1], ARGV[1], version .. ':' .. ARGV[2])
+return version
+"""
+
+START_VERSION_SCRIPT = """
+redis.call('hsetnx', KEYS[1], 'epoch', ARGV[3])
+redis.call('hsetnx', KEYS[1], ARGV[1], '0:' .. ARGV[2])
+return redis.call('hmget', KEYS[1], 'epoch', ARGV[1])
+"""
+
+_reset_pending = False
+
+
+def new_epoch():
+    return uuid.uuid4().hex[:12]
+
+
+def reset_pending_versions():
+    global _reset_pending
+
+    if _reset_pending:
+        redis_client.delete(POST_VERSIONS_KEY)
+        _reset_pending = False
+
+
+def reset_post_versions():
+    """
+    Forget the versions of all posts, e.g. after comments were changed without bumping them
+    """
+    redis_client.delete(POST_VERSIONS_KEY)
+
+
+def bump_post_version(post_id):
+    """
+    Called once the comments written to a post are committed, so a client never gets the new version with the
+    old comments
+    """
+    global _reset_pending
+
+    try:
+        reset_pending_versions()
+        redis_client.eval(BUMP_VERSION_SCRIPT, 1, POST_VERSIONS_KEY, str(post_id), int(timezone.now().timestamp()),
+                          new_epoch())
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('post_version')
+        _reset_pending = True
+
+
+def get_post_version(post):
+    """
+    ETag and last modified timestamp of the comments of a post, None without redis
+    """
+    try:
+        reset_pending_versions()
+        epoch, value = redis_client.hmget(POST_VERSIONS_KEY, EPOCH_FIELD, str(post.id))
+        if epoch is None or value is None:
+            last_comment_at = Comment.objects.filter(post_id=post.id).aggregate(Max('created_at'))['created_at__max']
+            modified_at = max(post.created_at, last_comment_at or post.created_at)
+            epoch, value = redis_client.eval(START_VERSION_SCRIPT, 1, POST_VERSIONS_KEY, str(post.id),
+                                             int(modified_at.timestamp()), new_epoch())
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('post_version')
+        return None
+
+    return parse_version(epoch, value)
+
+
+async def aget_post_version(post):
+    """
+    Async get_post_version
+    """
+    global _reset_pending
+
+    client = async_redis_client()
+    try:
+        if _reset_pending:
+            await client.delete(POST_VERSIONS_KEY)
+            _reset_pending = False
+        epoch, value = await client.hmget(POST_VERSIONS_KEY, EPOCH_FIELD, str(post.id))
+        if epoch is None or value is None:
+            aggregate = await Comment.objects.filter(post_id=post.id).aaggregate(Max('created_at'))
+            last_comment_at = aggregate['created_at__max']
+            modified_at = max(post.created_at, last_comment_at or post.created_at)
+            epoch, value = await client.eval(START_VERSION_SCRIPT, 1, POST_VERSIONS_KEY, str(post.id),
+                                             int(modified_at.timestamp()), new_epoch())
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('post_version')
+        return None
+
+    return parse_version(epoch, value)
+
+
+def parse_version(epoch, value):
+    version, modified_at = value.split(':')
+
+    return f'"{epoch}.{version}"', int(modified_at)
+
+
+def set_version_headers(response, version):
+    etag, last_modified = version
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Clients keep the response but revalidate it on every request
+    patch_cache_control(response, no_cache=True)
+
+    return response
+
+
+def not_modified(request, version):
+    """
+    Response 304 to a conditional GET of the version of a post, None when the client does not have it
+    """
+    if version is None:
+        return None
+
+    etag, last_modified = version
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    return None if response is None else set_version_headers(response, version)
+
+
+def with_version(response, version):
+    """
+    Responses served from the response cache have the version they were built from. Streamed bodies are read once
+    the view has returned, outside of the primary, so they are not given any version.
+    """
+    if response.status_code == 200 and not response.streaming and not response.has_header('ETag'):
+        set_version_headers(response, version)
+
+    return response
+
+
+def conditional_get(view_method):
+    """
+    Answer conditional GETs of a view of the comments of a post with 304 from the version of the post, before
+    the view reads any comment. The version is given to the view as its post_version, and the view reads the
+    comments of a response with a version from the primary.
+    """
+
+    @wraps(view_method)
+    def get(view, request, post_id, *args, **kwargs):
+        post = get_post(post_id)
+        version = None if post is None else get_post_version(post)
+        view.post_version = version
+
+        response = not_modified(request, version)
+        if response is not None:
+            return response
+
+        if version is None:
+            return view_method(view, request, post_id, *args, **kwargs)
+
+        # A replica may not have the comments of the version yet, so the body given the version is read from the primary
+        with use_primary():
+            return with_version(view_method(view, request, post_id, *args, **kwargs), version)
+
+    return get
+
+
+def aconditional_get(view_method):
+    """
+    conditional_get of an async view
+    """
+
+    @wraps(view_method)
+    async def get(view, request, post_id, *args, **kwargs):
+        post = await aget_post(post_id)
+        version = None if post is None else await aget_post_version(post)
+        view.post_version = version
+
+        response = not_modified(request, version)
+        if response is not None:
+            return response
+
+        if version is None:
+            return await view_method(view, request, post_id, *args, **kwargs)
+
+        with use_primary():
+            return with_version(await view_method(view, request, post_id, *args, **kwargs), version)
+
+    return get
@@ -1,55 +1,168 @@
 import json
 
 import redis
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import GenericAPIView, ListCreateAPIView
 from rest_framework.response import Response
 
+from backend.cache import get_post, local_cache
+from backend.counters import comment_counter
+from backend.encoders import COMMENT_ROW, COMMENT_WITH_POST_ROW, POST_ROW, fast_read_enabled, post_detail
+from backend.live import publish_comments
+from backend.metrics import record_fallback, render
 from backend.models import Post, Comment
+from backend.pagination import KeysetPagination, RankingPagination, SearchPagination
+from backend.paths import SEGMENT_WIDTH, allocate_comment_ids, child_path
+from backend.ranking import HOT_KEY, TOP_KEY, SORT_HOT, SORT_NEW, SORT_TOP, SORTS, hot_score, hot_score_column
+from backend.redis_client import redis_client
+from backend.replies import add_replies
+from backend.response_cache import cacheable, cached_response, response_cache_stats
+from backend.search import COMMENTS, SEARCH_TYPES, Search
 from backend.serializers import PostsSerializer, PostSerializer, CommentPostSerializer, CommentGetSerializer
-from config import *
+from backend.snapshots import RANKING_VERSION_KEY, RankingPages, get_ranking
+from backend.streaming import STREAM_FORMATS, STREAM_UNSUPPORTED_MESSAGE, stream_post, streaming_supported
+from backend.subtrees import DELETE_MODES, TOMBSTONE, delete_subtree, lock_reply_parents, lock_subtree, move_subtree, \
+    parent_path, tombstone_comment
+from backend.threads import THREAD_FIELDS, build_lazy_thread, build_thread, comment_node, decode_more, \
+    lazy_thread_comments, parse_lazy_thread_params, parse_thread_params, post_node, thread_comments
+from backend.versions import bump_post_version, conditional_get
 
-redis_client = None
-try:
-    redis_client = redis.Redis(host=host, port=6379, db=0, charset="utf-8", decode_responses=True)
-except Exception:
-    pass
+
+def add_posts_to_rankings(posts):
+    """
+    Add total_comments and hot score of new posts to redis
+    """
+    try:
+        pipeline = redis_client.pipeline()
+        pipeline.zadd(TOP_KEY, {str(post.id): 0 for post in posts})
+        pipeline.zadd(HOT_KEY, {str(post.id): hot_score(0, post.created_at) for post in posts})
+        pipeline.incr(RANKING_VERSION_KEY)
+        pipeline.execute()
+    except (redis.exceptions.ConnectionError,
+            redis.exceptions.BusyLoadingError):
+        record_fallback('post_rankings')
+
+
+def parse_batch(request):
+    """
+    Objects of a bulk create request: a non-empty JSON array of at most BULK_CREATE_MAX_SIZE objects
+    """
+    data = json.loads(request.body)
+
+    if not isinstance(data, list) or not data or not all(isinstance(item, dict) for item in data):
+        raise ValidationError({'non_field_errors': 'Must be a non-empty array of objects'})
+
+    if len(data) > settings.BULK_CREATE_MAX_SIZE:
+        raise ValidationError({'non_field_errors': f'Must have at most {settings.BULK_CREATE_MAX_SIZE} objects'})
+
+    return data
 
 
 class PostsView(ListCreateAPIView):
     authentication_classes = ()
     serializer_class = PostsSerializer
+    pagination_class = RankingPagination
+
+    def get_ranking_params(self):
+        get_items = self.request.GET
+        limit = self.paginator.get_limit(self.request)
+        sort = get_items.get('sort', SORT_TOP)
+
+        if sort not in SORTS:
+            raise ValidationError({'sort': f'Must be one of: {", ".join(SORTS)}'})
+
+        return limit, sort
+
+    def get_keyset_ordering(self):
+        sort = self.get_ranking_params()[1]
+
+        if sort == SORT_NEW:
+            return '-created_at', '-id'
+
+        if sort == SORT_HOT:
+            return '-hot', '-id'
+
+        return '-total_comments', '-id'
 
     """
-    Get top hot posts
+    Columns of the rows of the fast read path: the fields of a post, then the ordering values it lacks
     """
 
-    def get_queryset(self):
-        get_items = self.request.GET
-        limit = get_items.get('limit')
+    def get_keyset_columns(self):
+        ordering_fields = [field.lstrip('-') for field in self.get_keyset_ordering()]
 
-        if limit is not None:
-            limit = int(limit) - 1
+        return POST_ROW.fields + tuple(field for field in ordering_fields if field not in POST_ROW.fields)
 
-        """
-        Get list ids from redis
-        """
-        try:
-            top_posts = redis_client.zrange('comments', 0, limit - 1, desc=True, withscores=True)
-        except (redis.exceptions.ConnectionError,
-                redis.exceptions.BusyLoadingError):
-            top_posts = []
+    """
+    Position of a post in its ranking, posts served from redis are serialized
+    """
 
-        """
-        If list_comment_ids exists in redis, query list comments from list_comment_ids in posts table.
-        Else, query directly from posts table
-        """
-        if len(top_posts):
-            for post_id, total_comments in top_posts:
-                Post.objects.filter(id=post_id).update(total_comments=total_comments)
-            return Post.objects.filter(id__in=[post_id for post_id, total_comments in top_posts]). \
-                order_by('-total_comments')
+    def get_keyset_position(self, post):
+        if isinstance(post, tuple):
+            columns = self.get_keyset_columns()
+            return [post[columns.index(field.lstrip('-'))] for field in self.get_keyset_ordering()]
+
+        if not isinstance(post, dict):
+            return [getattr(post, field.lstrip('-')) for field in self.get_keyset_ordering()]
+
+        if self.get_ranking_params()[1] == SORT_HOT:
+            return hot_score(post['total_comments'], parse_datetime(post['created_at'])), post['id']
 
-        return Post.objects.order_by('-total_comments')
+        return post['total_comments'], post['id']
+
+    """
+    Get top hot posts from the snapshot of their ranking in redis.
+    Next pages are read from the sorted set of the ranking, and all pages from posts table without redis.
+    """
+
+    def list(self, request, *args, **kwargs):
+        page = None
+        if self.get_ranking_params()[1] != SORT_NEW:
+            try:
+                page = self.paginate_queryset(self.get_ranked_posts())
+            except (redis.exceptions.ConnectionError,
+                    redis.exceptions.BusyLoadingError):
+                record_fallback('ranking')
+
+        if page:
+            return self.get_paginated_response(page)
+
+        return self.list_from_database(request)
+
+    def first_page_ranked(self):
+        return self.get_ranking_params()[1] != SORT_NEW and self.paginator.cursor_query_param not in self.request.GET
+
+    def get_ranked_posts(self):
+        limit, sort = self.get_ranking_params()
+        if self.first_page_ranked():
+            # One more post tells the paginator whether there is a next page
+            return get_ranking(sort, limit + 1)
+
+        return RankingPages(sort)
+
+    def list_from_database(self, request):
+        if fast_read_enabled():
+            rows = self.filter_queryset(self.get_queryset()).values_list(*self.get_keyset_columns())
+            page = self.paginate_queryset(rows)
+            return self.get_paginated_response(POST_ROW.encode(page))
+
+        return super().list(request)
+
+    """
+    Query posts directly from posts table when their ranking is not in redis
+    """
+
+    def get_queryset(self):
+        sort = self.get_ranking_params()[1]
+
+        if sort == SORT_HOT:
+            return Post.objects.annotate(hot=hot_score_column()).order_by(*self.get_keyset_ordering())
+
+        return Post.objects.order_by(*self.get_keyset_ordering())
 
     """
     Create new post
@@ -63,18 +176,29 @@ class PostsView(ListCreateAPIView):
 
         response = serializer.data
 
-        """
-        Add total_comments of new post to redis
-        """
-        try:
-            redis_client.zadd('comments', {str(response['id']): 0})
-        except (redis.exceptions.ConnectionError,
-                redis.exceptions.BusyLoadingError):
-            pass
+        add_posts_to_rankings([serializer.instance])
 
         return Response(response, status=201)
 
 
+class BulkPostsView(GenericAPIView):
+    authentication_classes = ()
+
+    """
+    Create many posts with a single insert and a single redis pipeline
+    """
+
+    def post(self, request):
+        data = parse_batch(request)
+        serializer = PostSerializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        posts = Post.objects.bulk_create([Post(**item) for item in serializer.validated_data])
+        add_posts_to_rankings(posts)
+
+        return Response(PostsSerializer(posts, many=True).data, status=201)
+
+
 class PostView(GenericAPIView):
     authentication_classes = ()
 
@@ -82,20 +206,43 @@ class PostView(GenericAPIView):
     Get a post by its id
     """
 
+    @conditional_get
     def get(self, request, post_id):
-        post = Post.objects.filter(id=post_id).first()
+        post = get_post(post_id)
 
         if post is None:
             return Response(data={'code': 'not_found', 'message': 'Post not found'}, status=404)
+
+        """
+        Stream big threads instead of loading all their comments in memory
+        """
+        stream_format = request.GET.get('stream')
+        if stream_format is not None:
+            if not streaming_supported(request._request):
+                raise ValidationError({'stream': STREAM_UNSUPPORTED_MESSAGE})
+            if stream_format not in STREAM_FORMATS:
+                raise ValidationError({'stream': f'Must be one of: {", ".join(STREAM_FORMATS)}'})
+            return StreamingHttpResponse(stream_post(post, stream_format), content_type=STREAM_FORMATS[stream_format])
+
+        if cacheable(request, self.post_version):
+            return cached_response(post_id, 'post', self.post_version, lambda: self.get_data(post))
+
+        return Response(self.get_data(post))
+
+    def get_data(self, post):
+        if fast_read_enabled():
+            comments = COMMENT_ROW.encode(COMMENT_ROW.values_list(post.comments.all()))
+            return post_detail(post, comments)
+
         post_serializer = PostSerializer(instance=post)
-        res = post_serializer.data
 
-        return Response(res)
+        return post_serializer.data
 
 
 class CommentsView(ListCreateAPIView):
     authentication_classes = ()
     serializer_class = CommentPostSerializer
+    pagination_class = KeysetPagination
 
     """
     Custom get query set for comments
@@ -106,14 +253,32 @@ class CommentsView(ListCreateAPIView):
 
         return Comment.objects. \
             filter(post_id=post_id). \
-            order_by('-created_at')
+            order_by('-created_at', '-id')
+
+    def get_keyset_position(self, comment):
+        if isinstance(comment, tuple):
+            return comment[COMMENT_ROW.index('created_at')], comment[COMMENT_ROW.index('id')]
+
+        return comment.created_at, comment.id
+
+    """
+    List comments of a post, from values_list rows on the fast read path
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not fast_read_enabled():
+            return super().list(request, *args, **kwargs)
+
+        page = self.paginate_queryset(COMMENT_ROW.values_list(self.filter_queryset(self.get_queryset())))
+
+        return self.get_paginated_response(COMMENT_ROW.encode(page))
 
     """
     Create new comment for a post
     """
 
     def post(self, request, post_id):
-        post = Post.objects.filter(id=post_id).first()
+        post = get_post(post_id)
 
         if post is None:
             return Response(data={'code': 'post_not_found',
@@ -121,45 +286,128 @@ class CommentsView(ListCreateAPIView):
         data = json.loads(request.body)
         data['post'] = post_id
         parent_id = data.get('parent_id', None)
-
-        # Update path from parent comment
-        if parent_id is not None:
-            parent_comment = self.get_queryset().filter(id=parent_id).first()
-            if parent_comment is not None:
-                data['path'] = f'{parent_comment.path}/{parent_id}'
+        if parent_id is not None and (not isinstance(parent_id, int) or isinstance(parent_id, bool)):
+            raise ValidationError({'parent_id': 'Must be an integer'})
 
         serializer = CommentGetSerializer(data=data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        comment_id = allocate_comment_ids(1)[0]
+        with transaction.atomic():
+            # Update path from parent comment, locked with its ancestors until the reply is added
+            parent_path = ''
+            if parent_id is not None:
+                parent_path = lock_reply_parents(post_id, [parent_id]).get(parent_id, '')
 
-        """
-        Get total comments value of post id from Redis
-        """
-        try:
-            total_comments = redis_client.zscore('comments', str(post.id))
-        except (redis.exceptions.ConnectionError,
-                redis.exceptions.BusyLoadingError):
-            total_comments = Comment.objects.filter(post_id=post_id).count()
-
-        """
-        If value of total comments in redis is None, count it from db
-        Else increase total comment with 1
-        """
-        if total_comments is None:
-            total_comments = Comment.objects.filter(post_id=post_id).count()
-        else:
-            total_comments = int(total_comments) + 1
+            serializer.save(id=comment_id, tree_path=child_path(parent_path, comment_id))
+            add_replies(post_id, [parent_path])
 
         """
-        Update total comments value in redis
+        Count the new comment and update the rankings of its post
         """
-        try:
-            redis_client.zadd('comments', {str(post.id): total_comments})
-        except (redis.exceptions.ConnectionError,
-                redis.exceptions.BusyLoadingError):
-            Post.objects.filter(id=post_id).update(total_comments=total_comments)
+        comment_counter().add(post, 1)
+        bump_post_version(post_id)
 
         response = serializer.data
+        publish_comments(post_id, [response])
+
+        return Response(response, status=201)
+
+
+class BulkCommentsView(GenericAPIView):
+    authentication_classes = ()
+
+    """
+    A comment of a batch replies to an existing comment of the post with `parent_id`, or to a previous comment
+    of the batch with `parent_temp_id`, the `temp_id` of that comment
+    """
+
+    @staticmethod
+    def validate_parents(data):
+        errors = []
+        temp_ids = set()
+
+        for item in data:
+            item_errors = {}
+            temp_id = item.get('temp_id')
+            parent_temp_id = item.get('parent_temp_id')
+            parent_id = item.get('parent_id')
+
+            if parent_id is not None and (not isinstance(parent_id, int) or isinstance(parent_id, bool)):
+                item_errors['parent_id'] = 'Must be an integer'
+            if parent_temp_id is not None and parent_id is not None:
+                item_errors['parent_temp_id'] = 'Must not be given with parent_id'
+            elif parent_temp_id is not None and (isinstance(parent_temp_id, (dict, list)) or
+                                                 parent_temp_id not in temp_ids):
+                item_errors['parent_temp_id'] = 'Must be the temp_id of a previous comment of the batch'
+            if temp_id is not None and (isinstance(temp_id, (dict, list)) or temp_id in temp_ids):
+                item_errors['temp_id'] = 'Must be unique in the batch'
+            elif temp_id is not None:
+                temp_ids.add(temp_id)
+
+            errors.append(item_errors)
+
+        if any(errors):
+            raise ValidationError(errors)
+
+    """
+    Tree paths of the comments of a batch, their parents in the post being read and locked with their ancestors
+    by a single query
+    """
+
+    @staticmethod
+    def get_tree_paths(post_id, data, comment_ids):
+        parent_ids = {item['parent_id'] for item in data if item.get('parent_id') is not None}
+        parent_paths = {}
+        if parent_ids:
+            parent_paths = lock_reply_parents(post_id, parent_ids)
+
+        tree_paths = []
+        batch_paths = {}
+        for item, comment_id in zip(data, comment_ids):
+            if item.get('parent_temp_id') is not None:
+                parent_path = batch_paths[item['parent_temp_id']]
+            else:
+                parent_path = parent_paths.get(item.get('parent_id'), '')
+
+            tree_path = child_path(parent_path, comment_id)
+            tree_paths.append(tree_path)
+            if item.get('temp_id') is not None:
+                batch_paths[item['temp_id']] = tree_path
+
+        return tree_paths
+
+    """
+    Create many comments of a post with a single insert in one transaction and a single redis pipeline
+    """
+
+    def post(self, request, post_id):
+        post = get_post(post_id)
+
+        if post is None:
+            return Response(data={'code': 'post_not_found',
+                                  'message': 'Post not found'}, status=404)
+        data = parse_batch(request)
+        serializer = CommentPostSerializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        self.validate_parents(data)
+
+        comment_ids = allocate_comment_ids(len(data))
+
+        with transaction.atomic():
+            tree_paths = self.get_tree_paths(post_id, data, comment_ids)
+            comments = [Comment(id=comment_id, tree_path=tree_path, post_id=post_id, **item)
+                        for comment_id, tree_path, item in zip(comment_ids, tree_paths, serializer.validated_data)]
+            Comment.objects.bulk_create(comments)
+            add_replies(post_id, [tree_path[:-SEGMENT_WIDTH] for tree_path in tree_paths])
+
+        comment_counter().add(post, len(comments))
+        bump_post_version(post_id)
+
+        response = CommentGetSerializer(comments, many=True).data
+        publish_comments(post_id, response)
+        for comment, item in zip(response, data):
+            if item.get('temp_id') is not None:
+                comment['temp_id'] = item['temp_id']
 
         return Response(response, status=201)
 
@@ -176,10 +424,11 @@ class NestedCommentsView(GenericAPIView):
 
         return Comment.objects. \
             filter(post_id=post_id). \
-            order_by('-created_at')
+            order_by('tree_path')
 
+    @conditional_get
     def get(self, request, post_id, comment_id):
-        post = Post.objects.filter(id=post_id).first()
+        post = get_post(post_id)
 
         if post is None:
             return Response(data={'code': 'post_not_found',
@@ -191,11 +440,252 @@ class NestedCommentsView(GenericAPIView):
             return Response(data={'code': 'comment_not_found',
                                   'message': 'Comment not found'}, status=404)
 
-        child_path = f'{comment.path}/{comment_id}'
-        response = [
-            CommentGetSerializer(comment).data for comment in Comment.objects.filter(path__startswith=child_path)[::1]
-        ]
-        response.insert(0, CommentGetSerializer(comment).data)
-        response = Response(response)
+        if cacheable(request, self.post_version):
+            return cached_response(post_id, f'subtree:{comment_id}', self.post_version,
+                                   lambda: self.get_subtree_data(comment))
+
+        return Response(self.get_subtree_data(comment))
+
+    """
+    The comment and its replies are a single range of tree paths, already in depth-first order
+    """
+
+    def get_subtree_data(self, comment):
+        subtree = self.get_queryset().filter(tree_path__startswith=comment.tree_path)
+        if fast_read_enabled():
+            return COMMENT_WITH_POST_ROW.encode(COMMENT_WITH_POST_ROW.values_list(subtree))
+
+        return CommentGetSerializer(subtree, many=True).data
+
+    """
+    Delete a comment, replacing its body and keeping its replies, or with mode=hard deleting it with all its replies
+    """
+
+    def delete(self, request, post_id, comment_id):
+        mode = request.GET.get('mode', TOMBSTONE)
+        if mode not in DELETE_MODES:
+            raise ValidationError({'mode': f'Must be one of: {", ".join(DELETE_MODES)}'})
+
+        post = get_post(post_id)
+
+        if post is None:
+            return Response(data={'code': 'post_not_found',
+                                  'message': 'Post not found'}, status=404)
+
+        # The comment and its ancestors are locked until its subtree is deleted, so it is not moved in between
+        with transaction.atomic():
+            if mode == TOMBSTONE:
+                tree_path = self.get_queryset().filter(id=comment_id).values_list('tree_path', flat=True).first()
+            else:
+                tree_path = lock_subtree(post_id, comment_id)[0]
+
+            if tree_path is None:
+                return Response(data={'code': 'comment_not_found',
+                                      'message': 'Comment not found'}, status=404)
+
+            total_deleted = 0
+            if mode == TOMBSTONE:
+                tombstone_comment(post_id, comment_id)
+            else:
+                total_deleted = delete_subtree(post_id, tree_path)
+
+        if total_deleted:
+            comment_counter().add(post, -total_deleted)
+        bump_post_version(post_id)
+
+        return Response(status=204)
+
+
+class CommentMoveView(GenericAPIView):
+    authentication_classes = ()
+
+    """
+    Move a comment with all its replies under another comment, `parent_id`, or to the top of a post, of the same
+    post or of another one, `post_id`
+    """
+
+    def post(self, request, post_id, comment_id):
+        post = get_post(post_id)
+
+        if post is None:
+            return Response(data={'code': 'post_not_found',
+                                  'message': 'Post not found'}, status=404)
+        data = request.data
+        if not isinstance(data, dict):
+            raise ValidationError({'non_field_errors': 'Must be an object'})
+
+        new_post_id = data.get('post_id', post_id)
+        parent_id = data.get('parent_id')
+
+        for field, value in (('post_id', new_post_id), ('parent_id', parent_id)):
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+                raise ValidationError({field: 'Must be an integer'})
+
+        new_post = post if new_post_id == post_id else get_post(new_post_id)
+
+        if new_post is None:
+            return Response(data={'code': 'post_not_found',
+                                  'message': 'Post not found'}, status=404)
+
+        # The comment, its new parent and the ancestors of both are locked until the subtree is moved
+        total_moved = None
+        with transaction.atomic():
+            tree_path, new_parent_path = lock_subtree(post_id, comment_id, new_post_id, parent_id)
+
+            if tree_path is None:
+                return Response(data={'code': 'comment_not_found',
+                                      'message': 'Comment not found'}, status=404)
+
+            if parent_id is None:
+                new_parent_path = ''
+            elif new_parent_path is None:
+                return Response(data={'code': 'parent_not_found',
+                                      'message': 'Parent comment not found'}, status=404)
+            elif new_post_id == post_id and new_parent_path.startswith(tree_path):
+                raise ValidationError({'parent_id': 'Must not be the comment or one of its replies'})
+
+            if (new_post_id, new_parent_path) != (post_id, parent_path(tree_path)):
+                total_moved = move_subtree(post_id, tree_path, new_post_id, new_parent_path)
+
+        if total_moved is not None:
+            if total_moved and new_post_id != post_id:
+                comment_counter().add(post, -total_moved)
+                comment_counter().add(new_post, total_moved)
+            bump_post_version(post_id)
+            if new_post_id != post_id:
+                bump_post_version(new_post_id)
+
+        comment = Comment.objects.filter(post_id=new_post_id, id=comment_id).first()
+
+        return Response(CommentGetSerializer(comment).data)
+
+
+class ThreadView(GenericAPIView):
+    authentication_classes = ()
+
+    """
+    Get the comments of a post, or the replies of a comment, nested in a tree
+    """
+
+    @conditional_get
+    def get(self, request, post_id, comment_id=None):
+        post = get_post(post_id)
+
+        if post is None:
+            return Response(data={'code': 'post_not_found',
+                                  'message': 'Post not found'}, status=404)
+
+        limit, lazy_depth = parse_lazy_thread_params(request.GET)
+        if limit is not None:
+            return self.get_lazy(request, post, comment_id, limit, lazy_depth)
+
+        max_depth, sorts = parse_thread_params(request.GET)
+
+        if comment_id is None:
+            comments = build_thread(thread_comments(post_id, max_depth=max_depth), sorts)
+            return Response(post_node(post, comments))
+
+        root_path = Comment.objects.filter(post_id=post_id, id=comment_id).values_list('tree_path', flat=True).first()
+
+        if root_path is None:
+            return Response(data={'code': 'comment_not_found',
+                                  'message': 'Comment not found'}, status=404)
+
+        comments = build_thread(thread_comments(post_id, root_path, max_depth), sorts)
+
+        return Response(comments[0])
+
+    """
+    Get the first `limit` replies of each comment down to `max_depth` levels.
+    With a cursor, get the next replies of a truncated level.
+    """
+
+    def get_lazy(self, request, post, comment_id, limit, max_depth):
+        cursor = request.GET.get('cursor')
+        if cursor is not None:
+            parent_path, after = decode_more(cursor)
+            comments, more = build_lazy_thread(lazy_thread_comments(post.id, parent_path, after, limit, max_depth),
+                                               parent_path, limit, max_depth)
+            return Response({'comments': comments, 'more': more})
+
+        if comment_id is None:
+            comments, more = build_lazy_thread(lazy_thread_comments(post.id, '', '', limit, max_depth),
+                                               '', limit, max_depth)
+            response = post_node(post, comments)
+            response['more'] = more
+            return Response(response)
+
+        comment = Comment.objects.filter(post_id=post.id, id=comment_id).values(*THREAD_FIELDS).first()
+
+        if comment is None:
+            return Response(data={'code': 'comment_not_found',
+                                  'message': 'Comment not found'}, status=404)
+
+        response = comment_node(comment)
+        response['children'], response['more'] = build_lazy_thread(
+            lazy_thread_comments(post.id, comment['tree_path'], '', limit, max_depth),
+            comment['tree_path'], limit, max_depth)
+
+        return Response(response)
+
+
+class SearchView(GenericAPIView):
+    authentication_classes = ()
+    pagination_class = SearchPagination
+
+    def get_search(self):
+        get_items = self.request.GET
+        query = get_items.get('q', '').strip()
+        search_type = get_items.get('type', COMMENTS if 'post_id' in get_items else SEARCH_TYPES[0])
+
+        if not query:
+            raise ValidationError({'q': 'This field is required.'})
+        if len(query) > settings.SEARCH_MAX_QUERY_LENGTH:
+            raise ValidationError({'q': f'Must have at most {settings.SEARCH_MAX_QUERY_LENGTH} characters'})
+        if search_type not in SEARCH_TYPES:
+            raise ValidationError({'type': f'Must be one of: {", ".join(SEARCH_TYPES)}'})
+
+        post_id = get_items.get('post_id')
+        if post_id is not None:
+            if search_type != COMMENTS:
+                raise ValidationError({'post_id': 'Only filters comments'})
+            if not post_id.isdigit():
+                raise ValidationError({'post_id': 'A valid integer is required.'})
+            post_id = int(post_id)
+
+        return Search(query, search_type, post_id)
+
+    def get_keyset_position(self, row):
+        return self.search.get_position(row)
+
+    """
+    Search posts, or comments with an optional post filter, ranked by relevance
+    """
+
+    def get(self, request):
+        self.search = self.get_search()
+        page = self.paginate_queryset(self.search)
+
+        return self.get_paginated_response(self.search.encode(page))
+
+
+class CacheStatsView(GenericAPIView):
+    authentication_classes = ()
+
+    """
+    Get counters of the in-process cache of this worker, and of the response cache
+    """
+
+    def get(self, request):
+        return Response({**local_cache.stats(), 'responses': response_cache_stats()})
+
+
+class MetricsView(GenericAPIView):
+    authentication_classes = ()
+
+    """
+    Get the metrics of the workers sharing METRICS_DIR, or of this worker, in Prometheus text format
+    """
 
-        return response
+    def get(self, request):
+        return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'seta_test.settings')
+os.environ['SETA_ASGI'] = '1'
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Models can only be imported once Django is set up
+from backend.live import LiveApplication
+
+application = LiveApplication(django_application)
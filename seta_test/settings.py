@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.MetricsMiddleware',
+    'backend.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,6 +62,10 @@ MIDDLEWARE = [
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.encoders.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 ROOT_URLCONF = 'seta_test.urls'
@@ -93,13 +100,54 @@ DATABASES = {
         'PASSWORD': postgres_pass,
         'HOST': host,
         'PORT': postgres_port,
-        'CONN_MAX_AGE': 0,
+        # Connections are kept by each worker thread for a minute and checked before being reused by a request.
+        # Under ASGI, queries run in a new thread for every request, so connections are closed after each request.
+        'CONN_MAX_AGE': 0 if os.environ.get('SETA_ASGI') else 60,
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'client_encoding': 'UTF-8',
+            'connect_timeout': 5,
         },
     }
 }
 
+# Read replicas of the primary, as host:port separated by commas, e.g. SETA_DB_REPLICAS=127.0.0.1:5433.
+# Tests read the primary through them.
+DATABASE_REPLICAS = []
+for index, address in enumerate(filter(None, os.environ.get('SETA_DB_REPLICAS', '').split(','))):
+    replica_host, _, replica_port = address.partition(':')
+    DATABASES[f'replica{index + 1}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or postgres_port,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index + 1}')
+
+DATABASE_ROUTERS = ['backend.routers.ReplicaRouter']
+
+# Seconds a client reads from the primary after a write
+REPLICA_PIN_SECONDS = 5
+
+# Seconds of lag above which a replica is not read
+REPLICA_MAX_LAG = 2
+
+# Seconds between two checks of the lag of a replica by a worker
+REPLICA_LAG_CHECK_INTERVAL = 5
+
+# Characters of a search query
+SEARCH_MAX_QUERY_LENGTH = 256
+
+# Last live comment events of a post kept for clients resuming with Last-Event-ID, and seconds they are kept
+LIVE_BACKLOG_SIZE = 1000
+LIVE_BACKLOG_TTL = 24 * 60 * 60
+
+# Events queued for a live watcher before it has to catch up from the backlog
+LIVE_QUEUE_SIZE = 100
+
+# Seconds between two heartbeats of an idle live stream
+LIVE_HEARTBEAT = 15
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -143,6 +191,57 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CRONJOBS = [
-    # Cronjob run daily to update total_comments in posts table
-    ('*/10 * * * *', 'backend.cron.update_total_comments', '>> ~/scheduled_job.log 2>&1')
+    # Cronjob run every minute to add new comments to total_comments in posts table
+    ('* * * * *', 'backend.cron.flush_comment_counts', '>> ~/scheduled_job.log 2>&1'),
+    # Cronjob run weekly to recount total_comments in posts table
+    ('0 4 * * 0', 'backend.cron.update_total_comments', '>> ~/scheduled_job.log 2>&1'),
 ]
+
+# Number of posts kept in the snapshot of each ranking and how many seconds it may lag behind the rankings
+HOT_SNAPSHOT_SIZE = 100
+HOT_SNAPSHOT_MAX_AGE = 5
+
+# In-process cache of each worker: maximum number of keys, seconds a ranking is kept and seconds a post is kept
+LOCAL_CACHE_MAX_SIZE = 1024
+LOCAL_CACHE_TTL = 1
+LOCAL_CACHE_POST_TTL = 300
+
+# Read endpoints encode values_list rows and write JSON with orjson instead of going through their serializers
+FAST_READ_SERIALIZATION = False
+
+# Maximum number of posts or comments created by a single bulk request
+BULK_CREATE_MAX_SIZE = 1000
+
+# Counter of the comments of posts: backend.counters.RedisCounter, PostgresCounter or MemoryCounter
+COMMENT_COUNTER_BACKEND = 'backend.counters.RedisCounter'
+# Counter rows of each post with PostgresCounter
+COMMENT_COUNTER_SHARDS = 16
+
+# Partitions of comments table created by the partition_comments command
+COMMENT_PARTITIONS = 16
+
+# Connections of a worker to redis, and seconds a command waits for a free one
+REDIS_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT = 0.5
+# Seconds to connect to redis and to wait for a reply, and idle seconds after which a connection is checked
+REDIS_CONNECT_TIMEOUT = 0.2
+REDIS_SOCKET_TIMEOUT = 0.5
+REDIS_HEALTH_CHECK_INTERVAL = 30
+# Redis is skipped for REDIS_BREAKER_COOLDOWN seconds after REDIS_BREAKER_FAILURES failures in a row
+REDIS_BREAKER_FAILURES = 5
+REDIS_BREAKER_COOLDOWN = 10
+
+# Shared cache of the rendered responses of posts and subtrees, bounded to RESPONSE_CACHE_MAX_BYTES of bodies.
+# Bodies bigger than RESPONSE_CACHE_MAX_ENTRY_BYTES are not cached.
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RESPONSE_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+# Seconds a worker may hold the lock of an entry to rebuild, and a worker without any entry waits for it
+RESPONSE_CACHE_LOCK_TIMEOUT = 10
+RESPONSE_CACHE_WAIT = 1
+
+# Directory shared by the workers of a host, emptied before they start, where each worker writes its metrics every
+# METRICS_WRITE_INTERVAL seconds, so /metrics adds up those of all the workers. Without it, /metrics returns the
+# metrics of the worker serving it.
+METRICS_DIR = os.environ.get('SETA_METRICS_DIR')
+METRICS_WRITE_INTERVAL = 1
@@ -15,6 +15,9 @@ Including another URLconf
 """
 from django.urls import path, include
 
+from backend import views
+
 urlpatterns = [
     path('api/v1/', include('backend.urls')),
+    path('metrics', views.MetricsView.as_view()),
 ]